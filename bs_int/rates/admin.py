@@ -1,15 +1,69 @@
-import zipfile
-from io import BytesIO
+import hashlib
+import os
+import shutil
+from tempfile import SpooledTemporaryFile
 
+from django.conf import settings
 from django.contrib import admin
-from django.http import HttpResponse
-from rates.models import Excel, TreasuryData
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils.functional import cached_property
+from rates import workers
+from rates.exports import (
+    EXPORT_CHUNK_SIZE,
+    EXPORT_SPOOL_SIZE,
+    csv_files,
+    export_cache,
+    export_filename,
+    export_key,
+    export_rows,
+    stream_long_csv,
+    stream_zip,
+    write_excel,
+    write_npz,
+)
+from rates.jobs import submit_export
+from rates.models import ExportJob, TreasuryData, treasury_generation
+
+CHANGELIST_COUNT_TIMEOUT = 60 * 60
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator whose COUNT(*) is kept in the cache until the table changes."""
+
+    @cached_property
+    def count(self):
+        query = str(self.object_list.query).encode("utf-8")
+        key = (
+            f"rates:changelist-count:{treasury_generation()}:"
+            f"{hashlib.sha256(query).hexdigest()}"
+        )
+        return cache.get_or_set(
+            key, lambda: Paginator.count.func(self), CHANGELIST_COUNT_TIMEOUT
+        )
 
 
 # Register your models here.
 @admin.register(TreasuryData)
 class DataSetAdmin(admin.ModelAdmin):
     ordering = ("-date",)
+    list_display = (
+        "date",
+        "two_year",
+        "ten_year",
+        "thirty_year",
+        "ten_two_spread",
+        "inverted",
+        "thirty_year_zero",
+    )
+    list_filter = ("inverted",)
+    date_hierarchy = "date"
+    paginator = CachedCountPaginator
+    show_full_result_count = False
     readonly_fields = (
         "one_year",
         "two_year",
@@ -24,65 +78,129 @@ class DataSetAdmin(admin.ModelAdmin):
     actions = (
         "download_excel",
         "download_csv",
+        "download_long_csv",
+        "download_npz",
     )
 
     view_on_site = False
 
     @admin.action(description="Download CSV")
     def download_csv(self, request, queryset):
-        tdatas = list(queryset.order_by("date"))
+        if queryset.count() > settings.EXPORT_JOB_MIN_DATES:
+            return self._queue_export(queryset, ExportJob.Format.CSV)
+        queryset = queryset.select_related("stored_curve").order_by("date")
+        first = queryset.first()
+        last = queryset.last()
 
-        if len(tdatas) == 1:
-            filename = f"curve_{tdatas[0].date.year}-{tdatas[0].date.month}-{tdatas[0].date.day}"
+        if first == last:
+            filename = self._filename([first])
 
             response = HttpResponse(content_type="text/csv")
             response["Content-Disposition"] = f"attachment; filename={filename}.csv"
-            response.write(tdatas[0].to_csv().read())
+            response.write(first.to_csv().read())
         else:
-            io = BytesIO()
+            zip_filename = self._filename([first, last])
 
-            with zipfile.ZipFile(io, "w") as zf:
-                for tdata in tdatas:
-                    filename = self._filename(tdata)
-                    zf.writestr(f"{filename}.csv", tdata.to_csv().read())
-
-            zip_filename = self._filename(tdatas)
-
-            response = HttpResponse(content_type="application/x-zip-compressed")
-            response.write(io.getvalue())
+            key = export_key(ExportJob.Format.CSV, export_rows(queryset))
+            output = export_cache.get(key, ExportJob.Format.CSV)
+            if output is not None:
+                response = FileResponse(
+                    output, content_type="application/x-zip-compressed"
+                )
+            else:
+                # Zipped as it is sent, and cached once the last chunk has been
+                files = csv_files(queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE))
+                response = StreamingHttpResponse(
+                    export_cache.tee(key, ExportJob.Format.CSV, stream_zip(files)),
+                    content_type="application/x-zip-compressed",
+                )
             response["Content-Disposition"] = f"attachment; filename={zip_filename}.zip"
         return response
 
-    @staticmethod
-    def _filename(tdatas):
-        try:
-            if len(tdatas) == 1:
-                filename = f"curve_{tdatas[0].date.year}-{tdatas[0].date.month}-{tdatas[0].date.day}"
-            else:
-                filename = (
-                    f"curve_{tdatas[0].date.year}.{tdatas[0].date.month}.{tdatas[0].date.day}"
-                    f"-{tdatas[-1].date.year}.{tdatas[-1].date.month}.{tdatas[-1].date.day}"
-                )
-        except Exception:
-            filename = f"curve_{tdatas.date.year}-{tdatas.date.month}-{tdatas.date.day}"
+    @admin.action(description="Download CSV (long format)")
+    def download_long_csv(self, request, queryset):
+        if queryset.count() > settings.EXPORT_JOB_MIN_DATES:
+            return self._queue_export(queryset, ExportJob.Format.LONG_CSV)
+        queryset = queryset.select_related("stored_curve").order_by("date")
+        filename = self._filename([queryset.first(), queryset.last()])
 
-        return filename
+        response = StreamingHttpResponse(
+            stream_long_csv(queryset), content_type="text/csv"
+        )
+        response["Content-Disposition"] = f"attachment; filename={filename}.csv"
+        return response
 
-    @admin.action(description="Download Excel")
-    def download_excel(self, request, queryset):
-        excel = Excel()
+    @admin.action(description="Download NumPy arrays (.npz)")
+    def download_npz(self, request, queryset):
+        if queryset.count() > settings.EXPORT_JOB_MIN_DATES:
+            return self._queue_export(queryset, ExportJob.Format.NPZ)
+        queryset = queryset.order_by("date")
+        filename = self._filename([queryset.first(), queryset.last()])
 
-        tdatas = list(queryset.order_by("date"))
-        for tdata in tdatas:
-            excel.add_sheet(tdata)
+        output = SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+        write_npz(queryset, output)
+        output.seek(0)
 
-        output = excel.stream()
+        response = FileResponse(output, content_type="application/octet-stream")
+        response["Content-Disposition"] = f"attachment; filename={filename}.npz"
+        return response
 
-        filename = self._filename(tdatas)
+    _filename = staticmethod(export_filename)
+
+    def _queue_export(self, queryset, format):
+        job = submit_export(queryset, format)
+        return redirect("admin:rates_treasurydata_export", token=job.token)
+
+    def get_urls(self):
+        return [
+            path(
+                "exports/<str:token>/",
+                self.admin_site.admin_view(self.export_view),
+                name="rates_treasurydata_export",
+            ),
+            *super().get_urls(),
+        ]
+
+    def export_view(self, request, token):
+        """Page polling a queued export until its download link is ready."""
+        job = get_object_or_404(ExportJob, token=token)
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": f"Export {job.download_filename}",
+            "job": job,
+            "status_url": reverse("rates:export-status", args=[token]),
+        }
+        return TemplateResponse(
+            request, "admin/rates/treasurydata/export_job.html", context
+        )
 
-        response = HttpResponse(content_type="application/vnd.ms-excel")
+    @admin.action(description="Download Excel")
+    def download_excel(self, request, queryset):
+        if queryset.count() > settings.EXPORT_JOB_MIN_DATES:
+            return self._queue_export(queryset, ExportJob.Format.EXCEL)
+        queryset = queryset.order_by("date")
+        rows = export_rows(queryset)
+
+        def build(output):
+            path = workers.run(
+                write_excel, settings.EXCEL_EXPORT_ENGINE, [row[0] for row in rows]
+            )
+            try:
+                with open(path, "rb") as f:
+                    shutil.copyfileobj(f, output)
+            finally:
+                os.unlink(path)
+
+        key = export_key(ExportJob.Format.EXCEL, rows)
+        output = export_cache.get_or_build(key, ExportJob.Format.EXCEL, build)
+
+        first = queryset.first()
+        last = queryset.last()
+        filename = self._filename([first] if first == last else [first, last])
+
+        response = FileResponse(output, content_type="application/vnd.ms-excel")
         response["Content-Disposition"] = f"attachment; filename={filename}.xlsx"
-        response.write(output.getvalue())
         return response
 
     def change_view(self, request, object_id, form_url="", extra_context=None):
@@ -0,0 +1,191 @@
+import functools
+import hashlib
+import math
+import time
+from datetime import date
+
+from dateutil.parser import parse
+from django.conf import settings
+from django.core.cache import cache
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseForbidden,
+    JsonResponse,
+)
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_GET
+from rates.models import DataRow, TreasuryData, get_curve_engine
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+DEFAULT_API_THROTTLE_RATE = 120
+DEFAULT_API_THROTTLE_WINDOW = 60
+
+# The published par rates only; the summary columns are for the admin
+RATE_FIELDS = tuple(
+    maturity.name
+    for maturity in (*TreasuryData._bill_order, *TreasuryData._maturity_order)
+)
+CURVE_FIELDS = DataRow._fields[1:]
+
+
+def _throttled(user):
+    """Seconds until `user` may call the API again, or 0 if they may now.
+
+    Counted per user in fixed windows in the default cache, so every process
+    shares the count.
+    """
+    rate = getattr(settings, "API_THROTTLE_RATE", DEFAULT_API_THROTTLE_RATE)
+    window = getattr(settings, "API_THROTTLE_WINDOW", DEFAULT_API_THROTTLE_WINDOW)
+    now = time.time()
+    key = f"rates-api-throttle:{user.pk}:{int(now // window)}"
+
+    cache.add(key, 0, timeout=window)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        # Evicted since it was added
+        cache.set(key, 1, timeout=window)
+        count = 1
+    if count <= rate:
+        return 0
+    return math.ceil(window - now % window)
+
+
+def _api_view(view):
+    """Serve `view` to active logged in users, throttled per user."""
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        user = request.user
+        if not (user.is_authenticated and user.is_active):
+            return HttpResponseForbidden("Log in to use the API")
+
+        retry_after = _throttled(user)
+        if retry_after:
+            response = HttpResponse("Too many requests", status=429)
+            response["Retry-After"] = str(retry_after)
+            return response
+        return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def _fields(request, allowed):
+    if not request.GET.get("fields"):
+        return allowed
+
+    fields = request.GET["fields"].split(",")
+    unknown = set(fields).difference(allowed)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(field for field in allowed if field in fields)
+
+
+def _etag(*parts):
+    return quote_etag(hashlib.sha256(repr(parts).encode("utf-8")).hexdigest())
+
+
+def _conditional_json(request, etag, payload):
+    """JSON response built by `payload()` unless the client's copy is current."""
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(payload())
+        response["ETag"] = etag
+
+    # Clients may keep responses but have to revalidate them on every use;
+    # shared caches may not, as the API needs a login
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@require_GET
+@_api_view
+def treasury_list(request):
+    """Par rates ordered by date, a page at a time.
+
+    Pages are keyed on the last date seen (`?after=`) rather than an offset,
+    so each page is an index range scan however deep the client pages.
+    """
+    try:
+        fields = _fields(request, RATE_FIELDS)
+        limit = int(request.GET.get("limit", DEFAULT_PAGE_SIZE))
+        after = request.GET.get("after")
+        after = parse(after).date() if after else None
+    except (ValueError, OverflowError) as e:
+        return HttpResponseBadRequest(f"Invalid request: {e}")
+
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        return HttpResponseBadRequest(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+    queryset = TreasuryData.objects.order_by("date")
+    if after is not None:
+        queryset = queryset.filter(date__gt=after)
+    rows = list(queryset.values_list("date", *fields)[: limit + 1])
+
+    next_url = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        params = request.GET.copy()
+        params["after"] = rows[-1][0].isoformat()
+        next_url = f"{request.path}?{params.urlencode()}"
+
+    def payload():
+        return {
+            "results": [dict(zip(("date", *fields), row)) for row in rows],
+            "next": next_url,
+        }
+
+    return _conditional_json(request, _etag(fields, rows, next_url), payload)
+
+
+@require_GET
+@_api_view
+def curve_detail(request, date_str):
+    """Monthly curve for one date, as parallel columns keyed by field.
+
+    `?method=` picks the interpolation method, see rates.curves.CURVE_ENGINES.
+    """
+    try:
+        curve_date = date.fromisoformat(date_str)
+    except ValueError:
+        raise Http404(f"Invalid date {date_str}")
+
+    try:
+        fields = _fields(request, CURVE_FIELDS)
+        engine = get_curve_engine(request.GET.get("method"))
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    maturities = TreasuryData._input_maturities(engine.bill_months)
+    tdata = get_object_or_404(
+        TreasuryData.objects.select_related("stored_curve").only(
+            "date",
+            *(maturity.name for maturity in maturities),
+            "stored_curve__version",
+            "stored_curve__data",
+        ),
+        date=curve_date,
+    )
+
+    def payload():
+        rows = tdata.get_row_data(engine.method)
+        columns = {field: [getattr(row, field) for row in rows] for field in fields}
+        # Only the knot maturities have a par rate
+        if "par" in columns:
+            columns["par"] = [None if par == "" else par for par in columns["par"]]
+        return {
+            "date": tdata.date,
+            "version": engine.version,
+            "months": [row.months for row in rows],
+            **columns,
+        }
+
+    etag = _etag(
+        tdata.date, engine.version, tdata.par_values(engine.bill_months), fields
+    )
+    return _conditional_json(request, etag, payload)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class RatesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "rates"
+
+    def ready(self):
+        # Connects the receiver that appends newly stored curves to the history
+        from rates import history  # noqa: F401
@@ -0,0 +1,330 @@
+"""
+Ingest, compute and export benchmarks.
+
+These are not collected by the regular test run. Run them explicitly with:
+    pytest rates/benchmarks.py -s
+
+Every benchmark reports wall time and tracemalloc peak memory. Environment
+variables control the run:
+    BENCHMARK_MAX_DATES  largest date count to run (default 250, up to 2500)
+    BENCHMARK_SAVE       set to 1 to record the results as the new baseline
+    BENCHMARK_BASELINE   baseline file (default rates/benchmark_baseline.json)
+    BENCHMARK_THRESHOLD  allowed slowdown/growth over the baseline (default 1.5)
+
+Baselines are machine specific, so they are not checked in. Record one on a
+quiet machine before a change and compare against it afterwards.
+"""
+
+import csv
+import json
+import os
+import shutil
+import time
+import tracemalloc
+from datetime import date, timedelta
+from io import StringIO
+from pathlib import Path
+
+import pytest
+from dateutil.parser import parse
+from rates.models import (
+    Excel,
+    TreasuryCurve,
+    TreasuryData,
+    WriteOnlyExcel,
+    curve_cache,
+    curve_engines,
+    parse_treasury_table,
+    template_cache,
+)
+from rates.tests import MOCK_DATA
+
+DATE_COUNTS = (1, 30, 250, 2500)
+MAX_DATES = int(os.environ.get("BENCHMARK_MAX_DATES", 250))
+BASELINE_FILE = Path(
+    os.environ.get(
+        "BENCHMARK_BASELINE", Path(__file__).with_name("benchmark_baseline.json")
+    )
+)
+SAVE_BASELINE = os.environ.get("BENCHMARK_SAVE") == "1"
+THRESHOLD = float(os.environ.get("BENCHMARK_THRESHOLD", 1.5))
+# Quick benchmarks are repeated up to MAX_ROUNDS times, keeping the best time
+MIN_ROUNDS_SECONDS = 1
+MAX_ROUNDS = 5
+
+date_counts = pytest.mark.parametrize(
+    "count",
+    [
+        pytest.param(
+            count,
+            marks=pytest.mark.skipif(
+                count > MAX_DATES, reason=f"BENCHMARK_MAX_DATES={MAX_DATES}"
+            ),
+        )
+        for count in DATE_COUNTS
+    ],
+)
+
+
+@pytest.fixture(autouse=True)
+def offline(mock_get, settings, tmp_path):
+    settings.TREASURY_CACHE_DIR = tmp_path / "treasury_cache"
+    settings.TREASURY_FETCHER = "rates.treasury.HTTPFetcher"
+    settings.CURVE_HISTORY_DIR = tmp_path / "curve_history"
+    settings.MEDIA_ROOT = tmp_path / "media"
+    settings.EXPORT_CACHE_DIR = tmp_path / "export_cache"
+    settings.STORE_CHARTS = False
+
+
+@pytest.fixture(scope="module")
+def baseline():
+    try:
+        stored = json.loads(BASELINE_FILE.read_text())
+    except FileNotFoundError:
+        stored = {}
+
+    results = {}
+    yield stored, results
+
+    if SAVE_BASELINE and results:
+        BASELINE_FILE.write_text(
+            json.dumps({**stored, **results}, indent=2, sort_keys=True)
+        )
+        print(f"\nSaved {len(results)} results to {BASELINE_FILE}")
+
+
+@pytest.fixture
+def check(baseline, request):
+    """Report a result and compare it with the stored baseline."""
+    stored, results = baseline
+
+    def check(elapsed, peak):
+        name = request.node.name
+        report(name, elapsed, peak)
+        results[name] = {"seconds": elapsed, "peak": peak}
+
+        expected = stored.get(name)
+        if expected is None or SAVE_BASELINE:
+            return
+        assert (
+            elapsed <= expected["seconds"] * THRESHOLD
+        ), f"{name} took {elapsed:.3f}s, baseline {expected['seconds']:.3f}s"
+        assert (
+            peak <= expected["peak"] * THRESHOLD
+        ), f"{name} peaked at {peak} bytes, baseline {expected['peak']} bytes"
+
+    return check
+
+
+def synthetic_tdatas(count):
+    header, *lines = MOCK_DATA.splitlines()
+    columns = [column.strip('"') for column in header.split(",")[1:]]
+
+    tdatas = []
+    for idx in range(count):
+        values = lines[idx % len(lines)].split(",")[1:]
+        shift = (idx // len(lines)) * 0.01
+        tdatas.append(
+            TreasuryData(
+                date=date(2000, 1, 1) + timedelta(days=idx),
+                **{
+                    TreasuryData._treasury_map[column]: float(value) + shift
+                    for column, value in zip(columns, values)
+                },
+            )
+        )
+    return tdatas
+
+
+def stored_tdatas(count):
+    TreasuryData.objects.bulk_create(synthetic_tdatas(count))
+    queryset = TreasuryData.objects.order_by("date")
+    TreasuryCurve.store(queryset)
+    return list(queryset.select_related("stored_curve"))
+
+
+def measure(func, *args):
+    # tracemalloc slows allocation heavy code down considerably, so time and
+    # peak memory come from separate runs.
+    elapsed = None
+    total = 0
+    for _ in range(MAX_ROUNDS):
+        start = time.perf_counter()
+        result = func(*args)
+        duration = time.perf_counter() - start
+
+        elapsed = duration if elapsed is None else min(elapsed, duration)
+        total += duration
+        if total >= MIN_ROUNDS_SECONDS:
+            break
+
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def report(name, elapsed, peak):
+    print(f"\n{name}: {elapsed * 1000:.1f} ms, peak {peak / 1024 / 1024:.1f} MiB")
+
+
+def row_data(tdatas):
+    return [tdata.get_row_data() for tdata in tdatas]
+
+
+def to_csv(tdatas):
+    return [tdata.to_csv() for tdata in tdatas]
+
+
+def generate_chart(tdatas):
+    for tdata in tdatas:
+        tdata.generate_chart()
+
+
+def export_excel(engine, tdatas):
+    excel = engine()
+    for tdata in tdatas:
+        excel.add_sheet(tdata)
+    return excel.stream()
+
+
+@pytest.mark.django_db
+@date_counts
+@pytest.mark.parametrize("path", (row_data, to_csv, generate_chart))
+def test_curve_paths(path, count, check):
+    tdatas = stored_tdatas(count)
+
+    _, elapsed, peak = measure(path, tdatas)
+
+    check(elapsed, peak)
+
+
+@date_counts
+@pytest.mark.parametrize("method", sorted(curve_engines))
+def test_curve_methods(method, count, check):
+    # One batched compute, as used by the exports and history
+    tdatas = synthetic_tdatas(count)
+
+    curve, elapsed, peak = measure(TreasuryData.batch_curves, tdatas, method)
+
+    check(elapsed, peak)
+    assert curve.zero.shape == (count, len(curve_engines[method].months))
+
+
+@date_counts
+@pytest.mark.parametrize("method", sorted(curve_engines))
+def test_curve_method_rows(method, count, check):
+    # Per-date row data, the first call computing and the rest hitting the cache
+    tdatas = synthetic_tdatas(count)
+    curve_cache.clear()
+
+    _, elapsed, peak = measure(lambda: [tdata.get_row_data(method) for tdata in tdatas])
+
+    check(elapsed, peak)
+
+
+@pytest.mark.django_db
+@date_counts
+@pytest.mark.parametrize("engine", (Excel, WriteOnlyExcel))
+def test_excel_export(engine, count, check):
+    tdatas = stored_tdatas(count)
+    template_cache.layout()
+
+    output, elapsed, peak = measure(export_excel, engine, tdatas)
+
+    check(elapsed, peak)
+    assert output.read(2) == b"PK"
+
+
+@pytest.mark.django_db
+@date_counts
+@pytest.mark.parametrize(
+    "action", ("download_csv", "download_long_csv", "download_npz", "download_excel")
+)
+def test_admin_download(action, count, admin_client, settings, check):
+    # Built inside the request, not queued as an ExportJob
+    settings.EXPORT_JOB_MIN_DATES = count
+    pks = [tdata.pk for tdata in stored_tdatas(count)]
+
+    def download():
+        # Measure building the export rather than rates.exports.ExportCache
+        shutil.rmtree(settings.EXPORT_CACHE_DIR, ignore_errors=True)
+        response = admin_client.post(
+            "/admin/rates/treasurydata/",
+            {"action": action, "_selected_action": pks},
+        )
+        assert response.status_code == 200
+        if response.streaming:
+            return sum(len(chunk) for chunk in response.streaming_content)
+        return len(response.content)
+
+    size, elapsed, peak = measure(download)
+
+    check(elapsed, peak)
+    assert size
+
+
+@pytest.mark.django_db
+@date_counts
+@pytest.mark.parametrize("action", ("download_csv", "download_excel"))
+def test_admin_download_cached(action, count, admin_client, settings, check):
+    settings.EXPORT_JOB_MIN_DATES = count
+    pks = [tdata.pk for tdata in stored_tdatas(count)]
+
+    def download():
+        response = admin_client.post(
+            "/admin/rates/treasurydata/",
+            {"action": action, "_selected_action": pks},
+        )
+        assert response.status_code == 200
+        if response.streaming:
+            return sum(len(chunk) for chunk in response.streaming_content)
+        return len(response.content)
+
+    # The first download fills the cache
+    download()
+    size, elapsed, peak = measure(download)
+
+    check(elapsed, peak)
+    assert size
+
+
+def synthetic_treasury_csv(count):
+    header, *lines = MOCK_DATA.splitlines()
+    rows = [header]
+    for idx in range(count):
+        row_date = date(2000, 1, 1) + timedelta(days=idx)
+        values = lines[idx % len(lines)].split(",")[1:]
+        rows.append(",".join([row_date.strftime("%m/%d/%Y"), *values]))
+    return "\n".join(rows)
+
+
+def dictreader_lookup(content, lookup_date):
+    # The DictReader and dateutil parse loop parse_treasury_table replaced
+    for row in csv.DictReader(StringIO(content)):
+        data_date = parse(row.pop("Date")).date()
+        if data_date == lookup_date:
+            return {
+                TreasuryData._treasury_map[key]: float(val) if val != "" else None
+                for key, val in row.items()
+            }
+
+
+def table_lookup(content, lookup_date):
+    parse_treasury_table.cache_clear()
+    return parse_treasury_table(content).row(lookup_date)
+
+
+@pytest.mark.parametrize("parser", (dictreader_lookup, table_lookup))
+def test_parse_treasury_csv(parser, check):
+    # A year of business days, looking up the last row
+    content = synthetic_treasury_csv(250)
+    lookup_date = date(2000, 1, 1) + timedelta(days=249)
+
+    row, elapsed, peak = measure(parser, content, lookup_date)
+
+    check(elapsed, peak)
+    assert row == table_lookup(content, lookup_date)
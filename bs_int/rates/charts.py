@@ -0,0 +1,139 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from rates.metrics import timed
+
+logger = logging.getLogger(__file__)
+
+CHART_TITLE = "Continuous Monthly Zero Rates"
+CHART_DPI = 100
+DEFAULT_CHART_SIZE = (640, 480)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+@timed("chart_render")
+def render_chart(months, zero, format="png"):
+    """Render a zero curve without touching pyplot's global state."""
+    figure, ax = _figure(DEFAULT_CHART_SIZE)
+    ax.scatter(months, zero * 100)
+    return _save(figure, format)
+
+
+@timed("chart_render")
+def render_curves(curves, format="png", size=DEFAULT_CHART_SIZE):
+    """Render the zero curve and par knots of each (label, Curve) pair."""
+    figure, ax = _figure(size)
+    for label, curve in curves:
+        knots = ~np.isnan(curve.par)
+        zero_points = ax.scatter(
+            curve.months, curve.zero * 100, s=4, label=f"{label} zero"
+        )
+        ax.plot(
+            curve.months[knots],
+            curve.par[knots] * 100,
+            "o--",
+            color=zero_points.get_facecolor()[0],
+            label=f"{label} par",
+        )
+
+    if len(curves) > 1:
+        ax.legend(fontsize="small")
+    return _save(figure, format)
+
+
+def _figure(size):
+    width, height = size
+    figure = Figure(figsize=(width / CHART_DPI, height / CHART_DPI), dpi=CHART_DPI)
+    FigureCanvasAgg(figure)
+
+    ax = figure.add_subplot()
+    ax.set_title(CHART_TITLE)
+    ax.set_xlabel("Months")
+    ax.set_ylabel("Interest Rates (%)")
+    ax.grid(True)
+    return figure, ax
+
+
+def _save(figure, format):
+    output = BytesIO()
+    figure.savefig(output, format=format)
+    return output.getvalue()
+
+
+class RenderCache:
+    """Thread-safe LRU of rendered chart bytes."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        return None
+
+    def put(self, key, content):
+        with self._lock:
+            self._entries[key] = content
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_render(self, key, render):
+        content = self.get(key)
+        if content is None:
+            content = render()
+            self.put(key, content)
+        return content
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _get_executor():
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="rates-charts"
+            )
+        return _executor
+
+
+def schedule_render(func, *args):
+    """Call `func(*args)` once the current transaction commits.
+
+    With CHART_RENDER_ASYNC the call runs on a background thread so the
+    request that saved the row does not wait for the render.
+    """
+
+    def render():
+        if getattr(settings, "CHART_RENDER_ASYNC", True):
+            _get_executor().submit(_render_in_background, func, *args)
+        else:
+            func(*args)
+
+    transaction.on_commit(render)
+
+
+def _render_in_background(func, *args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception(f"Unable to render chart {args}")
+    finally:
+        close_old_connections()
@@ -0,0 +1,12 @@
+import pytest
+from rates.tests import MOCK_DATA
+
+
+@pytest.fixture
+def mock_get(mocker):
+    """requests.get answering every Treasury download with MOCK_DATA."""
+    mock_get = mocker.patch("rates.treasury.requests.get")
+    mock_get.return_value.status_code = 200
+    mock_get.return_value.content = MOCK_DATA.encode("utf-8")
+    mock_get.return_value.headers = {}
+    return mock_get
@@ -0,0 +1,443 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+from rates.metrics import timed
+
+CURVE_MIN_MONTH = 12
+CURVE_MAX_MONTH = 360
+
+Curve = namedtuple("Curve", "months,par,zero,zero_rate,df,ln_df")
+
+# Columns persisted by rates.models.TreasuryCurve, in storage order
+STORED_COLUMNS = ("par", "zero", "zero_rate", "df", "ln_df")
+
+# Curve engine classes by method name, see register_engine
+CURVE_ENGINES = {}
+
+
+def register_engine(cls):
+    CURVE_ENGINES[cls.method] = cls
+    return cls
+
+
+@register_engine
+class CurveEngine:
+    """Monthly zero curves from semiannual par yields.
+
+    Discount factors are interpolated log-linearly between the knot
+    maturities. `compute` accepts either one curve (8 par rates) or a batch
+    (N dates x 8 par rates) and returns a Curve of NumPy arrays whose last
+    axis is `months`.
+
+    Subclasses registered with `register_engine` provide other
+    interpolation methods by overriding `_prepare` (work that only depends
+    on the knots and the month grid) and `interpolate`.
+    """
+
+    method = "log_linear"
+    revision = 1
+    # Maturities below the knots that are passed to `compute` ahead of them
+    bill_months = ()
+
+    def __init__(
+        self, knot_months, min_month=CURVE_MIN_MONTH, max_month=CURVE_MAX_MONTH
+    ):
+        self.knot_months = np.asarray(knot_months, dtype=np.float64)
+        self.months = np.arange(min_month, max_month + 1)
+        self.knot_index = np.searchsorted(self.months, self.knot_months)
+
+        # Interpolation weights only depend on the grid, so they are shared by
+        # every curve the engine computes.
+        self._prepare()
+
+    def _prepare(self):
+        self._segment, self._weight = _linear_weights(self.knot_months, self.months)
+
+    def knot_ln_df(self, par):
+        return -(self.knot_months / 6) * np.log1p(par / 2)
+
+    def interpolate(self, knot_ln_df):
+        """ln(DF) on the month grid from ln(DF) at the knots."""
+        left = knot_ln_df[..., self._segment]
+        right = knot_ln_df[..., self._segment + 1]
+        return left + self._weight * (right - left)
+
+    @property
+    def version(self):
+        return f"{self.method}-{self.revision}"
+
+    def pack(self, curve):
+        """Serialize every curve of a batch to one float64 blob per date."""
+        columns = np.stack(
+            [getattr(curve, column) for column in STORED_COLUMNS], axis=-2
+        )
+        return [row.tobytes() for row in columns.reshape(-1, *columns.shape[-2:])]
+
+    def unpack(self, data):
+        columns = np.frombuffer(data, dtype=np.float64).reshape(
+            len(STORED_COLUMNS), len(self.months)
+        )
+        return Curve(months=self.months, **dict(zip(STORED_COLUMNS, columns)))
+
+    @timed("curve_compute")
+    def compute(self, par_rates):
+        par = np.asarray(par_rates, dtype=np.float64) / 100
+        ln_df = self.interpolate(self.knot_ln_df(par))
+
+        df = np.exp(ln_df)
+        zero_rate = np.expm1(-ln_df / self.months)
+        zero = np.expm1(-12 * ln_df / self.months)
+
+        par_column = np.full(ln_df.shape, np.nan)
+        par_column[..., self.knot_index] = par[..., len(self.bill_months) :]
+
+        return Curve(
+            months=self.months,
+            par=par_column,
+            zero=zero,
+            zero_rate=zero_rate,
+            df=df,
+            ln_df=ln_df,
+        )
+
+
+@register_engine
+class CubicSplineEngine(CurveEngine):
+    """Natural cubic spline through the continuously compounded knot zero rates.
+
+    A natural spline is linear in the knot values, so `_prepare` solves the
+    spline system once for the grid and every curve is a single matrix
+    product.
+    """
+
+    method = "cubic_spline"
+    revision = 1
+
+    def _prepare(self):
+        knots = self.knot_months
+        count = len(knots)
+        widths = np.diff(knots)
+
+        # Second derivatives M = solve(A, B @ y), with M = 0 at both ends
+        system = np.zeros((count, count))
+        rhs = np.zeros((count, count))
+        system[0, 0] = system[-1, -1] = 1
+        for idx in range(1, count - 1):
+            system[idx, idx - 1] = widths[idx - 1] / 6
+            system[idx, idx] = (widths[idx - 1] + widths[idx]) / 3
+            system[idx, idx + 1] = widths[idx] / 6
+            rhs[idx, idx - 1] = 1 / widths[idx - 1]
+            rhs[idx, idx] = -1 / widths[idx - 1] - 1 / widths[idx]
+            rhs[idx, idx + 1] = 1 / widths[idx]
+        second = np.linalg.solve(system, rhs)
+
+        segment = np.searchsorted(knots, self.months, side="right") - 1
+        segment = np.clip(segment, 0, count - 2)
+        width = widths[segment]
+        b = (self.months - knots[segment]) / width
+        a = 1 - b
+
+        rows = np.arange(len(self.months))
+        weights = np.zeros((len(self.months), count))
+        weights[rows, segment] += a
+        weights[rows, segment + 1] += b
+        weights += ((a**3 - a) * width**2 / 6)[:, None] * second[segment]
+        weights += ((b**3 - b) * width**2 / 6)[:, None] * second[segment + 1]
+        self._weights = weights.T
+
+    def interpolate(self, knot_ln_df):
+        zero = -knot_ln_df / self.knot_months
+        return -(zero @ self._weights) * self.months
+
+
+@register_engine
+class MonotoneConvexEngine(CurveEngine):
+    """Hagan and West's monotone convex interpolation.
+
+    Instantaneous forwards are continuous, and positive wherever the discrete
+    forwards between the knots are. The month grid's interval positions are
+    fixed in `_prepare`; the per-curve work is a handful of vectorised
+    expressions over all dates and months at once.
+    """
+
+    method = "monotone_convex"
+    revision = 2
+
+    def _prepare(self):
+        self._times = np.concatenate(([0.0], self.knot_months))
+        widths = np.diff(self._times)
+
+        # Forward at inner knot i as a width weighted mean of the discrete
+        # forwards either side of it
+        self._left_weight = widths[1:] / (widths[:-1] + widths[1:])
+        self._right_weight = widths[:-1] / (widths[:-1] + widths[1:])
+
+        self._interval = np.searchsorted(self._times, self.months, side="left")
+        self._start = self._times[self._interval - 1]
+        self._width = widths[self._interval - 1]
+        self._x = (self.months - self._start) / self._width
+
+    def interpolate(self, knot_ln_df):
+        # r(t) * t at the knots, starting from 0 at t = 0
+        area = np.concatenate(
+            (np.zeros(knot_ln_df.shape[:-1] + (1,)), -knot_ln_df), axis=-1
+        )
+        discrete = np.diff(area, axis=-1) / np.diff(self._times)
+
+        inner = (
+            self._left_weight * discrete[..., :-1]
+            + self._right_weight * discrete[..., 1:]
+        )
+        first = discrete[..., :1] - (inner[..., :1] - discrete[..., :1]) / 2
+        last = discrete[..., -1:] - (inner[..., -1:] - discrete[..., -1:]) / 2
+        forwards = np.concatenate((first, inner, last), axis=-1)
+
+        # Hagan and West's collar: with each knot forward between 0 and twice
+        # the smaller discrete forward beside it, g never takes an interval's
+        # forwards below 0 unless its discrete forward is negative
+        collar = 2 * np.concatenate(
+            (
+                discrete[..., :1],
+                np.minimum(discrete[..., :-1], discrete[..., 1:]),
+                discrete[..., -1:],
+            ),
+            axis=-1,
+        )
+        forwards = np.maximum(np.minimum(forwards, collar), 0)
+
+        # The integral of g over each interval is a cubic in x on either side
+        # of a break point, so the grid months only need one polynomial each
+        interval = self._interval - 1
+        fd = discrete[..., interval]
+        g0 = forwards[..., :-1] - discrete
+        g1 = forwards[..., 1:] - discrete
+        breaks, left, right = _monotone_convex_cubics(g0, g1)
+
+        # x is in (0, 1], so a break at 0 or 1 never picks the empty side
+        x = self._x
+        coefficients = np.where(
+            (x <= breaks[..., interval])[..., None],
+            left[..., interval, :],
+            right[..., interval, :],
+        )
+        integral = coefficients[..., 3] * x + coefficients[..., 2]
+        integral = integral * x + coefficients[..., 1]
+        integral = integral * x + coefficients[..., 0]
+
+        area_t = area[..., interval] + fd * (self.months - self._start)
+        return -(area_t + self._width * integral)
+
+
+def _monotone_convex_cubics(g0, g1):
+    """Hagan and West's integrated forward adjustment as piecewise cubics.
+
+    Returns the break point of every interval and the x**0..x**3
+    coefficients before and after it.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Zones 2 to 4 share one shape: a level plus a cubic bend towards g0
+        # before the break and towards g1 after it. Zone 2 stays level up to
+        # its break and zone 3 after it.
+        zone2 = (g1 + 2 * g0) / (g1 - g0), g0, g0, g1
+        zone3 = 3 * g1 / (g1 - g0), g1, g0, g1
+        eta4 = g1 / (g1 + g0)
+        zone4 = eta4, -g0 * g1 / (g0 + g1), g0, g1
+
+        in_zone1 = ((g0 < 0) & (-g0 / 2 <= g1) & (g1 <= -2 * g0)) | (
+            (g0 > 0) & (-g0 / 2 >= g1) & (g1 >= -2 * g0)
+        )
+        in_zone2 = ((g0 < 0) & (g1 > -2 * g0)) | ((g0 > 0) & (g1 < -2 * g0))
+        in_zone3 = ((g0 > 0) & (0 > g1) & (g1 > -g0 / 2)) | (
+            (g0 < 0) & (0 < g1) & (g1 < -g0 / 2)
+        )
+        flat = (g0 == 0) & (g1 == 0)
+        conditions = [flat | in_zone1, in_zone2, in_zone3]
+
+        eta, level, start, end = (
+            np.select(conditions, [1, *choices], default)
+            for *choices, default in zip(zone2, zone3, zone4)
+        )
+        bend = (start - level) / 3
+        tail = (end - level) / (3 * (1 - eta) ** 2)
+
+        left = np.stack(
+            (
+                np.zeros_like(eta),
+                level + 3 * bend,
+                -3 * bend / eta,
+                bend / eta**2,
+            ),
+            axis=-1,
+        )
+        right = np.stack(
+            (
+                bend * eta - tail * eta**3,
+                level + 3 * tail * eta**2,
+                -3 * tail * eta,
+                tail,
+            ),
+            axis=-1,
+        )
+
+    zone1 = (
+        np.stack((np.zeros_like(g0), g0, -2 * g0 - g1, g0 + g1), axis=-1)
+        * ~flat[..., None]
+    )
+    left = np.where((flat | in_zone1)[..., None], zone1, left)
+    right = np.where((flat | in_zone1)[..., None], zone1, right)
+    return eta, left, right
+
+
+@register_engine
+class BootstrapEngine(CurveEngine):
+    """Zero curves stripped from the par yields of semiannual coupon bonds.
+
+    Knots up to a year are treated as zero coupon bills. Par yields are
+    interpolated linearly onto the 6 month coupon dates past the first
+    year, and each date's discount factor is solved from the ones before
+    it, carrying their running sum (the bond's annuity) forward. Every
+    step is vectorised across dates, so a batch costs one pass over the
+    coupon dates. ln(DF) is interpolated log-linearly between coupon
+    dates for the month grid.
+    """
+
+    method = "bootstrap"
+    revision = 1
+
+    def _prepare(self):
+        self._bills = np.concatenate(
+            (self.bill_months, self.knot_months[self.knot_months <= 12])
+        ).astype(np.float64)
+        last_bill = self._bills[-1]
+        self._coupons = np.arange(6, self.knot_months[-1] + 1, 6, dtype=np.float64)
+
+        # Par yields of the coupon dates past the bills, as a linear
+        # combination of the knot par yields
+        bonds = self._coupons[self._coupons > last_bill]
+        self._par_weights = np.array(
+            [
+                np.interp(bonds, self.knot_months, column)
+                for column in np.eye(len(self.knot_months))
+            ]
+        )
+
+        # Coupon dates up to the last bill take their DF from the bills
+        self._bill_segment, self._bill_weight = _linear_weights(
+            np.concatenate(([0.0], self._bills)), self._coupons[: -len(bonds)]
+        )
+        self._segment, self._weight = _linear_weights(self._coupons, self.months)
+
+    def knot_ln_df(self, par):
+        """ln(DF) of every coupon date."""
+        bills = par[..., : len(self._bills)]
+        # Bond equivalent yields: simple interest up to 6 months,
+        # semiannual compounding after
+        bill_ln_df = np.where(
+            self._bills <= 6,
+            -np.log1p(bills * self._bills / 12),
+            -(self._bills / 6) * np.log1p(bills / 2),
+        )
+        bill_ln_df = _fill_missing(
+            np.concatenate(
+                (np.zeros(bill_ln_df.shape[:-1] + (1,)), bill_ln_df), axis=-1
+            ),
+            np.concatenate(([0.0], self._bills)),
+        )
+        left = bill_ln_df[..., self._bill_segment]
+        right = bill_ln_df[..., self._bill_segment + 1]
+        short = left + self._bill_weight * (right - left)
+
+        coupon = (par[..., len(self.bill_months) :] @ self._par_weights) / 2
+        df = np.empty(par.shape[:-1] + self._coupons.shape)
+        solved = short.shape[-1]
+        df[..., :solved] = np.exp(short)
+        annuity = df[..., :solved].sum(axis=-1)
+        for idx in range(solved, len(self._coupons)):
+            rate = coupon[..., idx - solved]
+            df[..., idx] = (1 - rate * annuity) / (1 + rate)
+            annuity += df[..., idx]
+        return np.log(df)
+
+
+@register_engine
+class BillBootstrapEngine(BootstrapEngine):
+    """BootstrapEngine that also takes the 1 to 6 month bill yields.
+
+    The 6 month bill prices the first coupon instead of interpolating it
+    from the 1 year. Missing bill yields are interpolated from their
+    neighbours.
+    """
+
+    method = "bootstrap_bills"
+    revision = 1
+    bill_months = (1, 2, 3, 4, 6)
+
+
+def _linear_weights(knots, months):
+    """Left knot index and weight of the right knot for each month."""
+    segment = np.searchsorted(knots, months, side="right") - 1
+    segment = np.clip(segment, 0, len(knots) - 2)
+    left = knots[segment]
+    right = knots[segment + 1]
+    return segment, (months - left) / (right - left)
+
+
+def _fill_missing(values, times):
+    """Linearly interpolate NaN columns from the nearest known ones.
+
+    The first and last columns must be known. Columns are few and rows many,
+    so the nearest known neighbours are carried across column by column.
+    """
+    known = ~np.isnan(values)
+    if known.all():
+        return values
+
+    neighbours = []
+    for columns in (range(values.shape[-1]), reversed(range(values.shape[-1]))):
+        value = values.copy()
+        time = np.where(known, times, np.nan)
+        previous = None
+        for idx in columns:
+            if previous is not None:
+                carry = ~known[..., idx]
+                value[..., idx] = np.where(carry, value[..., previous], value[..., idx])
+                time[..., idx] = np.where(carry, time[..., previous], time[..., idx])
+            previous = idx
+        neighbours.append((value, time))
+
+    (left, left_time), (right, right_time) = neighbours
+    with np.errstate(invalid="ignore"):
+        weight = (times - left_time) / (right_time - left_time)
+    return np.where(known, values, left + weight * (right - left))
+
+
+class CurveCache:
+    """Thread-safe LRU of computed curves.
+
+    Cached arrays are shared between callers, so they are made read-only.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        curve = compute()
+        for values in curve:
+            values.setflags(write=False)
+        with self._lock:
+            self._entries[key] = curve
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return curve
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
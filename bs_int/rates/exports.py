@@ -0,0 +1,265 @@
+import csv
+import hashlib
+import os
+import shutil
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+from rates.history import curve_matrices
+from rates.metrics import export_cache_lookups, timed
+from rates.models import TreasuryData, curve_engine
+
+EXPORT_CHUNK_SIZE = 200
+# Binary exports are built in memory up to this size, then on disk
+EXPORT_SPOOL_SIZE = 8 * 1024 * 1024
+
+# Date x months matrices written by write_npz, alongside dates, months and the
+# par rates at knot_months
+NPZ_MATRICES = ("zero", "df", "ln_df")
+
+LONG_CSV_HEADER = ("date", "months", "par", "zero", "zero_rate", "df", "ln_df")
+
+# Part of every export_key; bump it when the content of an export changes
+EXPORT_VERSION = 2
+DEFAULT_EXPORT_CACHE_SIZE = 512 * 1024 * 1024
+
+
+class _StreamBuffer:
+    """Write-only file object that hands its contents over as they are produced."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset):
+    """(pk, date, *par values) of the rows in `queryset`, ordered by pk."""
+    fields = [
+        maturity.name
+        for maturity in (*TreasuryData._bill_order, *TreasuryData._maturity_order)
+    ]
+    return list(queryset.order_by("pk").values_list("pk", "date", *fields))
+
+
+def export_key(format, rows):
+    """Hash identifying an export of `format` built from `export_rows`."""
+    digest = hashlib.sha256(
+        f"{format}:{EXPORT_VERSION}:{curve_engine.version}".encode("utf-8")
+    )
+    if format == "xlsx":
+        digest.update(settings.EXCEL_EXPORT_ENGINE.encode("utf-8"))
+    for row in rows:
+        digest.update(repr(row).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ExportCache:
+    """Finished exports on disk, named by export_key.
+
+    Keys hash the exported rows' values, so a changed row misses and the
+    files built from its old values age out. Hits bump the file's mtime and
+    the least recently used files are removed once the directory holds more
+    than EXPORT_CACHE_SIZE bytes, so processes sharing EXPORT_CACHE_DIR share
+    the entries and the bound.
+    """
+
+    def __init__(self, directory=None, max_bytes=None):
+        self._directory = directory
+        self._max_bytes = max_bytes
+
+    @property
+    def directory(self):
+        return Path(self._directory or settings.EXPORT_CACHE_DIR)
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes or getattr(
+            settings, "EXPORT_CACHE_SIZE", DEFAULT_EXPORT_CACHE_SIZE
+        )
+
+    def get(self, key, suffix):
+        """Open the export `key`, or return None if it is not cached."""
+        path = self.directory / f"{key}.{suffix}"
+        try:
+            output = open(path, "rb")
+        except FileNotFoundError:
+            export_cache_lookups.inc(result="miss")
+            return None
+
+        export_cache_lookups.inc(result="hit")
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted since it was opened, which the open file survives
+            pass
+        return output
+
+    def get_or_build(self, key, suffix, build):
+        """Open the export `key`, first calling `build(file)` to write it if needed."""
+        output = self.get(key, suffix)
+        if output is not None:
+            return output
+
+        path = self.directory / f"{key}.{suffix}"
+        with self._writing(path) as f:
+            build(f)
+
+        output = open(path, "rb")
+        self._evict(keep=path)
+        return output
+
+    def tee(self, key, suffix, chunks):
+        """Yield `chunks`, storing them as the export `key` once all are sent.
+
+        Closing the generator early, as Django does when a client disconnects,
+        discards what was written.
+        """
+        path = self.directory / f"{key}.{suffix}"
+        with self._writing(path) as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        self._evict(keep=path)
+
+    @contextmanager
+    def _writing(self, path):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Built under a temporary name so readers never see a partial file
+        with NamedTemporaryFile(dir=self.directory, prefix=".", delete=False) as f:
+            try:
+                yield f
+            except BaseException:
+                os.unlink(f.name)
+                raise
+        os.replace(f.name, path)
+
+    def _evict(self, keep):
+        entries = []
+        for path in self.directory.iterdir():
+            if path.name.startswith("."):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        size = sum(entry[1] for entry in entries)
+        for _, file_size, path in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            if path != keep:
+                path.unlink(missing_ok=True)
+                size -= file_size
+
+
+export_cache = ExportCache()
+
+
+def export_filename(tdatas):
+    """Download name, without extension, of one TreasuryData or a first/last pair."""
+    try:
+        if len(tdatas) == 1:
+            filename = f"curve_{tdatas[0].date.year}-{tdatas[0].date.month}-{tdatas[0].date.day}"
+        else:
+            filename = (
+                f"curve_{tdatas[0].date.year}.{tdatas[0].date.month}.{tdatas[0].date.day}"
+                f"-{tdatas[-1].date.year}.{tdatas[-1].date.month}.{tdatas[-1].date.day}"
+            )
+    except Exception:
+        filename = f"curve_{tdatas.date.year}-{tdatas.date.month}-{tdatas.date.day}"
+
+    return filename
+
+
+def csv_files(tdatas):
+    """(name, content) of a CSV per TreasuryData, the members of a CSV zip."""
+    for tdata in tdatas:
+        yield f"{export_filename(tdata)}.csv", tdata.to_csv().read()
+
+
+def stream_long_csv(queryset):
+    """Yield one tidy CSV covering every curve in `queryset`, a date at a time."""
+    return long_csv_chunks(queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE))
+
+
+def long_csv_chunks(tdatas):
+    csv_writer = csv.writer(_Echo())
+
+    yield csv_writer.writerow(LONG_CSV_HEADER)
+    for tdata in tdatas:
+        date = tdata.date.isoformat()
+        yield "".join(csv_writer.writerow((date, *row)) for row in tdata.csv_rows())
+
+
+def stream_zip(files):
+    """Yield a zip archive of (name, content) pairs one member at a time."""
+    buffer = _StreamBuffer()
+
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, content in files:
+            zf.writestr(name, content)
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+@timed("npz_export")
+def write_npz(queryset, file):
+    """Write `queryset` as an uncompressed .npz that loads without parsing.
+
+    Curves are read from the curve history, or the stored curves when it is
+    out of date, rather than computed.
+    """
+    dates, par, curve = curve_matrices(queryset.order_by("date"))
+    np.savez(
+        file,
+        dates=dates,
+        months=curve.months,
+        knot_months=curve_engine.knot_months,
+        par=par,
+        version=np.array(curve_engine.version),
+        **{name: getattr(curve, name) for name in NPZ_MATRICES},
+    )
+
+
+def write_excel(engine_path, pks):
+    """Write the TreasuryData rows `pks` as a workbook, returning its path.
+
+    Meant for rates.workers, so it takes primary keys rather than a queryset
+    and hands over a temporary file instead of the bytes. The caller removes
+    the file.
+    """
+    excel = import_string(engine_path)()
+
+    queryset = (
+        TreasuryData.objects.filter(pk__in=pks)
+        .select_related("stored_curve")
+        .order_by("date")
+    )
+    for tdata in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        excel.add_sheet(tdata)
+
+    with NamedTemporaryFile(suffix=".xlsx", delete=False) as f:
+        shutil.copyfileobj(excel.stream(), f)
+    return f.name
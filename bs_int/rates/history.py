@@ -0,0 +1,317 @@
+import fcntl
+import json
+import logging
+import shutil
+import tempfile
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models import Count, Max
+from django.dispatch import receiver
+from rates.curves import STORED_COLUMNS, Curve
+from rates.models import TreasuryData, curve_engine, curves_stored
+from rates.treasury import _atomic_write
+
+logger = logging.getLogger(__file__)
+
+DEFAULT_HISTORY_DIR = "/tmp/curve_history"
+HISTORY_COLUMNS = ("zero", "zero_rate", "df", "ln_df")
+REBUILD_CHUNK_SIZE = 1000
+
+History = namedtuple("History", ("dates", "months", *HISTORY_COLUMNS))
+
+
+class CurveHistory:
+    """Monthly curves of every TreasuryData row as (dates x months) matrices.
+
+    Each column lives in a raw float64 file that is memory-mapped on load, so
+    reading the whole history costs a metadata read and one aggregate query.
+    Curves stored for dates after the last one on file are appended; any other
+    change (an earlier date, a deleted row, a new curve engine version)
+    rebuilds the files from the database on the next load. Rates changed with
+    QuerySet.update() are not noticed until the next rebuild. Loads, appends
+    and rebuilds hold a lock file, so processes sharing the directory take
+    turns.
+    """
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = getattr(settings, "CURVE_HISTORY_DIR", DEFAULT_HISTORY_DIR)
+
+        self.directory = Path(directory)
+        self.meta_path = self.directory / "history.json"
+        self.rebuilds = 0
+
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        return self._load(rebuild=True)
+
+    def current(self):
+        """The history if it matches the database, else None without rebuilding."""
+        return self._load(rebuild=False)
+
+    def _load(self, rebuild):
+        with self._lock, self._file_lock():
+            stats = TreasuryData.objects.aggregate(
+                count=Count("pk"), last_date=Max("date")
+            )
+            meta = self._read_meta()
+            if not self._is_current(meta, stats):
+                if not rebuild:
+                    return None
+                meta = self._rebuild()
+
+            if self._loaded is None or self._loaded[0] != meta:
+                self._loaded = (meta, self._map(meta))
+            return self._loaded[1]
+
+    def append(self, dates, curve):
+        dates = np.asarray(dates, dtype="datetime64[D]")
+        order = np.argsort(dates)
+
+        with self._lock, self._file_lock():
+            meta = self._read_meta()
+            if meta is None or meta["version"] != curve_engine.version:
+                return
+            if meta["last_date"] is not None and dates[order[0]] <= np.datetime64(
+                meta["last_date"]
+            ):
+                # Rows are kept in date order, so this needs a rebuild
+                self.meta_path.unlink(missing_ok=True)
+                return
+
+            columns = {
+                column: getattr(curve, column).reshape(len(dates), -1)[order]
+                for column in HISTORY_COLUMNS
+            }
+            self._write(
+                self.directory / meta["path"], meta["count"], dates[order], columns
+            )
+            self._write_meta(
+                dict(
+                    meta,
+                    count=meta["count"] + len(dates),
+                    last_date=str(dates[order[-1]]),
+                )
+            )
+
+    @contextmanager
+    def _file_lock(self):
+        # Web workers and the sync_treasury or rebuild_curves commands share
+        # the directory; rebuilding removes files another process may be
+        # about to map or append to
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _is_current(self, meta, stats):
+        last_date = stats["last_date"]
+        return (
+            meta is not None
+            and meta["version"] == curve_engine.version
+            and meta["months"] == len(curve_engine.months)
+            and meta["count"] == stats["count"]
+            and meta["last_date"] == (last_date and last_date.isoformat())
+        )
+
+    def _rebuild(self):
+        self.rebuilds += 1
+        logger.info(f"Rebuilding curve history in {self.directory}")
+
+        path = Path(tempfile.mkdtemp(dir=self.directory, prefix="history-"))
+
+        queryset = TreasuryData.objects.order_by("date")
+        count = 0
+        last_date = None
+        while True:
+            page = (
+                queryset if last_date is None else queryset.filter(date__gt=last_date)
+            )
+            dates, _, curve = _stored_matrices(page[:REBUILD_CHUNK_SIZE])
+            if not len(dates):
+                break
+
+            columns = {column: getattr(curve, column) for column in HISTORY_COLUMNS}
+            self._write(path, count, dates, columns)
+            count += len(dates)
+            last_date = dates[-1].item()
+
+        meta = {
+            "path": path.name,
+            "version": curve_engine.version,
+            "months": len(curve_engine.months),
+            "count": count,
+            "last_date": last_date and last_date.isoformat(),
+        }
+        self._write_meta(meta)
+
+        # Arrays already mapped from older files stay readable after removal
+        for old_path in self.directory.glob("history-*"):
+            if old_path != path:
+                shutil.rmtree(old_path, ignore_errors=True)
+        return meta
+
+    def _write(self, path, offset, dates, columns):
+        for name, values in (("dates", dates), *columns.items()):
+            values = np.ascontiguousarray(values)
+            file_path = path / f"{name}.bin"
+            with open(file_path, "r+b" if file_path.exists() else "wb") as f:
+                f.seek(offset * (values.nbytes // len(values)))
+                f.write(values.tobytes())
+                f.truncate()
+
+    def _map(self, meta):
+        months = curve_engine.months
+        count = meta["count"]
+        if not count:
+            empty = np.empty((0, len(months)))
+            return History(
+                np.empty(0, dtype="datetime64[D]"),
+                months,
+                *(empty for _ in HISTORY_COLUMNS),
+            )
+
+        path = self.directory / meta["path"]
+        return History(
+            np.memmap(
+                path / "dates.bin", dtype="datetime64[D]", mode="r", shape=(count,)
+            ),
+            months,
+            *(
+                np.memmap(
+                    path / f"{column}.bin",
+                    dtype=np.float64,
+                    mode="r",
+                    shape=(count, len(months)),
+                )
+                for column in HISTORY_COLUMNS
+            ),
+        )
+
+    def _read_meta(self):
+        try:
+            return json.loads(self.meta_path.read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_meta(self, meta):
+        _atomic_write(self.meta_path, json.dumps(meta).encode("utf-8"))
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_history():
+    global _history
+
+    with _history_lock:
+        if _history is None:
+            _history = CurveHistory()
+        return _history
+
+
+def reset_history():
+    global _history
+
+    with _history_lock:
+        _history = None
+
+
+def load_history():
+    """Every stored date's monthly curves, as memory-mapped matrices."""
+    return get_history().load()
+
+
+def curve_matrices(queryset):
+    """Dates, knot par rates and monthly curves of `queryset` as arrays.
+
+    Rows come from the curve history's memory maps when it is current and
+    holds every date, otherwise from the stored curves.
+    """
+    history = get_history().current()
+    if history is None or not len(history.dates):
+        return _stored_matrices(queryset)
+
+    dates, par = _par_matrix(queryset)
+    index = np.searchsorted(history.dates, dates).clip(max=len(history.dates) - 1)
+    if not np.array_equal(history.dates[index], dates):
+        return _stored_matrices(queryset)
+
+    columns = {column: getattr(history, column)[index] for column in HISTORY_COLUMNS}
+    par_column = np.full(columns["zero"].shape, np.nan)
+    par_column[:, curve_engine.knot_index] = par
+    return dates, par, Curve(months=history.months, par=par_column, **columns)
+
+
+def _stored_matrices(queryset):
+    # Unpacks each row's stored curve; rows without one built by the current
+    # engine are computed in one batch
+    maturities = TreasuryData._input_maturities(curve_engine.bill_months)
+    rows = list(
+        queryset.values_list(
+            "date",
+            "stored_curve__version",
+            "stored_curve__data",
+            *(m.name for m in maturities),
+        )
+    )
+
+    dates = np.array([row[0] for row in rows], dtype="datetime64[D]")
+    inputs = np.array([row[3:] for row in rows], dtype=np.float64).reshape(
+        len(rows), len(maturities)
+    )
+    months = curve_engine.months
+    stored = np.empty((len(rows), len(STORED_COLUMNS), len(months)))
+    current = np.array([row[1] == curve_engine.version for row in rows], dtype=bool)
+    if current.any():
+        blobs = b"".join(bytes(row[2]) for row, ok in zip(rows, current) if ok)
+        stored[current] = np.frombuffer(blobs, dtype=np.float64).reshape(
+            -1, len(STORED_COLUMNS), len(months)
+        )
+    if not current.all():
+        computed = curve_engine.compute(inputs[~current])
+        stored[~current] = np.stack(
+            [getattr(computed, column) for column in STORED_COLUMNS], axis=1
+        )
+
+    curve = Curve(
+        months=months,
+        **{column: stored[:, i] for i, column in enumerate(STORED_COLUMNS)},
+    )
+    return dates, inputs[:, len(curve_engine.bill_months) :] / 100, curve
+
+
+def _par_matrix(queryset):
+    rows = list(
+        queryset.values_list("date", *(m.name for m in TreasuryData._maturity_order))
+    )
+    dates = np.array([row[0] for row in rows], dtype="datetime64[D]")
+    par = np.array([row[1:] for row in rows], dtype=np.float64).reshape(
+        len(rows), len(TreasuryData._maturity_order)
+    )
+    return dates, par / 100
+
+
+@receiver(curves_stored)
+def _append_stored_curves(sender, tdatas, curve, **kwargs):
+    dates = [tdata.date for tdata in tdatas]
+    transaction.on_commit(lambda: get_history().append(dates, curve))
+
+
+@receiver(setting_changed)
+def _reset_history_on_setting_change(setting, **kwargs):
+    if setting == "CURVE_HISTORY_DIR":
+        reset_history()
@@ -0,0 +1,209 @@
+"""
+Admin exports queued in the database and built by the run_export_jobs command.
+
+Large selections would otherwise be built inside the admin POST, holding a
+uwsgi thread past the proxy timeout. submit_export records an ExportJob and
+returns at once; a worker claims it, reports progress a sheet (or date) at a
+time and stores the file in rates.exports.export_cache, where the job's token
+downloads it. prune_jobs removes jobs, and their files, once they are old.
+
+Jobs are keyed on the format and the exported rows' values, so submitting an
+export identical to a pending, running or finished one returns that job.
+"""
+
+import logging
+import shutil
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rates.exports import (
+    EXPORT_CHUNK_SIZE,
+    csv_files,
+    export_cache,
+    export_filename,
+    export_key,
+    export_rows,
+    long_csv_chunks,
+    stream_zip,
+    write_npz,
+)
+from rates.models import ExportJob, TreasuryData
+
+logger = logging.getLogger(__file__)
+
+# Seconds between progress updates written by a running job
+PROGRESS_INTERVAL = 1
+
+
+def submit_export(queryset, format):
+    """The ExportJob building `queryset` as `format`, creating it if needed."""
+    rows = export_rows(queryset)
+    key = export_key(format, rows)
+
+    job = _active_job(key)
+    if job is not None:
+        return job
+
+    first, last = queryset.earliest("date"), queryset.latest("date")
+    try:
+        with transaction.atomic():
+            return ExportJob.objects.create(
+                key=key,
+                format=format,
+                dates=sorted(row[1].isoformat() for row in rows),
+                filename=export_filename([first] if first == last else [first, last]),
+                total=len(rows),
+            )
+    except IntegrityError:
+        # Another request submitted the same export first
+        return _active_job(key)
+
+
+def _active_job(key):
+    job = (
+        ExportJob.objects.exclude(status=ExportJob.Status.FAILED)
+        .filter(key=key)
+        .first()
+    )
+    if (
+        job is not None
+        and job.status == ExportJob.Status.DONE
+        and not job.file.storage.exists(job.file.name)
+    ):
+        logger.warning(f"{job.file.name} is gone, rebuilding the export")
+        job.status = ExportJob.Status.FAILED
+        job.error = "Export file removed"
+        job.save(update_fields=["status", "error", "updated"])
+        return None
+    return job
+
+
+def prune_jobs():
+    """Delete jobs finished EXPORT_JOB_MAX_AGE seconds ago, and their files."""
+    finished = timezone.now() - timedelta(seconds=settings.EXPORT_JOB_MAX_AGE)
+    pruned = 0
+    for job in ExportJob.objects.filter(
+        status__in=[ExportJob.Status.DONE, ExportJob.Status.FAILED],
+        finished__lt=finished,
+    ):
+        if job.file:
+            job.file.delete(save=False)
+        job.delete()
+        pruned += 1
+    return pruned
+
+
+def claim_job():
+    """Mark the oldest pending job running and return it, or None.
+
+    Jobs left running by a worker that stopped reporting progress for
+    EXPORT_JOB_STALE_AFTER seconds are claimed again.
+    """
+    stale = timezone.now() - timedelta(seconds=settings.EXPORT_JOB_STALE_AFTER)
+    with transaction.atomic():
+        job = (
+            ExportJob.objects.filter(
+                Q(status=ExportJob.Status.PENDING)
+                | Q(status=ExportJob.Status.RUNNING, updated__lt=stale)
+            )
+            .order_by("created")
+            .select_for_update(skip_locked=True)
+            .first()
+        )
+        if job is None:
+            return None
+
+        job.status = ExportJob.Status.RUNNING
+        job.progress = 0
+        job.save(update_fields=["status", "progress", "updated"])
+    return job
+
+
+def run_job(job):
+    """Build `job`'s file, recording progress and the outcome."""
+    queryset = (
+        TreasuryData.objects.filter(date__in=job.dates)
+        .select_related("stored_curve")
+        .order_by("date")
+    )
+    progress = _Progress(job)
+    try:
+        # Through the export cache, so job files count towards its size bound
+        # and identical downloads from the admin share them
+        export_cache.get_or_build(
+            job.key,
+            job.format,
+            lambda output: WRITERS[job.format](queryset, output, progress),
+        ).close()
+        job.file.name = f"{job.key}.{job.format}"
+    except Exception as e:
+        logger.exception(f"Export job {job.pk} failed")
+        job.status = ExportJob.Status.FAILED
+        job.error = f"{e.__class__.__name__}: {e}"
+    else:
+        job.status = ExportJob.Status.DONE
+        job.progress = job.total
+
+    job.finished = timezone.now()
+    job.save()
+    return job
+
+
+class _Progress:
+    """Pass TreasuryData rows through, saving the job's progress as they go."""
+
+    def __init__(self, job):
+        self.job = job
+        self._saved = time.monotonic()
+
+    def __call__(self, tdatas):
+        for tdata in tdatas:
+            yield tdata
+            self.job.progress += 1
+            if time.monotonic() - self._saved >= PROGRESS_INTERVAL:
+                self.save()
+
+    def save(self):
+        ExportJob.objects.filter(pk=self.job.pk).update(
+            progress=self.job.progress, updated=timezone.now()
+        )
+        self._saved = time.monotonic()
+
+
+def _write_excel(queryset, output, progress):
+    excel = import_string(settings.EXCEL_EXPORT_ENGINE)()
+    for tdata in progress(queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE)):
+        excel.add_sheet(tdata)
+    progress.save()
+
+    shutil.copyfileobj(excel.stream(), output)
+
+
+def _write_zip(queryset, output, progress):
+    tdatas = progress(queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE))
+    for chunk in stream_zip(csv_files(tdatas)):
+        output.write(chunk)
+
+
+def _write_long_csv(queryset, output, progress):
+    tdatas = progress(queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE))
+    for chunk in long_csv_chunks(tdatas):
+        output.write(chunk.encode("utf-8"))
+
+
+def _write_npz(queryset, output, progress):
+    # One batch curve for every date, so there is no progress to report
+    write_npz(queryset, output)
+
+
+WRITERS = {
+    ExportJob.Format.EXCEL: _write_excel,
+    ExportJob.Format.CSV: _write_zip,
+    ExportJob.Format.LONG_CSV: _write_long_csv,
+    ExportJob.Format.NPZ: _write_npz,
+}
@@ -0,0 +1,160 @@
+"""
+Throughput of Django's WSGI and ASGI handlers against a stub Treasury server.
+
+Only the async published view is compared; production stays on uwsgi because
+the admin's views are sync, see the README.
+
+Not collected by the regular test run. Run it explicitly with:
+    pytest rates/loadtest.py -s
+
+Requests go through Django's request handlers in-process: the WSGI side is
+WSGI_SLOTS threads each running one request at a time, like uwsgi's
+processes x threads; the ASGI side is one event loop serving every request
+at once. Environment variables control the run:
+    LOADTEST_REQUESTS     concurrent requests per run (default 40)
+    LOADTEST_LATENCY      seconds the stub Treasury takes to answer (default 0.2)
+    LOADTEST_MIN_SPEEDUP  required ASGI/WSGI throughput ratio (default 2)
+"""
+
+import asyncio
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from django.test import AsyncClient, Client
+from rates import views
+from rates.benchmarks import stored_tdatas
+from rates.tests import MOCK_DATA
+
+WSGI_SLOTS = 4
+REQUESTS = int(os.environ.get("LOADTEST_REQUESTS", 40))
+LATENCY = float(os.environ.get("LOADTEST_LATENCY", 0.2))
+MIN_SPEEDUP = float(os.environ.get("LOADTEST_MIN_SPEEDUP", 2))
+LAST_YEAR = date.today().year - 1
+
+
+class _SlowTreasuryHandler(BaseHTTPRequestHandler):
+    """Answer any yearly CSV request with MOCK_DATA moved to that year."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        year = re.search(r"field_tdr_date_value=(\d{4})", self.path).group(1)
+        body = MOCK_DATA.replace("/2024", f"/{year}").encode("utf-8")
+
+        time.sleep(LATENCY)
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _SlowTreasuryServer(ThreadingHTTPServer):
+    # Every ASGI request connects at once; the default backlog of 5 would
+    # stall connections in SYN retries
+    request_queue_size = 1024
+
+
+@pytest.fixture
+def slow_treasury(settings, tmp_path):
+    server = _SlowTreasuryServer(("127.0.0.1", 0), _SlowTreasuryHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    )
+    thread.start()
+
+    settings.TREASURY_BASE_URL = f"http://127.0.0.1:{server.server_port}"
+    settings.TREASURY_MAX_CONCURRENCY = REQUESTS
+    # published only answers for years since this one
+    settings.TREASURY_FIRST_YEAR = LAST_YEAR - 3 * REQUESTS
+    settings.TREASURY_CACHE_DIR = tmp_path / "treasury_cache"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def report(name, count, elapsed):
+    print(f"\n{name}: {count} requests in {elapsed:.2f}s, {count / elapsed:.1f} req/s")
+    return count / elapsed
+
+
+def wsgi_run(urls):
+    def get(url):
+        return Client().get(url).status_code
+
+    with ThreadPoolExecutor(max_workers=WSGI_SLOTS) as executor:
+        return list(executor.map(get, urls))
+
+
+async def asgi_run(urls, client=None):
+    client = client or AsyncClient()
+    responses = await asyncio.gather(*(client.get(url) for url in urls))
+    return [response.status_code for response in responses]
+
+
+def published_urls(batch):
+    # A past year apiece, so every request misses the Treasury cache
+    last_year = LAST_YEAR - batch * REQUESTS
+    return [
+        f"/rates/api/published/{date(year, 4, 2)}/"
+        for year in range(last_year - REQUESTS + 1, last_year + 1)
+    ]
+
+
+@pytest.mark.enable_socket
+def test_published_throughput(slow_treasury):
+    # Warm up both paths outside the timings
+    wsgi_run(published_urls(2)[:1])
+    asyncio.run(asgi_run(published_urls(2)[1:2]))
+
+    urls = published_urls(0)
+    start = time.perf_counter()
+    statuses = wsgi_run(urls)
+    wsgi = report("WSGI published", len(urls), time.perf_counter() - start)
+    assert set(statuses) == {200}
+
+    urls = published_urls(1)
+    start = time.perf_counter()
+    statuses = asyncio.run(asgi_run(urls))
+    asgi = report("ASGI published", len(urls), time.perf_counter() - start)
+    assert set(statuses) == {200}
+
+    assert asgi >= wsgi * MIN_SPEEDUP, f"ASGI is only {asgi / wsgi:.1f}x faster"
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize("pool_workers", (0, 2))
+def test_chart_throughput(pool_workers, settings, tmp_path, admin_user):
+    # Charts are CPU bound, so this depends on the cores available
+    settings.CPU_POOL_WORKERS = pool_workers
+    settings.STORE_CHARTS = False
+    settings.CURVE_HISTORY_DIR = tmp_path / "curve_history"
+    views.chart_cache.clear()
+    urls = [
+        f"/rates/chart/?dates={tdata.date}&format=svg"
+        for tdata in stored_tdatas(REQUESTS // 2)
+    ]
+    # Charts are for staff; every URL renders, so the render limit goes too
+    settings.CHART_MAX_RENDERS = len(urls)
+    client = AsyncClient()
+    client.force_login(admin_user)
+    # Start the pool's processes before timing
+    asyncio.run(asgi_run(urls[:1], client))
+
+    start = time.perf_counter()
+    statuses = asyncio.run(asgi_run(urls[1:], client))
+    report(
+        f"ASGI charts, {pool_workers} pool workers, {os.cpu_count()} CPUs",
+        len(urls) - 1,
+        time.perf_counter() - start,
+    )
+    assert set(statuses) == {200}
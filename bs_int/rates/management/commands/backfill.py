@@ -0,0 +1,68 @@
+import logging
+
+from dateutil.parser import parse
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rates.models import TreasuryData, parse_treasury_csv
+from rates.treasury import TreasuryPeriod, treasury_csvs
+
+logger = logging.getLogger(__file__)
+
+
+class Command(BaseCommand):
+    help = "Load every available Treasury curve between two dates"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", required=True, type=_date)
+        parser.add_argument("--end", type=_date)
+        parser.add_argument(
+            "--charts",
+            action="store_true",
+            help="Render charts for the inserted dates once all rows are stored",
+        )
+
+    def handle(self, *args, **kwargs):
+        current_date = timezone.now().date()
+        start = kwargs["start"]
+        end = kwargs["end"] or current_date
+
+        if start > end:
+            raise CommandError("--start must not be after --end")
+
+        periods = {
+            year: self._periods(year, end, current_date)
+            for year in range(start.year, end.year + 1)
+        }
+        # Downloads run in parallel; rows are still inserted a year at a time
+        contents = treasury_csvs(
+            [period for year_periods in periods.values() for period in year_periods],
+            current_date=current_date,
+        )
+        for year, year_periods in periods.items():
+            self._backfill_year(
+                year, [contents[period] for period in year_periods], start, end
+            )
+
+        if kwargs["charts"]:
+            call_command("render_charts", start=start, end=end, stdout=self.stdout)
+
+    def _periods(self, year, end, current_date):
+        periods = [TreasuryPeriod(year, None)]
+        if year == current_date.year and end >= current_date.replace(day=1):
+            periods.append(TreasuryPeriod(year, current_date.month))
+        return periods
+
+    def _backfill_year(self, year, contents, start, end):
+        rows = {}
+        for content in contents:
+            for data_date, values in parse_treasury_csv(content):
+                if start <= data_date <= end:
+                    rows[data_date] = values
+
+        tdatas = TreasuryData.insert_rows(rows)
+        self.stdout.write(f"{year}: inserted {len(tdatas)} of {len(rows)} dates")
+
+
+def _date(value):
+    return parse(value).date()
@@ -0,0 +1,38 @@
+import logging
+
+from dateutil.parser import parse
+from django.core.management.base import BaseCommand
+from rates.exports import stream_long_csv
+from rates.models import TreasuryData
+
+logger = logging.getLogger(__file__)
+
+
+class Command(BaseCommand):
+    help = "Export monthly curves for a date range as one long-format CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", type=_date)
+        parser.add_argument("--end", type=_date)
+        parser.add_argument(
+            "--output", help="File to write to. Defaults to standard output"
+        )
+
+    def handle(self, *args, **kwargs):
+        queryset = TreasuryData.objects.select_related("stored_curve").order_by("date")
+        if kwargs["start"]:
+            queryset = queryset.filter(date__gte=kwargs["start"])
+        if kwargs["end"]:
+            queryset = queryset.filter(date__lte=kwargs["end"])
+
+        if kwargs["output"]:
+            with open(kwargs["output"], "w", newline="") as f:
+                f.writelines(stream_long_csv(queryset))
+        else:
+            self.stdout.ending = ""
+            for chunk in stream_long_csv(queryset):
+                self.stdout.write(chunk)
+
+
+def _date(value):
+    return parse(value).date()
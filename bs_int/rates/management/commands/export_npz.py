@@ -0,0 +1,35 @@
+import logging
+
+from dateutil.parser import parse
+from django.core.management.base import BaseCommand
+from rates.exports import write_npz
+from rates.models import TreasuryData
+
+logger = logging.getLogger(__file__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Export monthly curves for a date range as NumPy arrays (.npz). "
+        "Load them with numpy.load(path)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", type=_date)
+        parser.add_argument("--end", type=_date)
+        parser.add_argument("--output", required=True, help="File to write to")
+
+    def handle(self, *args, **kwargs):
+        queryset = TreasuryData.objects.all()
+        if kwargs["start"]:
+            queryset = queryset.filter(date__gte=kwargs["start"])
+        if kwargs["end"]:
+            queryset = queryset.filter(date__lte=kwargs["end"])
+
+        with open(kwargs["output"], "wb") as f:
+            write_npz(queryset, f)
+        logger.info(f"Wrote {kwargs['output']}")
+
+
+def _date(value):
+    return parse(value).date()
@@ -0,0 +1,62 @@
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from rates.models import (
+    SUMMARY_FIELDS,
+    TreasuryCurve,
+    TreasuryData,
+    bump_treasury_generation,
+    curve_engine,
+)
+
+logger = logging.getLogger(__file__)
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = (
+        "Store monthly curves and summaries that are missing or were built by an "
+        "older method"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Rebuild every stored curve, not only stale ones",
+        )
+
+    def handle(self, *args, **kwargs):
+        queryset = TreasuryData.objects.order_by("date")
+        if not kwargs["all"]:
+            queryset = queryset.filter(
+                ~Q(stored_curve__version=curve_engine.version)
+                | Q(stored_curve__isnull=True)
+                # Rows added before the summary columns existed
+                | Q(thirty_year_zero__isnull=True)
+            )
+
+        total = 0
+        batch = []
+        for tdata in queryset.iterator(chunk_size=BATCH_SIZE):
+            batch.append(tdata)
+            if len(batch) == BATCH_SIZE:
+                total += self._store(batch)
+                batch = []
+        total += self._store(batch)
+        bump_treasury_generation()
+
+        self.stdout.write(f"Stored {total} curves ({curve_engine.version})")
+
+    def _store(self, batch):
+        if not batch:
+            return 0
+
+        curve = TreasuryData.batch_curves(batch)
+        stored_curves = TreasuryCurve.store(batch, curve)
+        # The summary columns depend on the curve method too
+        TreasuryData.set_summaries(batch, curve)
+        TreasuryData.objects.bulk_update(batch, SUMMARY_FIELDS)
+        return len(stored_curves)
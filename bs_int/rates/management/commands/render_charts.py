@@ -0,0 +1,75 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from dateutil.parser import parse
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from rates.charts import render_chart
+from rates.models import TreasuryData
+
+logger = logging.getLogger(__file__)
+
+BATCH_SIZE = 100
+
+
+class Command(BaseCommand):
+    help = "Render charts for stored dates that do not have one yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", type=_date)
+        parser.add_argument("--end", type=_date)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Number of rendering processes. Defaults to the number of CPUs",
+        )
+
+    def handle(self, *args, **kwargs):
+        queryset = (
+            TreasuryData.objects.filter(Q(chart="") | Q(chart__isnull=True))
+            .select_related("stored_curve")
+            .order_by("date")
+        )
+        if kwargs["start"]:
+            queryset = queryset.filter(date__gte=kwargs["start"])
+        if kwargs["end"]:
+            queryset = queryset.filter(date__lte=kwargs["end"])
+
+        tdatas = list(queryset)
+        if not tdatas:
+            self.stdout.write("No charts to render")
+            return
+
+        # Spawned workers only render; they never inherit this process's
+        # database connections.
+        with ProcessPoolExecutor(
+            max_workers=kwargs["workers"], mp_context=get_context("spawn")
+        ) as executor:
+            for start in range(0, len(tdatas), BATCH_SIZE):
+                batch = tdatas[start : start + BATCH_SIZE]
+                curves = [tdata.curve() for tdata in batch]
+                pngs = executor.map(
+                    render_chart,
+                    [curve.months for curve in curves],
+                    [curve.zero for curve in curves],
+                )
+                for tdata, png in zip(batch, pngs):
+                    self._store(tdata, png)
+
+        self.stdout.write(f"Rendered {len(tdatas)} charts")
+
+    @staticmethod
+    def _store(tdata, png):
+        tdata.chart.save(
+            f"{tdata.date.year}-{tdata.date.month}-{tdata.date.day}.png",
+            ContentFile(png),
+            save=False,
+        )
+        TreasuryData.objects.filter(pk=tdata.pk).update(chart=tdata.chart.name)
+
+
+def _date(value):
+    return parse(value).date()
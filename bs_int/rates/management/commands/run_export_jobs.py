@@ -0,0 +1,49 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from rates.jobs import claim_job, prune_jobs, run_job
+
+logger = logging.getLogger(__file__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the exports queued from the admin, see rates.jobs. "
+        "Run one per worker process; they share the queue"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty instead of polling it",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=2,
+            help="Seconds between checks of an empty queue",
+        )
+
+    def handle(self, *args, **kwargs):
+        while True:
+            # Between jobs, unless called inside a transaction that still
+            # needs the connection (call_command within atomic())
+            if not connection.in_atomic_block:
+                close_old_connections()
+            job = claim_job()
+            if job is None:
+                pruned = prune_jobs()
+                if pruned:
+                    self.stdout.write(f"Removed {pruned} old exports")
+                if kwargs["once"]:
+                    return
+                time.sleep(kwargs["poll_interval"])
+                continue
+
+            job = run_job(job)
+            self.stdout.write(
+                f"Export {job.pk} ({job.total} dates as {job.format}): {job.status}"
+            )
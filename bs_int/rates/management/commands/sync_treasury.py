@@ -0,0 +1,65 @@
+import logging
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from rates.models import TreasuryData, parse_treasury_csv
+from rates.treasury import TreasuryPeriod, treasury_csvs
+
+logger = logging.getLogger(__file__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Load Treasury curves published since the latest stored date. "
+        "Cheap enough to run from cron every few minutes"
+    )
+
+    def handle(self, *args, **kwargs):
+        current_date = timezone.now().date()
+        latest = TreasuryData.objects.aggregate(latest=Max("date"))["latest"]
+
+        if latest is not None and latest >= _last_business_day(current_date):
+            self.stdout.write(f"Up to date ({latest})")
+            return
+
+        periods = self._periods(latest, current_date)
+        contents = treasury_csvs(periods, current_date=current_date)
+
+        rows = {}
+        for period in periods:
+            for data_date, values in parse_treasury_csv(contents[period]):
+                if latest is None or data_date > latest:
+                    rows[data_date] = values
+
+        with transaction.atomic():
+            tdatas = TreasuryData.insert_rows(rows)
+        self.stdout.write(
+            f"Inserted {len(tdatas)} dates"
+            + (f" up to {tdatas[-1].date}" if tdatas else "")
+        )
+
+    def _periods(self, latest, current_date):
+        current_month = current_date.replace(day=1)
+        if latest is None or latest >= current_month:
+            return [TreasuryPeriod(current_date.year, current_date.month)]
+
+        previous_month = (current_month - timedelta(days=1)).replace(day=1)
+        if latest < previous_month - timedelta(days=1):
+            logger.warning(
+                f"Only syncing from {previous_month}, run backfill --start {latest} "
+                "to load older dates"
+            )
+        return [
+            TreasuryPeriod(previous_month.year, previous_month.month),
+            TreasuryPeriod(current_date.year, current_date.month),
+        ]
+
+
+def _last_business_day(current_date):
+    # Treasury publishes on weekdays; holidays still cost a (cached) request
+    while current_date.weekday() >= 5:
+        current_date -= timedelta(days=1)
+    return current_date
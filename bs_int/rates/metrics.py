@@ -0,0 +1,189 @@
+"""
+In-process counters and histograms, rendered in the Prometheus text format.
+
+Metrics live in each worker process, so a scraper sees the worker that
+answered its request; aggregate across workers on the Prometheus side.
+"""
+
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key, **extra):
+        pairs = [*zip(self.labelnames, key), *extra.items()]
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(val)}"' for name, val in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_value(self, key, value):
+        yield f"{self.name}{self._labels(key)} {_number(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[idx] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ((), 0.0))
+            return sum(counts)
+
+    def _render_value(self, key, value):
+        counts, total = value
+        cumulative = 0
+        for bound, count in zip((*self.buckets, "+Inf"), counts):
+            cumulative += count
+            yield (
+                f"{self.name}_bucket{self._labels(key, le=_number(bound))} {cumulative}"
+            )
+        yield f"{self.name}_sum{self._labels(key)} {_number(total)}"
+        yield f"{self.name}_count{self._labels(key)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = [line for metric in metrics for line in metric.render()]
+        return "\n".join(lines) + "\n"
+
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+registry = Registry()
+
+span_seconds = registry.histogram(
+    "rates_span_seconds", "Time spent in instrumented code paths", ("span",)
+)
+span_errors = registry.counter(
+    "rates_span_errors_total", "Instrumented code paths that raised", ("span",)
+)
+treasury_lookups = registry.counter(
+    "rates_treasury_lookups_total",
+    "Treasury CSV lookups by how the cache answered them",
+    ("result",),
+)
+export_cache_lookups = registry.counter(
+    "rates_export_cache_lookups_total",
+    "Admin export downloads by whether rates.exports.ExportCache had the file",
+    ("result",),
+)
+
+
+@contextmanager
+def span(name):
+    """Record the duration of the block in rates_span_seconds."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        span_errors.inc(span=name)
+        raise
+    finally:
+        span_seconds.observe(time.perf_counter() - start, span=name)
+
+
+def timed(name):
+    """Decorator form of `span`."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.3 on 2026-10-18 14:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rates", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TreasuryCurve",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("version", models.CharField(max_length=32)),
+                ("data", models.BinaryField()),
+                (
+                    "treasury_data",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="stored_curve",
+                        to="rates.treasurydata",
+                    ),
+                ),
+            ],
+        ),
+    ]
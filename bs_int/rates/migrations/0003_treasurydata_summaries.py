@@ -0,0 +1,32 @@
+# Generated by Django 5.0.3 on 2026-10-18 14:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rates", "0002_treasurycurve"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="treasurydata",
+            name="inverted",
+            field=models.BooleanField(db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="treasurydata",
+            name="ten_two_spread",
+            field=models.FloatField(
+                db_index=True, editable=False, null=True, verbose_name="10Y-2Y spread"
+            ),
+        ),
+        migrations.AddField(
+            model_name="treasurydata",
+            name="thirty_year_zero",
+            field=models.FloatField(
+                db_index=True, editable=False, null=True, verbose_name="30Y zero rate"
+            ),
+        ),
+    ]
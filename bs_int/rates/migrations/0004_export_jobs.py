@@ -0,0 +1,78 @@
+# Generated by Django 5.0.3 on 2026-10-18 15:02
+
+import rates.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rates", "0003_treasurydata_summaries"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ExportJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=64)),
+                (
+                    "format",
+                    models.CharField(
+                        choices=[
+                            ("xlsx", "Excel"),
+                            ("zip", "CSV"),
+                            ("csv", "CSV (long format)"),
+                            ("npz", "NumPy arrays"),
+                        ],
+                        max_length=4,
+                    ),
+                ),
+                ("dates", models.JSONField()),
+                ("filename", models.CharField(max_length=64)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("running", "Running"),
+                            ("done", "Done"),
+                            ("failed", "Failed"),
+                        ],
+                        db_index=True,
+                        default="pending",
+                        max_length=8,
+                    ),
+                ),
+                ("progress", models.PositiveIntegerField(default=0)),
+                ("total", models.PositiveIntegerField()),
+                (
+                    "token",
+                    models.CharField(
+                        default=rates.models._export_token, max_length=43, unique=True
+                    ),
+                ),
+                ("file", models.FileField(blank=True, upload_to="exports/")),
+                ("error", models.TextField(blank=True)),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("updated", models.DateTimeField(auto_now=True)),
+                ("finished", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="exportjob",
+            constraint=models.UniqueConstraint(
+                models.F("key"),
+                condition=models.Q(("status", "failed"), _negated=True),
+                name="unique_active_export",
+            ),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.3 on 2026-10-18 16:47
+
+import rates.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rates", "0004_export_jobs"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="exportjob",
+            name="file",
+            field=models.FileField(
+                blank=True, storage=rates.models.ExportStorage(), upload_to=""
+            ),
+        ),
+    ]
@@ -1,30 +1,48 @@
+import copyreg
 import csv
+import functools
 import logging
 import math
-from collections import namedtuple
+import os
+import pickle
+import secrets
+import threading
+import time
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+from copy import copy
+from datetime import date, datetime
 from io import BytesIO, StringIO
 from pathlib import Path
+from tempfile import SpooledTemporaryFile
 
-import matplotlib.pyplot as plt
-import requests
-from dateutil.parser import parse
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
 from django.db import models
-from django.utils import timezone
-from django.utils.html import mark_safe
-from openpyxl import load_workbook
+from django.db.models.signals import post_delete
+from django.dispatch import Signal, receiver
+from django.urls import reverse
+from django.utils.html import format_html
+from django.utils.http import urlencode
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import Cell, WriteOnlyCell
 from openpyxl.chart import Reference, ScatterChart, Series
-
-REQUEST_TIMEOUT = 60
-
-CURRENT_MONTH_TREASURY_URL_TEMPLATE = "https://home.treasury.gov/resource-center/data-chart-center/interest-rates/daily-treasury-rates.csv/all/{year}{month}?type=daily_treasury_yield_curve&field_tdr_date_value_month={year}{month}&page&_format=csv"
-
-ANNUAL_TREASURY_URL_TEMPLATE = "https://home.treasury.gov/resource-center/data-chart-center/interest-rates/daily-treasury-rates.csv/{year}/all?type=daily_treasury_yield_curve&field_tdr_date_value={year}&page&_format=csv"
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.utils.indexed_list import IndexedList
+from rates.charts import render_chart, schedule_render
+from rates.curves import CURVE_ENGINES, CurveCache
+from rates.metrics import span, timed
+from rates.treasury import TreasuryPeriod, treasury_csv
 
 logger = logging.getLogger(__file__)
 
 EXCEL_TEMPLATE_FILE = Path(__file__).parent / "quant_assessment_template.xlsx"
+EXCEL_SPOOL_SIZE = 8 * 1024 * 1024
+PARSED_TABLE_CACHE_SIZE = 8
 PAR_VALUES_COL = "C"
 PAR_VALUES_START_ROW = 19
 ZERO_RATES_COL = "E"
@@ -39,6 +57,14 @@ CHART_MAX_ROW = 351
 MINI_CHART_MIN_ROW = 19
 MINI_CHART_MAX_ROW = 26
 
+SUMMARY_FIELDS = ("ten_two_spread", "inverted", "thirty_year_zero")
+# Cache key bumped whenever TreasuryData rows change, see treasury_generation
+TREASURY_GENERATION_KEY = "rates:treasury-data:generation"
+
+# Sent by TreasuryCurve.store with the stored TreasuryData rows and their
+# batch Curve
+curves_stored = Signal()
+
 Maturity = namedtuple("Maturity", "name,months")
 DataRow = namedtuple("DataRow", "months,par,zero,zero_rate,df,ln_df")
 
@@ -71,6 +97,15 @@ class TreasuryData(models.Model):
         Maturity(name="twenty_year", months=240),
         Maturity(name="thirty_year", months=360),
     )
+    # Bill maturities an engine may take ahead of _maturity_order, see
+    # rates.curves.CurveEngine.bill_months
+    _bill_order = (
+        Maturity(name="one_month", months=1),
+        Maturity(name="two_month", months=2),
+        Maturity(name="three_month", months=3),
+        Maturity(name="four_month", months=4),
+        Maturity(name="six_month", months=6),
+    )
 
     date = models.DateField(null=False, blank=False)
 
@@ -89,6 +124,16 @@ class TreasuryData(models.Model):
     twenty_year = models.FloatField(null=False, blank=False)
     thirty_year = models.FloatField(null=False, blank=False)
 
+    # Precomputed from the curve on save so the admin can sort and filter on
+    # them in SQL
+    ten_two_spread = models.FloatField(
+        null=True, editable=False, db_index=True, verbose_name="10Y-2Y spread"
+    )
+    inverted = models.BooleanField(null=True, editable=False, db_index=True)
+    thirty_year_zero = models.FloatField(
+        null=True, editable=False, db_index=True, verbose_name="30Y zero rate"
+    )
+
     chart = models.ImageField(
         null=True,
         blank=True,
@@ -109,7 +154,15 @@ class TreasuryData(models.Model):
         return str(self)
 
     def image_tag(self):
-        return mark_safe(f'<img src="{self.chart.url}" width="600" height="400" />')
+        if self.pk is None:
+            return ""
+
+        url = reverse("rates:chart")
+        return format_html(
+            '<img src="{}?{}" width="600" height="400" />',
+            url,
+            urlencode({"dates": self.date.isoformat(), "width": 600, "height": 400}),
+        )
 
     image_tag.short_description = "Chart"
 
@@ -119,55 +172,36 @@ class TreasuryData(models.Model):
             if m.months < maturity.months:
                 yield m
 
+    def _ingestion_context(self):
+        context = getattr(self, "_ingestion", None)
+        if context is None or context.date != self.date:
+            context = self._ingestion = IngestionContext(self.date)
+        return context
+
     def _retrieve_treasury_data(self):
         if not self._required_fields_missing():
             return
 
-        current_date = timezone.now().date()
-
-        if (
-            current_date.month == self.date.month
-            and current_date.year == self.date.year
-        ):
-            URL = CURRENT_MONTH_TREASURY_URL_TEMPLATE.format(
-                year=self.date.year, month=f"{self.date.month:02}"
-            )
-        else:
-            URL = ANNUAL_TREASURY_URL_TEMPLATE.format(year=self.date.year)
-
-        resp = requests.get(URL, timeout=REQUEST_TIMEOUT)
-        resp.raise_for_status()
-
-        data = StringIO(resp.content.decode("utf-8"))
-        dict_reader = csv.DictReader(data)
-
-        for row in dict_reader:
-            data_date = parse(row.pop("Date"))
-
-            if data_date.date() == self.date:
-                for key, val in row.items():
-                    try:
-                        if val != "":
-                            val = float(val)
-                        else:
-                            val = None
-                        setattr(self, self._treasury_map[key], val)
-                    except Exception as e:
-                        raise ValidationError(
-                            f"Got error getting {key} treasury data for {self.date}: {e}"
-                        )
-                break
-        else:
-            raise ValidationError(f"Treasury data for {self.date} was not found")
-
-        self.generate_chart()
+        context = self._ingestion_context()
+        for field, val in context.values().items():
+            setattr(self, field, val)
 
     def _required_fields_missing(self):
         return any((getattr(self, x.name, None) is None for x in self._maturity_order))
 
     def save(self, *args, **kwargs):
         self._retrieve_treasury_data()
+        curve = self.batch_curves([self])
+        self.set_summaries([self], curve)
         super().save(*args, **kwargs)
+        TreasuryCurve.store([self], curve)
+        bump_treasury_generation()
+
+        if not self.chart and getattr(settings, "STORE_CHARTS", True):
+            context = self._ingestion_context()
+            if not context.charts:
+                schedule_render(self.render_stored_chart, self.pk)
+                context.charts += 1
 
     def clean(self, *args, **kwargs):
         if self.pk is not None:
@@ -190,78 +224,112 @@ class TreasuryData(models.Model):
         except Exception as e:
             raise ValidationError(e)
 
-    def par_values(self):
-        return [getattr(self, maturity.name) for maturity in self._maturity_order]
-
-    def zero_rates(self):
-        zrs = {}
-
-        for idx, maturity in enumerate(self._maturity_order):
-            par_rate = getattr(self, maturity.name) / 100
-            df = 1 / ((1 + (par_rate / 2)) ** (maturity.months / 6))
-            zero_rate = 1 / (df ** (1 / maturity.months)) - 1
-            zrs[maturity] = zero_rate
-        return zrs
-
-    def get_row_data(self):
-        key_data = {}
-        zero_rates = self.zero_rates()
-
-        for idx, maturity in enumerate(self._maturity_order):
-            months = maturity.months
-            par = getattr(self, maturity.name) / 100
-            zero_rate = zero_rates[maturity]
-            zero = (1 + zero_rate) ** 12 - 1
-            df = 1 / (1 + zero_rate) ** months
-            ln_df = math.log(df)
-
-            key_data[maturity.months] = DataRow(
-                months=months,
-                par=par,
-                zero=zero,
-                zero_rate=zero_rate,
-                df=df,
-                ln_df=ln_df,
-            )
+    @classmethod
+    def insert_rows(cls, rows):
+        """Store `{date: values}` rows that are not in the database yet.
+
+        Rows missing a required maturity are skipped. Returns the inserted
+        instances, whose curves are stored too.
+        """
+        existing = set(
+            cls.objects.filter(date__in=rows.keys()).values_list("date", flat=True)
+        )
 
-        key_slopes = []
-        key_data_list = list(key_data.values())
-        for idx in range(1, len(key_data)):
-            curr = key_data_list[idx]
-            prev = key_data_list[idx - 1]
-
-            slope = (curr.ln_df - prev.ln_df) / (curr.months - prev.months)
-            key_slopes.append(slope)
-
-        data = []
-        key_row = None
-        key_slope = None
-        for months in range(12, 361):
-            if months in key_data:
-                key_row = key_data[months]
-                if key_slopes:
-                    key_slope = key_slopes.pop(0)
-                data.append(key_row)
+        tdatas = []
+        for data_date, values in sorted(rows.items()):
+            if data_date in existing:
                 continue
 
-            ln_df = key_row.ln_df + key_slope * (months - key_row.months)
-            df = math.exp(ln_df)
-            par = ""
-            zero_rate = (1 / df) ** (1 / months) - 1
-            zero = (1 + zero_rate) ** 12 - 1
-
-            data.append(
-                DataRow(
-                    months=months,
-                    par=par,
-                    zero=zero,
-                    zero_rate=zero_rate,
-                    df=df,
-                    ln_df=ln_df,
-                )
+            tdata = cls(date=data_date, **values)
+            if tdata._required_fields_missing():
+                logger.warning(f"Skipping {data_date}: required maturities missing")
+                continue
+            tdatas.append(tdata)
+
+        cls.set_summaries(tdatas)
+        cls.objects.bulk_create(tdatas, ignore_conflicts=True)
+        TreasuryCurve.store(
+            cls.objects.filter(
+                date__in=[tdata.date for tdata in tdatas], stored_curve__isnull=True
             )
-        return data
+        )
+        bump_treasury_generation()
+        return tdatas
 
+    @classmethod
+    def set_summaries(cls, tdatas, curve=None):
+        """Fill in SUMMARY_FIELDS from each instance's curve."""
+        if not tdatas:
+            return
+        if curve is None:
+            curve = cls.batch_curves(tdatas)
+
+        zero = curve.zero.reshape(len(tdatas), -1)
+        for tdata, thirty_year_zero in zip(tdatas, zero[:, -1].tolist()):
+            tdata.ten_two_spread = round(tdata.ten_year - tdata.two_year, 4)
+            tdata.inverted = tdata.ten_two_spread < 0
+            tdata.thirty_year_zero = thirty_year_zero * 100
+
+    @classmethod
+    def _input_maturities(cls, bill_months=()):
+        bills = [m for m in cls._bill_order if m.months in bill_months]
+        return [*bills, *cls._maturity_order]
+
+    def par_values(self, bill_months=()):
+        return [
+            getattr(self, maturity.name)
+            for maturity in self._input_maturities(bill_months)
+        ]
+
+    def curve(self, method=None):
+        """Monthly curve built with `method`, by default settings.CURVE_METHOD.
+
+        Curves of the default method come from TreasuryCurve when stored; the
+        others are computed and kept in an in-process LRU.
+        """
+        engine = get_curve_engine(method)
+        if engine is not curve_engine:
+            par_values = self.par_values(engine.bill_months)
+            return curve_cache.get_or_compute(
+                (self.date, engine.version, *par_values),
+                lambda: engine.compute(par_values),
+            )
+
+        try:
+            stored = self.stored_curve
+        except TreasuryCurve.DoesNotExist:
+            stored = None
+
+        if stored is not None and stored.version == curve_engine.version:
+            return stored.curve()
+        return curve_engine.compute(self.par_values(curve_engine.bill_months))
+
+    @classmethod
+    def batch_curves(cls, tdatas, method=None):
+        engine = get_curve_engine(method)
+        return engine.compute(
+            [tdata.par_values(engine.bill_months) for tdata in tdatas]
+        )
+
+    def zero_rates(self, method=None):
+        zero_rates = self.curve(method).zero_rate[curve_engine.knot_index]
+        return dict(zip(self._maturity_order, zero_rates.tolist()))
+
+    def get_row_data(self, method=None):
+        return [DataRow(*row) for row in self.csv_rows(method)]
+
+    def csv_rows(self, method=None):
+        curve = self.curve(method)
+        return zip(
+            curve.months.tolist(),
+            _csv_column(curve.par),
+            curve.zero.tolist(),
+            curve.zero_rate.tolist(),
+            curve.df.tolist(),
+            curve.ln_df.tolist(),
+        )
+
+    @timed("csv_export")
     def to_csv(self):
         output = StringIO()
         csv_writer = csv.writer(output)
@@ -277,94 +345,448 @@ class TreasuryData(models.Model):
             ]
         )
 
-        for data in self.get_row_data():
-            csv_writer.writerow(
-                [
-                    data.months,
-                    data.par,
-                    data.zero,
-                    data.zero_rate,
-                    data.df,
-                    data.ln_df,
-                ]
-            )
+        csv_writer.writerows(self.csv_rows())
         output.seek(0)
         return output
 
     def generate_chart(self):
-        io = BytesIO()
-
-        data = self.get_row_data()
-        x_values = [x.months for x in data]
-        y_values = [y.zero * 100 for y in data]
-        plt.scatter(x_values, y_values)
-        plt.title("Continuous Monthly Zero Rates")
-        plt.xlabel("Months")
-        plt.ylabel("Interest Rates (%)")
-        plt.grid(True)
-        plt.savefig(io)
+        curve = self.curve()
         self.chart.save(
             f"{self.date.year}-{self.date.month}-{self.date.day}.png",
-            ContentFile(io.getvalue()),
+            ContentFile(render_chart(curve.months, curve.zero)),
             save=False,
         )
-        plt.close()
 
+    @classmethod
+    def render_stored_chart(cls, pk):
+        tdata = cls.objects.select_related("stored_curve").get(pk=pk)
+        tdata.generate_chart()
+        cls.objects.filter(pk=pk).update(chart=tdata.chart.name)
 
-class Excel:
-    def __init__(self):
-        self.wb = load_workbook(filename=EXCEL_TEMPLATE_FILE)
-        self.ws = None
 
-    def populate_data(self, par_values, zero_rates):
-        if self.ws is None:
-            raise Exception("Sheet must be added before populating data")
+class TreasuryCurve(models.Model):
+    treasury_data = models.OneToOneField(
+        TreasuryData,
+        on_delete=models.CASCADE,
+        related_name="stored_curve",
+    )
+    version = models.CharField(max_length=32)
+    data = models.BinaryField()
 
-        for idx, par_val in enumerate(par_values, start=PAR_VALUES_START_ROW):
-            self.ws[f"{PAR_VALUES_COL}{idx}"] = par_val / 100
+    def __str__(self):
+        return f"<{self.__class__.__name__} {self.treasury_data_id} {self.version}>"
 
-        for idx, zero_rate in enumerate(
-            list(zero_rates.values()), start=ZERO_RATES_START_ROW
-        ):
-            self.ws[f"{ZERO_RATES_COL}{idx}"] = zero_rate
+    def __repr__(self):
+        return str(self)
 
-        chart = ScatterChart()
-        chart.x_axis.title = "Future Monthly Periods"
-        chart.y_axis.title = "Interest Rate"
+    def curve(self):
+        return curve_engine.unpack(bytes(self.data))
 
-        par_x_values = Reference(
-            self.ws,
-            min_col=MINI_CHART_MONTH_COL_INDEX,
-            min_row=MINI_CHART_MIN_ROW,
-            max_row=MINI_CHART_MAX_ROW,
+    @classmethod
+    def store(cls, tdatas, curve=None):
+        """Store the curve of each of `tdatas`, computing `curve` if needed."""
+        tdatas = list(tdatas)
+        if not tdatas:
+            return []
+
+        if curve is None:
+            curve = TreasuryData.batch_curves(tdatas)
+        blobs = curve_engine.pack(curve)
+        stored_curves = []
+        for tdata, data in zip(tdatas, blobs):
+            stored_curve = cls(
+                treasury_data=tdata, version=curve_engine.version, data=data
+            )
+            tdata.stored_curve = stored_curve
+            stored_curves.append(stored_curve)
+
+        stored_curves = cls.objects.bulk_create(
+            stored_curves,
+            update_conflicts=True,
+            unique_fields=["treasury_data"],
+            update_fields=["version", "data"],
         )
+        curves_stored.send(sender=cls, tdatas=tdatas, curve=curve)
+        return stored_curves
 
-        par_values = Reference(
-            self.ws,
-            min_col=CHART_PAR_COL,
-            min_row=MINI_CHART_MIN_ROW,
-            max_row=MINI_CHART_MAX_ROW,
-        )
-        par_series = Series(par_values, par_x_values, title="Par")
 
-        zero_x_values = Reference(
-            self.ws,
-            min_col=CHART_MONTH_COL_INDEX,
-            min_row=CHART_MIN_ROW,
-            max_row=CHART_MAX_ROW,
+def _export_token():
+    return secrets.token_urlsafe(32)
+
+
+class ExportStorage(FileSystemStorage):
+    """ExportJob files, kept in EXPORT_CACHE_DIR rather than MEDIA_ROOT.
+
+    nginx serves MEDIA_ROOT to anyone; exports are only handed out by the
+    staff only export_download view.
+    """
+
+    @property
+    def base_location(self):
+        return settings.EXPORT_CACHE_DIR
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+
+class ExportJob(models.Model):
+    """An admin export built by the run_export_jobs command, see rates.jobs."""
+
+    class Format(models.TextChoices):
+        EXCEL = "xlsx", "Excel"
+        CSV = "zip", "CSV"
+        LONG_CSV = "csv", "CSV (long format)"
+        NPZ = "npz", "NumPy arrays"
+
+    class Status(models.TextChoices):
+        PENDING = "pending"
+        RUNNING = "running"
+        DONE = "done"
+        FAILED = "failed"
+
+    # Hash of the format and the exported rows, shared by identical exports
+    key = models.CharField(max_length=64)
+    format = models.CharField(max_length=4, choices=Format)
+    dates = models.JSONField()
+    filename = models.CharField(max_length=64)
+    status = models.CharField(
+        max_length=8, choices=Status, default=Status.PENDING, db_index=True
+    )
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField()
+    token = models.CharField(max_length=43, unique=True, default=_export_token)
+    file = models.FileField(blank=True, storage=ExportStorage())
+    error = models.TextField(blank=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+    # Bumped with the progress, so a crashed worker's job can be reclaimed
+    updated = models.DateTimeField(auto_now=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                "key",
+                condition=~models.Q(status="failed"),
+                name="unique_active_export",
+            ),
+        ]
+
+    def __str__(self):
+        return f"<{self.__class__.__name__} {self.format} {self.status}>"
+
+    def __repr__(self):
+        return str(self)
+
+    @property
+    def download_filename(self):
+        return f"{self.filename}.{self.format}"
+
+
+# One engine per registered method, sharing the knots. curve_engine builds
+# the curves stored in TreasuryCurve and used by the exports.
+curve_engines = {
+    method: engine_class([maturity.months for maturity in TreasuryData._maturity_order])
+    for method, engine_class in CURVE_ENGINES.items()
+}
+curve_engine = curve_engines[getattr(settings, "CURVE_METHOD", "log_linear")]
+curve_cache = CurveCache(getattr(settings, "CURVE_CACHE_SIZE", 1024))
+
+
+def get_curve_engine(method=None):
+    if method is None:
+        return curve_engine
+    try:
+        return curve_engines[method]
+    except KeyError:
+        raise ValueError(
+            f"Unknown curve method {method}, expected one of "
+            + ", ".join(sorted(curve_engines))
         )
-        zero_values = Reference(
-            self.ws,
-            min_col=CHART_ZERO_COL,
-            min_row=CHART_MIN_ROW,
-            max_row=CHART_MAX_ROW,
+
+
+def treasury_generation():
+    """Counter that changes whenever TreasuryData rows do.
+
+    Include it in cache keys of anything derived from the table. Changes made
+    with QuerySet.update() do not bump it.
+    """
+    return cache.get_or_set(TREASURY_GENERATION_KEY, 0, timeout=None)
+
+
+def bump_treasury_generation():
+    try:
+        cache.incr(TREASURY_GENERATION_KEY)
+    except ValueError:
+        cache.set(TREASURY_GENERATION_KEY, 1, timeout=None)
+
+
+@receiver(post_delete, sender=TreasuryData)
+def _bump_generation_on_delete(sender, **kwargs):
+    bump_treasury_generation()
+
+
+def _csv_column(values):
+    return ["" if math.isnan(value) else value for value in values.tolist()]
+
+
+class IngestionContext:
+    def __init__(self, date):
+        self.date = date
+        self.fetches = 0
+        self.charts = 0
+        self._values = None
+        self._error = None
+
+    def values(self):
+        if self._error is not None:
+            raise self._error
+
+        if self._values is None:
+            self.fetches += 1
+            logger.debug(f"Fetching Treasury data for {self.date}")
+            try:
+                table = parse_treasury_table(
+                    treasury_csv(TreasuryPeriod.for_date(self.date))
+                )
+                if self.date not in table:
+                    raise ValidationError(
+                        f"Treasury data for {self.date} was not found"
+                    )
+                self._values = table.row(self.date)
+            except Exception as e:
+                self._error = e
+                raise
+        return self._values
+
+
+class TreasuryTable:
+    """Every row of a Treasury CSV, column-wise.
+
+    `dates` keeps the file's row order, `index` maps a date to its row and
+    `columns` holds one read-only float64 array per TreasuryData field, NaN
+    where the file has no rate.
+    """
+
+    def __init__(self, dates, columns):
+        self.dates = dates
+        self.columns = columns
+        self.index = {data_date: idx for idx, data_date in enumerate(dates)}
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __contains__(self, data_date):
+        return data_date in self.index
+
+    def row(self, data_date):
+        idx = self.index[data_date]
+        values = {}
+        for field, column in self.columns.items():
+            val = column[idx].item()
+            values[field] = None if math.isnan(val) else val
+        return values
+
+    def rows(self):
+        for data_date in self.dates:
+            yield data_date, self.row(data_date)
+
+
+@functools.lru_cache(maxsize=PARSED_TABLE_CACHE_SIZE)
+@timed("csv_parse")
+def parse_treasury_table(content):
+    """Parse a Treasury CSV into a TreasuryTable.
+
+    The header is mapped to fields once and dates are read as the fixed
+    MM/DD/YYYY format Treasury publishes. Tables are cached by content, so
+    every lookup served by one download shares one parse.
+    """
+    reader = csv.reader(StringIO(content))
+    header = next(reader, None)
+    if not header:
+        raise ValidationError("Treasury data is empty")
+
+    try:
+        fields = [TreasuryData._treasury_map[key] for key in header[1:]]
+    except KeyError as e:
+        raise ValidationError(f"Unknown treasury data column {e}")
+
+    dates = []
+    rows = []
+    for row in reader:
+        if not row:
+            continue
+        try:
+            data_date = _parse_treasury_date(row[0])
+        except ValueError as e:
+            raise ValidationError(f"Got error parsing treasury date {row[0]!r}: {e}")
+
+        try:
+            rows.append([float(val) if val != "" else math.nan for val in row[1:]])
+        except ValueError as e:
+            raise ValidationError(
+                f"Got error getting treasury data for {data_date}: {e}"
+            )
+        dates.append(data_date)
+
+    values = np.array(rows, dtype=np.float64).reshape(len(rows), len(fields))
+    values.flags.writeable = False
+    return TreasuryTable(
+        dates, {field: values[:, idx] for idx, field in enumerate(fields)}
+    )
+
+
+def _parse_treasury_date(value):
+    if len(value) == 10 and value[2] == value[5] == "/":
+        return date(int(value[6:]), int(value[:2]), int(value[3:5]))
+    return datetime.strptime(value, "%m/%d/%Y").date()
+
+
+def parse_treasury_csv(content):
+    yield from parse_treasury_table(content).rows()
+
+
+def _curve_chart(ws):
+    chart = ScatterChart()
+    chart.x_axis.title = "Future Monthly Periods"
+    chart.y_axis.title = "Interest Rate"
+
+    par_x_values = Reference(
+        ws,
+        min_col=MINI_CHART_MONTH_COL_INDEX,
+        min_row=MINI_CHART_MIN_ROW,
+        max_row=MINI_CHART_MAX_ROW,
+    )
+
+    par_values = Reference(
+        ws,
+        min_col=CHART_PAR_COL,
+        min_row=MINI_CHART_MIN_ROW,
+        max_row=MINI_CHART_MAX_ROW,
+    )
+    par_series = Series(par_values, par_x_values, title="Par")
+
+    zero_x_values = Reference(
+        ws,
+        min_col=CHART_MONTH_COL_INDEX,
+        min_row=CHART_MIN_ROW,
+        max_row=CHART_MAX_ROW,
+    )
+    zero_values = Reference(
+        ws,
+        min_col=CHART_ZERO_COL,
+        min_row=CHART_MIN_ROW,
+        max_row=CHART_MAX_ROW,
+    )
+    zero_series = Series(zero_values, zero_x_values, title="Zero")
+
+    chart.series.append(par_series)
+    chart.series.append(zero_series)
+
+    return chart
+
+
+class ExcelTimings:
+    """Time spent loading the template, populating sheets and saving an export."""
+
+    def __init__(self):
+        self.template = 0.0
+        self.populate = 0.0
+        self.save = 0.0
+
+    @contextmanager
+    def measure(self, name):
+        start = time.perf_counter()
+        try:
+            with span(f"excel_{name}"):
+                yield
+        finally:
+            setattr(self, name, getattr(self, name) + time.perf_counter() - start)
+
+    def report(self, engine, sheets):
+        logger.info(
+            f"{engine} export of {sheets} sheets: "
+            f"template {self.template * 1000:.1f}ms, "
+            f"populate {self.populate * 1000:.1f}ms, "
+            f"save {self.save * 1000:.1f}ms"
         )
-        zero_series = Series(zero_values, zero_x_values, title="Zero")
 
-        chart.series.append(par_series)
-        chart.series.append(zero_series)
 
-        self.ws.add_chart(chart, "A2")
+class ExcelTemplateCache:
+    """The parsed template workbook, kept once per process.
+
+    Exports start from an unpickled clone, which is several times faster
+    than parsing the xlsx file. The cache is refreshed whenever the template
+    file's mtime changes.
+    """
+
+    def __init__(self, filename=EXCEL_TEMPLATE_FILE):
+        self.filename = filename
+        self._mtime = None
+        self._pickled = None
+        self._layout = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        mtime = os.stat(self.filename).st_mtime_ns
+        with self._lock:
+            if mtime != self._mtime:
+                wb = load_workbook(filename=self.filename)
+                self._pickled = _pickle_workbook(wb)
+                self._layout = ExcelTemplate(wb.active)
+                self._mtime = mtime
+            return self._pickled, self._layout
+
+    def workbook(self):
+        pickled, _ = self._refresh()
+        return pickle.loads(pickled)
+
+    def layout(self):
+        _, layout = self._refresh()
+        return layout
+
+
+class _WorkbookPickler(pickle.Pickler):
+    # IndexedList's default pickling appends through a class level dict,
+    # which drops entries it has seen in other lists. Rebuild it from its
+    # items instead.
+    dispatch_table = {
+        **copyreg.dispatch_table,
+        IndexedList: lambda indexed_list: (IndexedList, (list(indexed_list),)),
+    }
+
+
+def _pickle_workbook(wb):
+    output = BytesIO()
+    _WorkbookPickler(output, pickle.HIGHEST_PROTOCOL).dump(wb)
+    return output.getvalue()
+
+
+template_cache = ExcelTemplateCache()
+
+
+class Excel:
+    def __init__(self):
+        self.timings = ExcelTimings()
+        with self.timings.measure("template"):
+            self.wb = template_cache.workbook()
+        self.ws = None
+        self.sheets = 0
+
+    def populate_data(self, curve):
+        if self.ws is None:
+            raise Exception("Sheet must be added before populating data")
+
+        par_values = curve.par[curve_engine.knot_index].tolist()
+        for idx, par_val in enumerate(par_values, start=PAR_VALUES_START_ROW):
+            self.ws[f"{PAR_VALUES_COL}{idx}"] = par_val
+
+        zero_rates = curve.zero_rate[curve_engine.knot_index].tolist()
+        for idx, zero_rate in enumerate(zero_rates, start=ZERO_RATES_START_ROW):
+            self.ws[f"{ZERO_RATES_COL}{idx}"] = zero_rate
+
+        self.ws.add_chart(_curve_chart(self.ws), "A2")
 
     def add_sheet(self, treasury_data):
         if self.ws is None:
@@ -373,12 +795,155 @@ class Excel:
             source = self.ws
             self.ws = self.wb.copy_worksheet(source)
 
-        self.ws.sheet_view.showGridLines = False
-        self.ws.title = f"{treasury_data.date}"
-        self.populate_data(treasury_data.par_values(), treasury_data.zero_rates())
+        with self.timings.measure("populate"):
+            self.ws.sheet_view.showGridLines = False
+            self.ws.title = f"{treasury_data.date}"
+            self.populate_data(treasury_data.curve())
+        self.sheets += 1
 
     def stream(self):
         output = BytesIO()
-        self.wb.save(output)
+        with self.timings.measure("save"):
+            self.wb.save(output)
+        output.seek(0)
+        self.timings.report(self.__class__.__name__, self.sheets)
+        return output
+
+
+class ExcelTemplate:
+    """Cell values, styles and sheet settings of EXCEL_TEMPLATE_FILE.
+
+    Built once per process by ExcelTemplateCache so that WriteOnlyExcel can
+    replay the template row by row into write-only worksheets.
+    """
+
+    def __init__(self, ws):
+        # Keyed by a range's first column, each dimension covers min to max
+        self.column_widths = {
+            get_column_letter(idx): dimension.width
+            for dimension in ws.column_dimensions.values()
+            if dimension.customWidth
+            for idx in range(dimension.min, dimension.max + 1)
+        }
+        self.default_row_height = ws.row_dimensions[1].height
+
+        self.styles = []
+        style_ids = {}
+        self.rows = []
+        for row in ws.iter_rows():
+            cells = []
+            for cell in row:
+                style_id = None
+                if cell.has_style:
+                    style = (
+                        copy(cell.font),
+                        copy(cell.fill),
+                        copy(cell.border),
+                        copy(cell.alignment),
+                        cell.number_format,
+                        copy(cell.protection),
+                    )
+                    style_id = style_ids.setdefault(style, len(self.styles))
+                    if style_id == len(self.styles):
+                        self.styles.append(style)
+                cells.append((cell.value, style_id))
+            self.rows.append(cells)
+
+    def bind(self, ws):
+        """Build the template's rows as cells of `ws`'s workbook."""
+        styles = []
+        for style in self.styles:
+            cell = WriteOnlyCell(ws)
+            (
+                cell.font,
+                cell.fill,
+                cell.border,
+                cell.alignment,
+                cell.number_format,
+                cell.protection,
+            ) = style
+            styles.append(cell._style)
+
+        rows = []
+        for row in self.rows:
+            cells = []
+            for value, style_id in row:
+                if style_id is None:
+                    cells.append(value)
+                else:
+                    cell = WriteOnlyCell(ws, value)
+                    cell._style = copy(styles[style_id])
+                    cells.append(cell)
+            rows.append(cells)
+        return rows
+
+
+class WriteOnlyExcel:
+    """Excel export built with openpyxl's write-only mode.
+
+    Produces the same sheets as Excel, but each sheet is streamed to disk
+    as it is added instead of copying worksheets in memory.
+    """
+
+    def __init__(self):
+        self.timings = ExcelTimings()
+        with self.timings.measure("template"):
+            self.template = template_cache.layout()
+        self.wb = Workbook(write_only=True)
+        self._rows = None
+        self.sheets = 0
+
+    def add_sheet(self, treasury_data):
+        with self.timings.measure("populate"):
+            self._write_sheet(treasury_data)
+        self.sheets += 1
+
+    def _write_sheet(self, treasury_data):
+        ws = self.wb.create_sheet(title=f"{treasury_data.date}")
+        ws.sheet_view.showGridLines = False
+        ws.sheet_format.defaultRowHeight = self.template.default_row_height
+        ws.sheet_format.customHeight = True
+        for key, width in self.template.column_widths.items():
+            ws.column_dimensions[key].width = width
+
+        # Template cells are only written out on append, so the same cells
+        # are reused for every sheet of the workbook.
+        if self._rows is None:
+            self._rows = self.template.bind(ws)
+
+        curve = treasury_data.curve()
+        overrides = defaultdict(dict)
+        knot_columns = (
+            (PAR_VALUES_COL, PAR_VALUES_START_ROW, curve.par),
+            (ZERO_RATES_COL, ZERO_RATES_START_ROW, curve.zero_rate),
+        )
+        for col, start_row, values in knot_columns:
+            col_idx = column_index_from_string(col) - 1
+            for row_idx, value in enumerate(
+                values[curve_engine.knot_index].tolist(), start=start_row
+            ):
+                overrides[row_idx][col_idx] = value
+
+        for row_idx, cells in enumerate(self._rows, start=1):
+            if row_idx in overrides:
+                cells = self._override(ws, cells, overrides[row_idx])
+            ws.append(cells)
+        ws.add_chart(_curve_chart(ws), "A2")
+
+    @staticmethod
+    def _override(ws, cells, values):
+        cells = list(cells)
+        for col_idx, value in values.items():
+            cell = WriteOnlyCell(ws, value)
+            if isinstance(cells[col_idx], Cell):
+                cell._style = copy(cells[col_idx]._style)
+            cells[col_idx] = cell
+        return cells
+
+    def stream(self):
+        output = SpooledTemporaryFile(max_size=EXCEL_SPOOL_SIZE)
+        with self.timings.measure("save"):
+            self.wb.save(output)
         output.seek(0)
+        self.timings.report(self.__class__.__name__, self.sheets)
         return output
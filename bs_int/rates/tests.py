@@ -1,11 +1,86 @@
-from datetime import date
+import asyncio
+import csv
+import fcntl
+import math
+import os
+import shutil
+import threading
+import time
+import zipfile
+from copy import copy
+from datetime import date, datetime, timedelta
+from datetime import timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from pathlib import Path
+from urllib.parse import urlsplit
 
+import httpx
+import numpy as np
 import pytest
-from rates.models import Maturity, TreasuryData
+import requests
+from django.conf import settings as site_settings
+from django.core.cache import CacheHandler, cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from openpyxl import load_workbook
+from rates import admin, jobs, models, views, workers
+from rates.charts import render_chart
+from rates.exports import ExportCache
+from rates.history import curve_matrices, get_history, load_history
+from rates.metrics import Registry, span, span_errors, span_seconds
+from rates.models import (
+    EXCEL_TEMPLATE_FILE,
+    SUMMARY_FIELDS,
+    TREASURY_GENERATION_KEY,
+    Excel,
+    ExcelTemplateCache,
+    ExportJob,
+    Maturity,
+    TreasuryCurve,
+    TreasuryData,
+    curve_cache,
+    curve_engine,
+    curve_engines,
+    parse_treasury_csv,
+    parse_treasury_table,
+    treasury_generation,
+)
+from rates.treasury import (
+    AsyncSessionFetcher,
+    FetchResult,
+    LocalFetcher,
+    SessionFetcher,
+    TreasuryCache,
+    TreasuryPeriod,
+    atreasury_csv,
+    get_cache,
+    reset_cache,
+    treasury_csvs,
+)
+
+SITE_CACHES = site_settings.CACHES
 
 MOCK_DATA = 'Date,"1 Mo","2 Mo","3 Mo","4 Mo","6 Mo","1 Yr","2 Yr","3 Yr","5 Yr","7 Yr","10 Yr","20 Yr","30 Yr"\n04/05/2024,5.47,5.50,5.43,5.41,5.34,5.05,4.73,4.54,4.38,4.39,4.39,4.65,4.54\n04/04/2024,5.47,5.49,5.41,5.40,5.32,5.00,4.65,4.46,4.30,4.31,4.31,4.57,4.47\n04/03/2024,5.47,5.44,5.42,5.40,5.33,5.03,4.68,4.48,4.34,4.36,4.36,4.61,4.51\n04/02/2024,5.49,5.45,5.42,5.40,5.34,5.05,4.70,4.51,4.35,4.37,4.36,4.61,4.51\n04/01/2024,5.49,5.47,5.44,5.41,5.36,5.06,4.72,4.51,4.34,4.33,4.33,4.58,4.47'
 
 
+@pytest.fixture(autouse=True)
+def treasury_cache_dir(settings, tmp_path):
+    settings.TREASURY_CACHE_DIR = tmp_path / "treasury_cache"
+    settings.TREASURY_FETCHER = "rates.treasury.HTTPFetcher"
+    settings.CHART_RENDER_ASYNC = False
+    settings.MEDIA_ROOT = tmp_path / "media"
+    settings.CURVE_HISTORY_DIR = tmp_path / "curve_history"
+    settings.EXPORT_CACHE_DIR = tmp_path / "export_cache"
+    # The site's DatabaseCache needs database access, which most tests lack
+    settings.CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+    }
+    cache.clear()
+
+
 class TestEffectiveMaturities:
     @pytest.mark.parametrize(
         "test_maturity_months,expected",
@@ -41,10 +116,7 @@ class TestEffectiveMaturities:
 @pytest.mark.django_db
 class TestRetrieveTreasuryData:
     @pytest.fixture(autouse=True)
-    def setUp(self, mocker):
-        self.mock_get = mocker.patch("rates.models.requests.get")
-
-        self.mock_get.return_value.content.decode.return_value = MOCK_DATA
+    def setUp(self, mock_get):
         self.treasury_data = TreasuryData(date=date(2024, 4, 1))
 
     def test_retrieve(self):
@@ -66,3 +138,1834 @@ class TestRetrieveTreasuryData:
         assert self.treasury_data.ten_year == 4.33
         assert self.treasury_data.twenty_year == 4.58
         assert self.treasury_data.thirty_year == 4.47
+
+
+class TestParseTreasuryTable:
+    def test_columns(self):
+        table = parse_treasury_table(MOCK_DATA)
+
+        assert len(table) == 5
+        assert table.dates[0] == date(2024, 4, 5)
+        assert table.columns["ten_year"].tolist() == [4.39, 4.31, 4.36, 4.36, 4.33]
+        assert table.row(date(2024, 4, 2))["thirty_year"] == 4.51
+
+    def test_missing_rates(self):
+        content = MOCK_DATA.replace("04/03/2024,5.47,5.44,", "04/03/2024,,5.44,")
+
+        row = parse_treasury_table(content).row(date(2024, 4, 3))
+
+        assert row["one_month"] is None
+        assert row["two_month"] == 5.44
+
+    def test_parsed_once(self):
+        assert parse_treasury_table(MOCK_DATA) is parse_treasury_table(
+            "".join(MOCK_DATA)
+        )
+
+    def test_matches_csv_rows(self):
+        rows = list(csv.DictReader(MOCK_DATA.splitlines()))
+
+        assert [
+            (data_date, values["two_year"])
+            for data_date, values in parse_treasury_csv(MOCK_DATA)
+        ] == [
+            (datetime.strptime(row["Date"], "%m/%d/%Y").date(), float(row["2 Yr"]))
+            for row in rows
+        ]
+
+    @pytest.mark.parametrize(
+        "content",
+        (
+            "",
+            MOCK_DATA.replace("30 Yr", "40 Yr"),
+            MOCK_DATA.replace("04/03/2024", "2024-13-03"),
+            MOCK_DATA.replace("4.36,4.61", "n/a,4.61"),
+        ),
+    )
+    def test_invalid(self, content):
+        with pytest.raises(ValidationError):
+            parse_treasury_table(content)
+
+
+@pytest.mark.django_db
+class TestBackfill:
+    @pytest.fixture(autouse=True)
+    def setUp(self, mock_get):
+        self.mock_get = mock_get
+
+    def test_backfill_single_download(self):
+        call_command("backfill", "--start", "2024-04-02", "--end", "2024-04-04")
+
+        assert self.mock_get.call_count == 1
+        assert list(
+            TreasuryData.objects.order_by("date").values_list("date", flat=True)
+        ) == [date(2024, 4, 2), date(2024, 4, 3), date(2024, 4, 4)]
+        assert TreasuryData.objects.get(date=date(2024, 4, 3)).thirty_year == 4.51
+
+    def test_backfill_charts_output(self, mocker):
+        mocker.patch(
+            "rates.management.commands.render_charts.Command.handle",
+            lambda command, *args, **kwargs: command.stdout.write("Rendered"),
+        )
+        stdout = StringIO()
+
+        call_command(
+            "backfill",
+            "--start",
+            "2024-04-02",
+            "--end",
+            "2024-04-04",
+            "--charts",
+            stdout=stdout,
+        )
+
+        assert stdout.getvalue().endswith("inserted 3 of 3 dates\nRendered\n")
+
+    def test_backfill_skips_existing(self):
+        call_command("backfill", "--start", "2024-04-01", "--end", "2024-04-02")
+        call_command("backfill", "--start", "2024-04-01", "--end", "2024-04-05")
+
+        assert TreasuryData.objects.count() == 5
+
+
+@pytest.mark.django_db
+class TestSyncTreasury:
+    @pytest.fixture(autouse=True)
+    def setUp(self, mock_get, mocker):
+        self.mock_get = mock_get
+        self.mock_now = mocker.patch("django.utils.timezone.now")
+
+    def sync(self, today):
+        self.mock_now.return_value = datetime.combine(
+            today, datetime.min.time(), tzinfo=dt_timezone.utc
+        )
+        call_command("sync_treasury", stdout=StringIO())
+
+    def requested_urls(self):
+        return [call.args[0] for call in self.mock_get.call_args_list]
+
+    def test_initial_sync(self):
+        self.sync(date(2024, 4, 8))
+
+        assert self.requested_urls() == [TreasuryPeriod(2024, 4).url]
+        assert TreasuryData.objects.count() == 5
+        assert TreasuryCurve.objects.count() == 5
+
+    def test_only_new_dates(self):
+        TreasuryData(date=date(2024, 4, 3)).save()
+        self.mock_get.reset_mock()
+
+        self.sync(date(2024, 4, 8))
+
+        assert list(
+            TreasuryData.objects.order_by("date").values_list("date", flat=True)
+        ) == [date(2024, 4, 3), date(2024, 4, 4), date(2024, 4, 5)]
+
+    @pytest.mark.parametrize("today", (date(2024, 4, 5), date(2024, 4, 7)))
+    def test_up_to_date(self, today):
+        TreasuryData(date=date(2024, 4, 5)).save()
+        self.mock_get.reset_mock()
+        reset_cache()
+
+        self.sync(today)
+
+        assert self.mock_get.call_count == 0
+        assert get_cache().lookups == 0
+
+    def test_month_boundary(self):
+        TreasuryData(date=date(2024, 4, 4)).save()
+        self.mock_get.reset_mock()
+
+        self.sync(date(2024, 5, 1))
+
+        assert sorted(self.requested_urls()) == [
+            TreasuryPeriod(2024, 4).url,
+            TreasuryPeriod(2024, 5).url,
+        ]
+        assert TreasuryData.objects.latest("date").date == date(2024, 4, 5)
+
+    def test_idempotent(self):
+        self.sync(date(2024, 4, 8))
+        self.sync(date(2024, 4, 8))
+
+        assert TreasuryData.objects.count() == 5
+
+
+@pytest.mark.django_db
+class TestTreasuryCache:
+    @pytest.fixture(autouse=True)
+    def setUp(self, mock_get, tmp_path):
+        self.mock_get = mock_get
+        self.mock_get.return_value.headers = {"ETag": '"abc"'}
+        self.tmp_path = tmp_path
+
+    def test_one_download_per_year(self):
+        TreasuryData(date=date(2024, 4, 1)).save()
+        TreasuryData(date=date(2024, 4, 2)).save()
+
+        assert self.mock_get.call_count == 1
+
+    def test_persisted_between_processes(self):
+        get_cache().get(TreasuryPeriod(2024, None))
+        reset_cache()
+        get_cache().get(TreasuryPeriod(2024, None))
+
+        assert self.mock_get.call_count == 1
+
+    def test_current_month_revalidates(self, mocker):
+        fetcher = mocker.Mock(
+            side_effect=[
+                FetchResult(200, b"data", '"abc"', None),
+                FetchResult(304, None, None, None),
+            ]
+        )
+        cache = TreasuryCache(fetcher=fetcher, directory=self.tmp_path, ttl=0)
+        period = TreasuryPeriod(2024, 4)
+
+        assert cache.get(period, current_date=date(2024, 4, 10)) == b"data"
+        assert cache.get(period, current_date=date(2024, 4, 10)) == b"data"
+        assert fetcher.call_args.kwargs["headers"] == {"If-None-Match": '"abc"'}
+
+    def test_past_month_never_expires(self, mocker):
+        fetcher = mocker.Mock(return_value=FetchResult(200, b"data", None, None))
+        cache = TreasuryCache(fetcher=fetcher, directory=self.tmp_path, ttl=0)
+
+        cache.get(TreasuryPeriod(2024, 4), current_date=date(2024, 5, 1))
+        cache.get(TreasuryPeriod(2024, 4), current_date=date(2024, 5, 1))
+
+        assert fetcher.call_count == 1
+
+    def test_month_refetched_once_past(self, mocker):
+        fetcher = mocker.Mock(return_value=FetchResult(200, b"data", None, None))
+        cache = TreasuryCache(fetcher=fetcher, directory=self.tmp_path, ttl=0)
+        period = TreasuryPeriod(2024, 4)
+        mocker.patch(
+            "rates.treasury.time.time",
+            return_value=datetime(2024, 4, 30, 12, tzinfo=dt_timezone.utc).timestamp(),
+        )
+        cache.get(period, current_date=date(2024, 4, 30))
+
+        mocker.patch(
+            "rates.treasury.time.time",
+            return_value=datetime(2024, 5, 1, 12, tzinfo=dt_timezone.utc).timestamp(),
+        )
+        cache.get(period, current_date=date(2024, 5, 1))
+        cache.get(period, current_date=date(2024, 5, 1))
+
+        assert fetcher.call_count == 2
+
+    def test_local_fetcher(self, settings):
+        local_dir = self.tmp_path / "local"
+        local_dir.mkdir()
+        (local_dir / "2024.csv").write_text(MOCK_DATA)
+        settings.TREASURY_FETCHER = "rates.treasury.LocalFetcher"
+        settings.TREASURY_LOCAL_DIR = local_dir
+
+        TreasuryData(date=date(2024, 4, 3)).save()
+
+        assert TreasuryData.objects.get().ten_year == 4.36
+        assert not self.mock_get.called
+
+    def test_local_fetcher_missing(self):
+        with pytest.raises(requests.HTTPError):
+            LocalFetcher(self.tmp_path)(TreasuryPeriod(2023, None))
+
+
+class _StubTreasuryHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, self.client_address))
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            status, delay = (
+                server.responses.pop(0) if server.responses else server.default
+            )
+
+        try:
+            time.sleep(delay)
+            body = MOCK_DATA.encode("utf-8") if status == 200 else b""
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", '"abc"')
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_treasury():
+    """Local HTTP server answering with scripted (status, delay) responses."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubTreasuryHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = []
+    server.responses = []
+    server.default = (200, 0)
+    server.in_flight = server.max_in_flight = 0
+    server.url = f"http://127.0.0.1:{server.server_port}"
+
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    )
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.enable_socket
+class TestSessionFetcher:
+    @pytest.fixture(autouse=True)
+    def setUp(self, stub_treasury):
+        self.server = stub_treasury
+        self.fetcher = SessionFetcher(backoff=0, base_url=stub_treasury.url)
+
+    def test_fetch(self):
+        period = TreasuryPeriod(2024, 4)
+        result = self.fetcher(period)
+
+        assert result == FetchResult(200, MOCK_DATA.encode("utf-8"), '"abc"', None)
+        url = urlsplit(period.url)
+        assert self.server.requests[0][0] == f"{url.path}?{url.query}"
+
+    def test_connection_reused(self):
+        self.fetcher(TreasuryPeriod(2023, None))
+        self.fetcher(TreasuryPeriod(2024, None))
+
+        assert len({address for _, address in self.server.requests}) == 1
+
+    def test_retry_server_errors(self):
+        self.server.responses = [(503, 0), (502, 0)]
+
+        assert self.fetcher(TreasuryPeriod(2024, None)).status == 200
+        assert len(self.server.requests) == 3
+
+    def test_give_up(self):
+        self.server.default = (500, 0)
+
+        with pytest.raises(requests.HTTPError):
+            self.fetcher(TreasuryPeriod(2024, None))
+        assert len(self.server.requests) == self.fetcher.retries + 1
+
+    def test_client_error_not_retried(self):
+        self.server.responses = [(404, 0)]
+
+        with pytest.raises(requests.HTTPError):
+            self.fetcher(TreasuryPeriod(2024, None))
+        assert len(self.server.requests) == 1
+
+    def test_retry_read_timeout(self):
+        self.server.responses = [(200, 1)]
+        fetcher = SessionFetcher(read_timeout=0.2, backoff=0, base_url=self.server.url)
+
+        assert fetcher(TreasuryPeriod(2024, None)).status == 200
+        assert len(self.server.requests) == 2
+
+    def test_deadline(self):
+        self.server.default = (503, 0)
+        fetcher = SessionFetcher(retries=10, deadline=0, base_url=self.server.url)
+
+        with pytest.raises(requests.HTTPError):
+            fetcher(TreasuryPeriod(2024, None))
+        assert len(self.server.requests) == 1
+
+    def test_parallel_fetch_limit(self, settings):
+        settings.TREASURY_FETCHER = "rates.treasury.SessionFetcher"
+        settings.TREASURY_BASE_URL = self.server.url
+        settings.TREASURY_MAX_CONCURRENCY = 2
+        self.server.default = (200, 0.05)
+        periods = [TreasuryPeriod(year, None) for year in range(2010, 2020)]
+
+        contents = treasury_csvs(periods, max_workers=len(periods))
+
+        assert list(contents) == periods
+        assert set(contents.values()) == {MOCK_DATA}
+        assert self.server.max_in_flight == 2
+
+
+@pytest.mark.enable_socket
+class TestAsyncSessionFetcher:
+    @pytest.fixture(autouse=True)
+    def setUp(self, stub_treasury):
+        self.server = stub_treasury
+        self.fetcher = AsyncSessionFetcher(backoff=0, base_url=stub_treasury.url)
+
+    def test_fetch(self):
+        result = asyncio.run(self.fetcher(TreasuryPeriod(2024, 4)))
+
+        assert result == FetchResult(200, MOCK_DATA.encode("utf-8"), '"abc"', None)
+
+    def test_retry_server_errors(self):
+        self.server.responses = [(503, 0), (502, 0)]
+
+        assert asyncio.run(self.fetcher(TreasuryPeriod(2024, None))).status == 200
+        assert len(self.server.requests) == 3
+
+    def test_give_up(self):
+        self.server.default = (500, 0)
+
+        with pytest.raises(httpx.HTTPStatusError):
+            asyncio.run(self.fetcher(TreasuryPeriod(2024, None)))
+        assert len(self.server.requests) == self.fetcher.retries + 1
+
+    def test_retry_read_timeout(self):
+        self.server.responses = [(200, 1)]
+        fetcher = AsyncSessionFetcher(
+            read_timeout=0.2, backoff=0, base_url=self.server.url
+        )
+
+        assert asyncio.run(fetcher(TreasuryPeriod(2024, None))).status == 200
+        assert len(self.server.requests) == 2
+
+    def test_client_closed_with_loop(self):
+        async def fetch():
+            await self.fetcher(TreasuryPeriod(2024, None))
+            return await self.fetcher._client()
+
+        clients = [asyncio.run(fetch()) for _ in range(2)]
+
+        assert clients[0] is not clients[1]
+        assert all(client.is_closed for client in clients)
+
+    def test_concurrency_limit(self):
+        self.server.default = (200, 0.05)
+        fetcher = AsyncSessionFetcher(max_concurrency=2, base_url=self.server.url)
+
+        async def fetch_all():
+            return await asyncio.gather(
+                *(fetcher(TreasuryPeriod(year, None)) for year in range(2010, 2020))
+            )
+
+        assert {result.status for result in asyncio.run(fetch_all())} == {200}
+        assert self.server.max_in_flight == 2
+
+    def test_cache(self, settings):
+        settings.TREASURY_BASE_URL = self.server.url
+        period = TreasuryPeriod(2023, None)
+
+        assert asyncio.run(atreasury_csv(period)) == MOCK_DATA
+        assert asyncio.run(atreasury_csv(period)) == MOCK_DATA
+        assert len(self.server.requests) == 1
+        assert get_cache().get(period) == MOCK_DATA.encode("utf-8")
+
+
+@pytest.mark.django_db
+@pytest.mark.enable_socket
+class TestPublishedView:
+    @pytest.fixture(autouse=True)
+    def setUp(self, settings, stub_treasury):
+        self.server = stub_treasury
+        settings.TREASURY_BASE_URL = stub_treasury.url
+        settings.TREASURY_BACKOFF = 0
+
+    def test_published(self, client):
+        response = client.get("/rates/api/published/2024-04-02/")
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["date"] == "2024-04-02"
+        assert data["one_month"] == 5.49
+        assert data["thirty_year"] == 4.51
+        assert not TreasuryData.objects.exists()
+
+    def test_not_published(self, client):
+        assert client.get("/rates/api/published/2024-04-06/").status_code == 404
+        assert client.get("/rates/api/published/April/").status_code == 404
+
+    @pytest.mark.parametrize("date_str", ("0001-01-01", "1989-12-29", "2999-01-04"))
+    def test_out_of_range(self, client, date_str):
+        assert client.get(f"/rates/api/published/{date_str}/").status_code == 404
+        assert self.server.requests == []
+
+    def test_treasury_unavailable(self, client):
+        self.server.default = (503, 0)
+
+        assert client.get("/rates/api/published/2024-04-02/").status_code == 502
+
+
+class TestWorkers:
+    def test_inline(self):
+        assert workers.get_pool() is None
+        assert workers.run(os.getpid) == os.getpid()
+        assert asyncio.run(workers.arun(math.factorial, 5)) == 120
+
+    def test_inline_keeps_connections(self, mocker):
+        # The caller may be inside a transaction
+        close = mocker.spy(workers, "close_old_connections")
+        workers.run(os.getpid)
+        assert close.call_count == 0
+
+    def test_pool(self, settings):
+        settings.CPU_POOL_WORKERS = 1
+
+        pid = workers.run(os.getpid)
+        assert pid != os.getpid()
+        assert asyncio.run(workers.arun(os.getpid)) == pid
+        assert span_seconds.count(span="cpu_pool") >= 2
+
+
+@pytest.mark.django_db
+class TestAdminAdd:
+    @pytest.fixture(autouse=True)
+    def setUp(self, mock_get, mocker):
+        self.generate_chart = mocker.spy(TreasuryData, "generate_chart")
+
+    def test_single_fetch_and_render(
+        self, admin_client, django_capture_on_commit_callbacks
+    ):
+        with django_capture_on_commit_callbacks(execute=True):
+            response = admin_client.post(
+                "/admin/rates/treasurydata/add/", {"date": "2024-04-02"}
+            )
+
+        assert response.status_code == 302
+        assert TreasuryData.objects.get().two_year == 4.70
+        assert get_cache().lookups == 1
+        assert get_cache().downloads == 1
+        assert self.generate_chart.call_count == 1
+
+    def test_chart_rendered_after_commit(
+        self, admin_client, django_capture_on_commit_callbacks
+    ):
+        with django_capture_on_commit_callbacks() as callbacks:
+            admin_client.post("/admin/rates/treasurydata/add/", {"date": "2024-04-02"})
+
+        tdata = TreasuryData.objects.get()
+        assert not tdata.chart
+        assert "/rates/chart/?dates=2024-04-02" in tdata.image_tag()
+
+        for callback in callbacks:
+            callback()
+
+        tdata.refresh_from_db()
+        assert tdata.chart.read(8) == b"\x89PNG\r\n\x1a\n"
+
+    def test_missing_date(self, admin_client):
+        response = admin_client.post(
+            "/admin/rates/treasurydata/add/", {"date": "2024-04-06"}
+        )
+
+        assert response.status_code == 200
+        assert "was not found" in response.content.decode("utf-8")
+        assert get_cache().lookups == 1
+        assert self.generate_chart.call_count == 0
+
+
+class TestCurveEngine:
+    @pytest.fixture(autouse=True)
+    def setUp(self):
+        self.treasury_data = TreasuryData(
+            date=date(2024, 4, 1),
+            one_year=5.06,
+            two_year=4.72,
+            three_year=4.51,
+            five_year=4.34,
+            seven_year=4.33,
+            ten_year=4.33,
+            twenty_year=4.58,
+            thirty_year=4.47,
+        )
+
+    def test_knots(self):
+        curve = self.treasury_data.curve()
+
+        assert curve.months[0] == 12
+        assert curve.months[-1] == 360
+        assert curve.par[0] == pytest.approx(0.0506)
+        assert math.isnan(curve.par[1])
+        assert curve.df[0] == pytest.approx(1 / (1 + 0.0506 / 2) ** 2)
+        assert curve.zero[0] == pytest.approx((1 + 0.0506 / 2) ** 2 - 1)
+
+    def test_log_linear_between_knots(self):
+        curve = self.treasury_data.curve()
+
+        # Months 24 and 36 are knots, 30 is halfway between them
+        assert curve.ln_df[18] == pytest.approx((curve.ln_df[12] + curve.ln_df[24]) / 2)
+        assert curve.zero_rate[18] == pytest.approx(math.exp(-curve.ln_df[18] / 30) - 1)
+
+    def test_batch(self):
+        other = TreasuryData(
+            date=date(2024, 4, 2),
+            **{m.name: 4.0 for m in TreasuryData._maturity_order},
+        )
+        batch = TreasuryData.batch_curves([self.treasury_data, other])
+
+        assert batch.zero.shape == (2, 349)
+        assert batch.zero[0].tolist() == self.treasury_data.curve().zero.tolist()
+        assert batch.zero[1].tolist() == other.curve().zero.tolist()
+
+    def test_csv(self):
+        rows = list(csv.reader(self.treasury_data.to_csv()))
+
+        assert rows[0] == ["Months", "Par", "Zero", "", "DF", "ln(DF)"]
+        assert len(rows) == 350
+        assert rows[1][:2] == ["12", "0.0506"]
+        assert rows[2][1] == ""
+
+
+# Methods whose curves pass through the knot zero rates of log_linear
+INTERPOLATION_METHODS = ("cubic_spline", "log_linear", "monotone_convex")
+
+
+class TestCurveMethods:
+    @pytest.fixture(autouse=True)
+    def setUp(self):
+        curve_cache.clear()
+        self.treasury_data = TreasuryData(
+            date=date(2024, 4, 1),
+            one_year=5.06,
+            two_year=4.72,
+            three_year=4.51,
+            five_year=4.34,
+            seven_year=4.33,
+            ten_year=4.33,
+            twenty_year=4.58,
+            thirty_year=4.47,
+        )
+
+    @pytest.mark.parametrize("method", INTERPOLATION_METHODS)
+    def test_knots(self, method):
+        engine = curve_engines[method]
+        curve = self.treasury_data.curve(method)
+        default = curve_engine.compute(self.treasury_data.par_values())
+
+        assert curve.months.tolist() == default.months.tolist()
+        np.testing.assert_allclose(
+            curve.ln_df[engine.knot_index], default.ln_df[engine.knot_index]
+        )
+        assert np.all(np.diff(curve.df) < 0)
+
+    @pytest.mark.parametrize("method", sorted(curve_engines))
+    def test_flat(self, method):
+        engine = curve_engines[method]
+        curve = engine.compute([4.0] * (len(engine.bill_months) + 8))
+
+        np.testing.assert_allclose(curve.zero, (1 + 0.04 / 2) ** 2 - 1)
+
+    def test_monotone_convex_forwards(self):
+        curve = self.treasury_data.curve("monotone_convex")
+
+        # Forwards stay positive without being log-linear's piecewise flat ones
+        forwards = -np.diff(curve.ln_df)
+        assert np.all(forwards > 0)
+        assert not np.allclose(
+            curve.ln_df, self.treasury_data.curve("log_linear").ln_df
+        )
+
+    @pytest.mark.parametrize(
+        "par",
+        [
+            # Near zero bills under an inverted belly
+            [0.04, 0.15, 1.95, 1.17, 1.52, 1.24, 1.02, 0.92],
+            [0.66, 0.48, 1.31, 0.86, 0.82, 0.81, 0.64, 0.74],
+        ],
+    )
+    def test_monotone_convex_positive(self, par):
+        engine = curve_engines["monotone_convex"]
+        curve = engine.compute(par)
+        log_linear = curve_engines["log_linear"].compute(par)
+
+        # Log-linear forwards are the discrete ones, all positive here
+        assert np.all(np.diff(log_linear.ln_df) < 0)
+        assert np.all(np.diff(curve.ln_df) < 0)
+        np.testing.assert_allclose(
+            curve.ln_df[engine.knot_index], log_linear.ln_df[engine.knot_index]
+        )
+
+    def test_cached(self, mocker):
+        engine = curve_engines["cubic_spline"]
+        compute = mocker.spy(engine, "compute")
+
+        curve = self.treasury_data.curve("cubic_spline")
+        assert self.treasury_data.curve("cubic_spline") is curve
+        assert compute.call_count == 1
+        assert not curve.zero.flags.writeable
+
+        self.treasury_data.one_year = 5.0
+        assert self.treasury_data.curve("cubic_spline") is not curve
+        assert compute.call_count == 2
+
+    def test_batch(self):
+        batch = TreasuryData.batch_curves([self.treasury_data], "monotone_convex")
+
+        assert batch.zero[0].tolist() == (
+            self.treasury_data.curve("monotone_convex").zero.tolist()
+        )
+
+    def test_unknown_method(self):
+        with pytest.raises(ValueError, match="Unknown curve method"):
+            self.treasury_data.curve("nelson_siegel")
+
+
+class TestBootstrap:
+    @pytest.fixture(autouse=True)
+    def setUp(self):
+        curve_cache.clear()
+        self.treasury_data = TreasuryData(
+            date=date(2024, 4, 1),
+            one_month=5.49,
+            two_month=5.47,
+            three_month=5.44,
+            four_month=5.41,
+            six_month=5.36,
+            one_year=5.06,
+            two_year=4.72,
+            three_year=4.51,
+            five_year=4.34,
+            seven_year=4.33,
+            ten_year=4.33,
+            twenty_year=4.58,
+            thirty_year=4.47,
+        )
+
+    def price(self, curve, maturity, six_month_df):
+        # A par bond with semiannual coupons priced off the curve
+        df = dict(zip(curve.months.tolist(), curve.df.tolist()))
+        df[6] = six_month_df
+        coupon = getattr(self.treasury_data, maturity.name) / 200
+        payments = range(6, maturity.months + 1, 6)
+        return coupon * sum(df[month] for month in payments) + df[maturity.months]
+
+    @pytest.mark.parametrize("maturity", TreasuryData._maturity_order[1:])
+    def test_prices_par_bonds(self, maturity):
+        curve = self.treasury_data.curve("bootstrap")
+        # Without bills the 6 month DF is log-linear between 0 and 1 year
+        six_month_df = math.sqrt(curve.df[0])
+
+        assert self.price(curve, maturity, six_month_df) == pytest.approx(1)
+
+    @pytest.mark.parametrize("maturity", TreasuryData._maturity_order[1:])
+    def test_prices_par_bonds_with_bills(self, maturity):
+        curve = self.treasury_data.curve("bootstrap_bills")
+        six_month_df = 1 / (1 + 0.0536 / 2)
+
+        assert self.price(curve, maturity, six_month_df) == pytest.approx(1)
+
+    def test_one_year_is_zero_coupon(self):
+        curve = self.treasury_data.curve("bootstrap")
+
+        assert curve.zero[0] == pytest.approx((1 + 0.0506 / 2) ** 2 - 1)
+        assert curve.par[0] == pytest.approx(0.0506)
+        assert math.isnan(curve.par[1])
+
+    def test_missing_bills(self):
+        with_bills = self.treasury_data.curve("bootstrap_bills")
+        for maturity in TreasuryData._bill_order:
+            setattr(self.treasury_data, maturity.name, None)
+
+        # With no bills the 6 month DF is interpolated as without them
+        np.testing.assert_allclose(
+            self.treasury_data.curve("bootstrap_bills").df,
+            self.treasury_data.curve("bootstrap").df,
+        )
+        assert not np.allclose(with_bills.df, self.treasury_data.curve("bootstrap").df)
+
+    def test_batch_with_missing_bills(self):
+        other = copy(self.treasury_data)
+        other.date = date(2024, 4, 2)
+        other.four_month = other.six_month = None
+
+        batch = TreasuryData.batch_curves(
+            [self.treasury_data, other], "bootstrap_bills"
+        )
+
+        for row, tdata in zip(batch.ln_df, (self.treasury_data, other)):
+            np.testing.assert_allclose(row, tdata.curve("bootstrap_bills").ln_df)
+        # The 6 month DF comes from the 3 month bill and the 1 year
+        assert not np.allclose(batch.ln_df[0], batch.ln_df[1])
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures("mock_get")
+class TestStoredCurve:
+    def test_stored_on_save(self):
+        TreasuryData(date=date(2024, 4, 1)).save()
+
+        tdata = TreasuryData.objects.select_related("stored_curve").get()
+        assert tdata.stored_curve.version == curve_engine.version
+        assert (
+            tdata.curve().zero.tolist()
+            == curve_engine.compute(tdata.par_values()).zero.tolist()
+        )
+
+    def test_computed_once_on_save(self, mocker):
+        compute = mocker.spy(curve_engine, "compute")
+
+        TreasuryData(date=date(2024, 4, 1)).save()
+
+        assert compute.call_count == 1
+
+    def test_export_reads_stored_curve(self, mocker):
+        TreasuryData(date=date(2024, 4, 1)).save()
+        tdata = TreasuryData.objects.select_related("stored_curve").get()
+        compute = mocker.spy(curve_engine, "compute")
+
+        tdata.to_csv()
+
+        assert compute.call_count == 0
+
+    def test_stale_version_recomputed(self, mocker):
+        TreasuryData(date=date(2024, 4, 1)).save()
+        TreasuryCurve.objects.update(version="old")
+        tdata = TreasuryData.objects.select_related("stored_curve").get()
+        compute = mocker.spy(curve_engine, "compute")
+
+        tdata.curve()
+        assert compute.call_count == 1
+
+        call_command("rebuild_curves")
+        assert TreasuryCurve.objects.get().version == curve_engine.version
+
+    def test_backfill_stores_curves(self):
+        call_command("backfill", "--start", "2024-04-01", "--end", "2024-04-05")
+
+        assert TreasuryCurve.objects.count() == 5
+
+
+@pytest.mark.django_db
+class TestDownloadCSV:
+    @pytest.fixture(autouse=True)
+    def setUp(self, mock_get):
+        call_command("backfill", "--start", "2024-04-01", "--end", "2024-04-05")
+
+    def _download(self, client, tdatas):
+        return client.post(
+            "/admin/rates/treasurydata/",
+            {
+                "action": "download_csv",
+                "_selected_action": [tdata.pk for tdata in tdatas],
+            },
+        )
+
+    def test_single(self, admin_client):
+        response = self._download(
+            admin_client, TreasuryData.objects.filter(date=date(2024, 4, 2))
+        )
+
+        assert (
+            response["Content-Disposition"] == "attachment; filename=curve_2024-4-2.csv"
+        )
+        assert len(response.content.decode("utf-8").splitlines()) == 350
+
+    def test_streamed_zip(self, admin_client):
+        response = self._download(admin_client, TreasuryData.objects.all())
+
+        assert response.streaming
+        assert (
+            response["Content-Disposition"]
+            == "attachment; filename=curve_2024.4.1-2024.4.5.zip"
+        )
+
+        archive = zipfile.ZipFile(BytesIO(b"".join(response.streaming_content)))
+        assert archive.namelist() == [f"curve_2024-4-{day}.csv" for day in range(1, 6)]
+        assert (
+            archive.read("curve_2024-4-3.csv").decode("utf-8")
+            == TreasuryData.objects.get(date=date(2024, 4, 3)).to_csv().read()
+        )
+
+    def test_long_format(self, admin_client):
+        response = admin_client.post(
+            "/admin/rates/treasurydata/",
+            {
+                "action": "download_long_csv",
+                "_selected_action": [tdata.pk for tdata in TreasuryData.objects.all()],
+            },
+        )
+
+        assert response.streaming
+        rows = list(
+            csv.reader(
+                b"".join(response.streaming_content).decode("utf-8").splitlines()
+            )
+        )
+        assert rows[0] == [
+            "date",
+            "months",
+            "par",
+            "zero",
+            "zero_rate",
+            "df",
+            "ln_df",
+        ]
+        assert len(rows) == 1 + 5 * 349
+        assert rows[1][:3] == ["2024-04-01", "12", "0.0506"]
+        assert rows[-1][:2] == ["2024-04-05", "360"]
+
+    def test_export_command(self, tmp_path):
+        output = tmp_path / "curves.csv"
+        call_command(
+            "export_curves",
+            "--start",
+            "2024-04-02",
+            "--end",
+            "2024-04-03",
+            "--output",
+            str(output),
+        )
+
+        rows = list(csv.reader(output.open()))
+        assert len(rows) == 1 + 2 * 349
+        assert {row[0] for row in rows[1:]} == {"2024-04-02", "2024-04-03"}
+
+    def test_npz(self, admin_client):
+        response = admin_client.post(
+            "/admin/rates/treasurydata/",
+            {
+                "action": "download_npz",
+                "_selected_action": [tdata.pk for tdata in TreasuryData.objects.all()],
+            },
+        )
+
+        arrays = np.load(BytesIO(b"".join(response.streaming_content)))
+        assert arrays["dates"].tolist() == [date(2024, 4, day) for day in range(1, 6)]
+        assert arrays["zero"].shape == (5, 349)
+        assert arrays["par"][1].tolist() == [
+            rate / 100
+            for rate in TreasuryData.objects.get(date="2024-04-02").par_values()
+        ]
+
+        tdata = TreasuryData.objects.get(date="2024-04-03")
+        for name in ("zero", "df", "ln_df"):
+            assert arrays[name][2] == pytest.approx(
+                [getattr(row, name) for row in tdata.get_row_data()]
+            )
+
+    def test_npz_command(self, tmp_path):
+        output = tmp_path / "curves.npz"
+        call_command("export_npz", "--start", "2024-04-04", "--output", str(output))
+
+        arrays = np.load(output)
+        assert arrays["dates"].tolist() == [date(2024, 4, 4), date(2024, 4, 5)]
+        assert arrays["months"].tolist() == list(range(12, 361))
+        assert str(arrays["version"]) == curve_engine.version
+
+
+@pytest.mark.django_db
+class TestDownloadExcel:
+    @pytest.fixture(autouse=True)
+    def setUp(self, mock_get):
+        call_command("backfill", "--start", "2024-04-01", "--end", "2024-04-05")
+
+    @pytest.mark.parametrize(
+        "engine", ("rates.models.Excel", "rates.models.WriteOnlyExcel")
+    )
+    def test_download(self, admin_client, settings, engine):
+        settings.EXCEL_EXPORT_ENGINE = engine
+
+        response = admin_client.post(
+            "/admin/rates/treasurydata/",
+            {
+                "action": "download_excel",
+                "_selected_action": [tdata.pk for tdata in TreasuryData.objects.all()],
+            },
+        )
+
+        assert (
+            response["Content-Disposition"]
+            == "attachment; filename=curve_2024.4.1-2024.4.5.xlsx"
+        )
+        wb = load_workbook(BytesIO(b"".join(response.streaming_content)))
+        assert wb.sheetnames == [f"2024-04-0{day}" for day in range(1, 6)]
+
+        ws = wb["2024-04-03"]
+        assert ws["C19"].value == pytest.approx(0.0503)
+        assert ws["C26"].value == pytest.approx(0.0451)
+        assert ws["E19"].value == pytest.approx(
+            TreasuryData.objects.get(date=date(2024, 4, 3)).curve().zero_rate[0]
+        )
+        assert ws["O4"].value == "=$O$3+$G$32*(J4-$J$3)"
+        template = load_workbook(EXCEL_TEMPLATE_FILE).active
+        assert ws["N3"].number_format == template["N3"].number_format
+        assert _column_widths(ws) == _column_widths(template)
+
+
+def _column_widths(ws):
+    return {
+        idx: dimension.width
+        for dimension in ws.column_dimensions.values()
+        if dimension.customWidth
+        for idx in range(dimension.min, dimension.max + 1)
+    }
+
+
+class TestExportCache:
+    @pytest.fixture(autouse=True)
+    def setUp(self, tmp_path):
+        self.export_cache = ExportCache(tmp_path / "exports", max_bytes=10)
+
+    def _get(self, key, content):
+        def build(output):
+            output.write(content)
+
+        with self.export_cache.get_or_build(key, "zip", build) as f:
+            return f.read()
+
+    def test_hit(self, mocker):
+        build = mocker.Mock(side_effect=lambda output: output.write(b"abc"))
+
+        for _ in range(2):
+            with self.export_cache.get_or_build("a", "zip", build) as f:
+                assert f.read() == b"abc"
+        assert build.call_count == 1
+
+    def test_least_recently_used_evicted(self):
+        self._get("a", b"aaaa")
+        self._get("b", b"bbbb")
+        for age, key in enumerate("ba", start=1):
+            os.utime(self.export_cache.directory / f"{key}.zip", (0, time.time() - age))
+
+        # A hit makes "a" the most recently used
+        self._get("a", b"")
+        self._get("c", b"cccc")
+
+        assert sorted(path.name for path in self.export_cache.directory.iterdir()) == [
+            "a.zip",
+            "c.zip",
+        ]
+
+    def test_oversized_export_served(self):
+        assert self._get("a", b"a" * 20) == b"a" * 20
+
+    def test_failed_build(self):
+        with pytest.raises(ValueError):
+            self.export_cache.get_or_build("a", "zip", _failing_build)
+        assert list(self.export_cache.directory.iterdir()) == []
+
+    def test_tee(self):
+        chunks = self.export_cache.tee("a", "zip", iter([b"ab", b"c"]))
+
+        assert next(chunks) == b"ab"
+        assert self.export_cache.get("a", "zip") is None
+        assert list(chunks) == [b"c"]
+        with self.export_cache.get("a", "zip") as f:
+            assert f.read() == b"abc"
+
+    def test_tee_closed_early(self):
+        chunks = self.export_cache.tee("a", "zip", iter([b"ab", b"c"]))
+        next(chunks)
+        chunks.close()
+
+        assert list(self.export_cache.directory.iterdir()) == []
+
+
+def _failing_build(output):
+    output.write(b"partial")
+    raise ValueError("build failed")
+
+
+@pytest.mark.django_db
+class TestCachedDownloads:
+    @pytest.fixture(autouse=True)
+    def setUp(self, mock_get, mocker):
+        call_command("backfill", "--start", "2024-04-01", "--end", "2024-04-05")
+        self.run = mocker.spy(workers, "run")
+        self.csv_files = mocker.spy(admin, "csv_files")
+
+    def _download(self, client, action):
+        response = client.post(
+            "/admin/rates/treasurydata/",
+            {
+                "action": action,
+                "_selected_action": [tdata.pk for tdata in TreasuryData.objects.all()],
+            },
+        )
+        return b"".join(response.streaming_content)
+
+    def test_excel_cached(self, admin_client):
+        content = self._download(admin_client, "download_excel")
+        assert self._download(admin_client, "download_excel") == content
+        assert self.run.call_count == 1
+
+    def test_zip_cached(self, admin_client, mocker):
+        tee = mocker.spy(admin.export_cache, "tee")
+        content = self._download(admin_client, "download_csv")
+        assert self._download(admin_client, "download_csv") == content
+        assert self.csv_files.call_count == 1
+        assert tee.call_count == 1
+
+    def test_changed_row_rebuilt(self, admin_client):
+        self._download(admin_client, "download_excel")
+        tdata = TreasuryData.objects.get(date=date(2024, 4, 3))
+        tdata.ten_year = 4.5
+        tdata.save()
+
+        wb = load_workbook(BytesIO(self._download(admin_client, "download_excel")))
+        assert self.run.call_count == 2
+        assert wb["2024-04-03"]["C24"].value == pytest.approx(0.045)
+
+
+@pytest.mark.django_db
+class TestExportJobs:
+    @pytest.fixture(autouse=True)
+    def setUp(self, mock_get, settings):
+        call_command("backfill", "--start", "2024-04-01", "--end", "2024-04-05")
+        settings.EXPORT_JOB_MIN_DATES = 2
+
+    def _submit(self, client, action):
+        return client.post(
+            "/admin/rates/treasurydata/",
+            {
+                "action": action,
+                "_selected_action": [tdata.pk for tdata in TreasuryData.objects.all()],
+            },
+        )
+
+    def test_queued_excel(self, admin_client):
+        response = self._submit(admin_client, "download_excel")
+
+        job = ExportJob.objects.get()
+        assert response.status_code == 302
+        assert response["Location"] == f"/admin/rates/treasurydata/exports/{job.token}/"
+        assert job.status == ExportJob.Status.PENDING
+        assert job.total == 5
+
+        page = admin_client.get(response["Location"])
+        assert f'/rates/exports/{job.token}/"' in page.content.decode("utf-8")
+
+        status = admin_client.get(f"/rates/exports/{job.token}/status/").json()
+        assert status["status"] == "pending"
+        assert status["download"] is None
+        assert admin_client.get(f"/rates/exports/{job.token}/").status_code == 404
+
+        call_command("run_export_jobs", "--once")
+
+        status = admin_client.get(f"/rates/exports/{job.token}/status/").json()
+        assert status["status"] == "done"
+        assert status["progress"] == 5
+        assert status["download"] == f"/rates/exports/{job.token}/"
+
+        response = admin_client.get(status["download"])
+        assert (
+            response["Content-Disposition"]
+            == 'attachment; filename="curve_2024.4.1-2024.4.5.xlsx"'
+        )
+        wb = load_workbook(BytesIO(b"".join(response.streaming_content)))
+        assert wb.sheetnames == [f"2024-04-0{day}" for day in range(1, 6)]
+
+    def test_staff_only(self, admin_client, client):
+        self._submit(admin_client, "download_csv")
+        call_command("run_export_jobs", "--once")
+        job = ExportJob.objects.get()
+
+        for url in (
+            f"/rates/exports/{job.token}/status/",
+            f"/rates/exports/{job.token}/",
+        ):
+            response = client.get(url)
+            assert response.status_code == 302
+            assert response["Location"].startswith("/admin/login/")
+
+    def test_queued_zip(self, admin_client):
+        self._submit(admin_client, "download_csv")
+        call_command("run_export_jobs", "--once")
+
+        job = ExportJob.objects.get()
+        archive = zipfile.ZipFile(job.file.open("rb"))
+        assert archive.namelist() == [f"curve_2024-4-{day}.csv" for day in range(1, 6)]
+
+    def test_queued_long_csv(self, admin_client):
+        self._submit(admin_client, "download_long_csv")
+        call_command("run_export_jobs", "--once")
+
+        job = ExportJob.objects.get()
+        rows = list(csv.reader(job.file.open("r")))
+        assert len(rows) == 1 + 5 * 349
+
+    def test_stored_outside_media_root(self, admin_client, settings):
+        self._submit(admin_client, "download_csv")
+        call_command("run_export_jobs", "--once")
+
+        path = Path(ExportJob.objects.get().file.path)
+        assert path.parent == Path(settings.EXPORT_CACHE_DIR)
+        assert not (Path(settings.MEDIA_ROOT) / path.name).exists()
+
+    def test_files_bounded_by_export_cache(self, admin_client, settings):
+        settings.EXPORT_CACHE_SIZE = 1
+        self._submit(admin_client, "download_csv")
+        call_command("run_export_jobs", "--once")
+        first = ExportJob.objects.get()
+
+        self._submit(admin_client, "download_npz")
+        call_command("run_export_jobs", "--once")
+
+        assert not os.path.exists(first.file.path)
+        assert admin_client.get(f"/rates/exports/{first.token}/").status_code == 404
+
+    def test_old_jobs_pruned(self, admin_client, settings):
+        self._submit(admin_client, "download_csv")
+        call_command("run_export_jobs", "--once")
+        job = ExportJob.objects.get()
+
+        call_command("run_export_jobs", "--once")
+        assert ExportJob.objects.count() == 1
+
+        ExportJob.objects.update(
+            finished=job.finished - timedelta(seconds=settings.EXPORT_JOB_MAX_AGE + 1)
+        )
+        call_command("run_export_jobs", "--once")
+        assert not ExportJob.objects.exists()
+        assert not os.path.exists(job.file.path)
+
+    def test_deduplicated(self, admin_client):
+        self._submit(admin_client, "download_excel")
+        self._submit(admin_client, "download_excel")
+        assert ExportJob.objects.count() == 1
+
+        call_command("run_export_jobs", "--once")
+        self._submit(admin_client, "download_excel")
+        assert ExportJob.objects.get().status == ExportJob.Status.DONE
+
+        self._submit(admin_client, "download_npz")
+        assert ExportJob.objects.count() == 2
+
+    def test_changed_rows_rebuilt(self, admin_client):
+        self._submit(admin_client, "download_excel")
+        call_command("run_export_jobs", "--once")
+
+        TreasuryData.objects.filter(date=date(2024, 4, 3)).update(ten_year=4.5)
+        self._submit(admin_client, "download_excel")
+        assert ExportJob.objects.filter(status=ExportJob.Status.PENDING).count() == 1
+
+    def test_removed_file_rebuilt(self, admin_client):
+        self._submit(admin_client, "download_excel")
+        call_command("run_export_jobs", "--once")
+        job = ExportJob.objects.get()
+        job.file.delete(save=False)
+
+        self._submit(admin_client, "download_excel")
+        job.refresh_from_db()
+        assert job.status == ExportJob.Status.FAILED
+        assert ExportJob.objects.exclude(pk=job.pk).get().status == "pending"
+
+    def test_failed(self, admin_client, settings):
+        settings.EXCEL_EXPORT_ENGINE = "rates.models.MissingExcel"
+        self._submit(admin_client, "download_excel")
+        call_command("run_export_jobs", "--once")
+
+        job = ExportJob.objects.get()
+        assert job.status == ExportJob.Status.FAILED
+        assert "MissingExcel" in job.error
+        assert not job.file
+
+        # Failed jobs are not reused
+        self._submit(admin_client, "download_excel")
+        assert ExportJob.objects.filter(status=ExportJob.Status.PENDING).count() == 1
+
+    def test_stale_job_reclaimed(self, admin_client, settings):
+        self._submit(admin_client, "download_excel")
+        job = jobs.claim_job()
+        assert jobs.claim_job() is None
+
+        ExportJob.objects.filter(pk=job.pk).update(
+            updated=job.updated - timedelta(seconds=settings.EXPORT_JOB_STALE_AFTER + 1)
+        )
+        assert jobs.claim_job() == job
+
+    def test_small_selection_inline(self, admin_client, settings):
+        settings.EXPORT_JOB_MIN_DATES = 5
+
+        response = self._submit(admin_client, "download_excel")
+        assert response.status_code == 200
+        assert not ExportJob.objects.exists()
+
+
+class TestExcelTemplateCache:
+    @pytest.fixture(autouse=True)
+    def setUp(self, tmp_path):
+        self.template_file = tmp_path / "template.xlsx"
+        shutil.copy(EXCEL_TEMPLATE_FILE, self.template_file)
+        self.cache = ExcelTemplateCache(self.template_file)
+
+    def test_clones_are_independent(self):
+        first = self.cache.workbook()
+        first.active["C19"] = 1
+
+        assert self.cache.workbook().active["C19"].value == 0.0153
+
+    def test_clone_keeps_styles(self):
+        self.cache.workbook()
+        output = BytesIO()
+        self.cache.workbook().save(output)
+
+        ws = load_workbook(output).active
+        template = load_workbook(EXCEL_TEMPLATE_FILE).active
+        for coordinate in ("J2", "M3", "N3", "S6"):
+            assert ws[coordinate].number_format == template[coordinate].number_format
+            assert ws[coordinate].font.b == template[coordinate].font.b
+
+    def test_reloaded_when_modified(self, mocker):
+        load = mocker.spy(models, "load_workbook")
+
+        self.cache.workbook()
+        self.cache.layout()
+        assert load.call_count == 1
+
+        stat = self.template_file.stat()
+        os.utime(self.template_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        self.cache.workbook()
+        assert load.call_count == 2
+
+    def test_timings(self):
+        excel = Excel()
+        excel.add_sheet(
+            TreasuryData(
+                date=date(2024, 4, 1),
+                **{m.name: 4.0 for m in TreasuryData._maturity_order},
+            )
+        )
+        excel.stream()
+
+        assert excel.sheets == 1
+        assert excel.timings.template > 0
+        assert excel.timings.populate > 0
+        assert excel.timings.save > 0
+
+
+@pytest.mark.django_db
+class TestRenderCharts:
+    @pytest.fixture(autouse=True)
+    def setUp(self, mock_get):
+        call_command("backfill", "--start", "2024-04-01", "--end", "2024-04-03")
+
+    def test_render_chart(self):
+        curve = TreasuryData.objects.first().curve()
+
+        assert render_chart(curve.months, curve.zero).startswith(b"\x89PNG")
+        assert b"<svg" in render_chart(curve.months, curve.zero, format="svg")
+
+    def test_render_missing(self):
+        call_command("render_charts", "--start", "2024-04-02", "--workers", "1")
+
+        rendered = {
+            tdata.date: bool(tdata.chart) for tdata in TreasuryData.objects.all()
+        }
+        assert rendered == {
+            date(2024, 4, 1): False,
+            date(2024, 4, 2): True,
+            date(2024, 4, 3): True,
+        }
+
+
+@pytest.mark.django_db
+class TestChartView:
+    @pytest.fixture(autouse=True)
+    def setUp(self, mock_get, mocker):
+        for day in (1, 2):
+            TreasuryData(date=date(2024, 4, day)).save()
+        views.chart_cache.clear()
+        self.render_curves = mocker.spy(views, "render_curves")
+
+    def test_png(self, admin_client):
+        response = admin_client.get("/rates/chart/", {"dates": "2024-04-02"})
+
+        assert response.status_code == 200
+        assert response["Content-Type"] == "image/png"
+        assert response.content.startswith(b"\x89PNG")
+        assert response["ETag"]
+        assert "max-age=86400" in response["Cache-Control"]
+        assert "private" in response["Cache-Control"]
+
+    def test_svg_overlay(self, admin_client):
+        response = admin_client.get(
+            "/rates/chart/", {"dates": "2024-04-01,2024-04-02", "format": "svg"}
+        )
+
+        assert response.status_code == 200
+        assert response["Content-Type"] == "image/svg+xml"
+        assert b"2024-04-01 zero" in response.content
+        assert b"2024-04-02 zero" in response.content
+
+    def test_not_modified(self, admin_client):
+        params = {"dates": "2024-04-02", "width": 600, "height": 400}
+        etag = admin_client.get("/rates/chart/", params)["ETag"]
+
+        response = admin_client.get("/rates/chart/", params, HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == 304
+        assert self.render_curves.call_count == 1
+
+    def test_cached_render(self, admin_client):
+        for _ in range(2):
+            response = admin_client.get("/rates/chart/", {"dates": "2024-04-02"})
+            assert response.status_code == 200
+
+        assert self.render_curves.call_count == 1
+
+    def test_etag_changes_with_data(self, admin_client):
+        etag = admin_client.get("/rates/chart/", {"dates": "2024-04-02"})["ETag"]
+        TreasuryData.objects.filter(date="2024-04-02").update(thirty_year=5.0)
+
+        response = admin_client.get(
+            "/rates/chart/", {"dates": "2024-04-02"}, HTTP_IF_NONE_MATCH=etag
+        )
+
+        assert response.status_code == 200
+        assert response["ETag"] != etag
+
+    @pytest.mark.parametrize(
+        "params",
+        (
+            {},
+            {"dates": "not-a-date"},
+            {"dates": "2024-04-02", "width": 5000},
+            {"dates": "2024-04-02", "width": 641},
+            {"dates": "2024-04-02", "format": "gif"},
+        ),
+    )
+    def test_bad_request(self, admin_client, params):
+        assert admin_client.get("/rates/chart/", params).status_code == 400
+
+    def test_missing_date(self, admin_client):
+        response = admin_client.get("/rates/chart/", {"dates": "2024-04-02,2024-04-06"})
+
+        assert response.status_code == 404
+
+    def test_staff_only(self, client, django_user_model):
+        response = client.get("/rates/chart/", {"dates": "2024-04-02"})
+        assert response.status_code == 302
+        assert response["Location"].startswith("/admin/login/")
+
+        client.force_login(django_user_model.objects.create_user("analyst"))
+        assert client.get("/rates/chart/", {"dates": "2024-04-02"}).status_code == 302
+        assert self.render_curves.call_count == 0
+
+    def test_render_limit(self, admin_client, settings):
+        settings.CHART_MAX_RENDERS = 1
+        views._render_slots.acquire()
+
+        response = admin_client.get("/rates/chart/", {"dates": "2024-04-02"})
+        assert response.status_code == 503
+        assert response["Retry-After"] == "1"
+
+        views._render_slots.release()
+        assert (
+            admin_client.get("/rates/chart/", {"dates": "2024-04-02"}).status_code
+            == 200
+        )
+        # The slot is given back after rendering
+        assert views._render_slots.acquire(blocking=False)
+
+
+@pytest.mark.django_db
+class TestApi:
+    @pytest.fixture(autouse=True)
+    def setUp(self, mock_get, client, django_user_model):
+        user = django_user_model.objects.create_user("reader")
+        client.force_login(user)
+        for day in range(1, 6):
+            TreasuryData(date=date(2024, 4, day)).save()
+
+    def test_keyset_pagination(self, client):
+        response = client.get("/rates/api/treasury/", {"limit": 2})
+        data = response.json()
+
+        assert response.status_code == 200
+        assert [row["date"] for row in data["results"]] == ["2024-04-01", "2024-04-02"]
+        assert data["results"][0]["two_year"] == 4.72
+
+        dates = []
+        url = "/rates/api/treasury/?limit=2"
+        while url:
+            data = client.get(url).json()
+            dates.extend(row["date"] for row in data["results"])
+            url = data["next"]
+
+        assert dates == [f"2024-04-0{day}" for day in range(1, 6)]
+
+    def test_field_projection(self, client):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(
+                "/rates/api/treasury/", {"fields": "ten_year,two_year", "limit": 1}
+            )
+
+        assert response.json()["results"] == [
+            {"date": "2024-04-01", "two_year": 4.72, "ten_year": 4.33}
+        ]
+        (sql,) = [
+            query["sql"]
+            for query in queries.captured_queries
+            if query["sql"].startswith('SELECT "rates_treasurydata"')
+        ]
+        assert "thirty_year" not in sql
+
+    def test_list_not_modified(self, client):
+        etag = client.get("/rates/api/treasury/")["ETag"]
+
+        response = client.get("/rates/api/treasury/", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+
+        TreasuryData.objects.filter(date="2024-04-03").update(ten_year=4.0)
+        response = client.get("/rates/api/treasury/", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+
+    def test_curve(self, client):
+        tdata = TreasuryData.objects.get(date="2024-04-02")
+        rows = tdata.get_row_data()
+
+        response = client.get("/rates/api/curves/2024-04-02/")
+        data = response.json()
+
+        assert response.status_code == 200
+        assert data["months"] == [row.months for row in rows]
+        assert data["zero"] == [row.zero for row in rows]
+        assert data["par"][0] == rows[0].par
+        assert data["par"][1] is None
+
+    def test_curve_method(self, client):
+        tdata = TreasuryData.objects.get(date="2024-04-02")
+        rows = tdata.get_row_data("cubic_spline")
+
+        response = client.get(
+            "/rates/api/curves/2024-04-02/", {"method": "cubic_spline"}
+        )
+        data = response.json()
+
+        assert data["version"] == curve_engines["cubic_spline"].version
+        assert data["zero"] == [row.zero for row in rows]
+        assert response["ETag"] != client.get("/rates/api/curves/2024-04-02/")["ETag"]
+
+    def test_curve_fields_and_etag(self, client):
+        response = client.get("/rates/api/curves/2024-04-02/", {"fields": "df"})
+
+        assert set(response.json()) == {"date", "version", "months", "df"}
+
+        response = client.get(
+            "/rates/api/curves/2024-04-02/",
+            {"fields": "df"},
+            HTTP_IF_NONE_MATCH=response["ETag"],
+        )
+        assert response.status_code == 304
+
+    @pytest.mark.parametrize(
+        "url",
+        (
+            "/rates/api/treasury/?fields=chart",
+            "/rates/api/treasury/?limit=0",
+            "/rates/api/treasury/?after=yesterday-ish",
+            "/rates/api/curves/2024-04-02/?fields=months,foo",
+            "/rates/api/curves/2024-04-02/?method=nelson_siegel",
+        ),
+    )
+    def test_bad_request(self, client, url):
+        assert client.get(url).status_code == 400
+
+    def test_missing_curve(self, client):
+        assert client.get("/rates/api/curves/2024-04-06/").status_code == 404
+        assert client.get("/rates/api/curves/April/").status_code == 404
+
+    def test_par_rates_only(self, client):
+        (row,) = client.get("/rates/api/treasury/", {"limit": 1}).json()["results"]
+
+        assert "thirty_year" in row
+        assert not set(row).intersection(SUMMARY_FIELDS)
+        response = client.get("/rates/api/treasury/", {"fields": "ten_two_spread"})
+        assert response.status_code == 400
+
+    @pytest.mark.parametrize(
+        "url", ("/rates/api/treasury/", "/rates/api/curves/2024-04-02/")
+    )
+    def test_login_required(self, client, url):
+        client.logout()
+
+        assert client.get(url).status_code == 403
+
+    def test_throttled(self, client, admin_client, settings):
+        settings.API_THROTTLE_RATE = 2
+        # Wide enough that the requests share a window
+        settings.API_THROTTLE_WINDOW = 24 * 60 * 60
+
+        for _ in range(2):
+            assert client.get("/rates/api/treasury/").status_code == 200
+        response = client.get("/rates/api/curves/2024-04-02/")
+        assert response.status_code == 429
+        assert 0 < int(response["Retry-After"]) <= settings.API_THROTTLE_WINDOW
+        # Counted per user
+        assert admin_client.get("/rates/api/treasury/").status_code == 200
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures("mock_get")
+class TestCurveHistory:
+    def _save(self, *days):
+        for day in days:
+            TreasuryData(date=date(2024, 4, day)).save()
+
+    def assert_matches_database(self, history):
+        tdatas = list(TreasuryData.objects.order_by("date"))
+        assert history.dates.tolist() == [tdata.date for tdata in tdatas]
+        for idx, tdata in enumerate(tdatas):
+            rows = tdata.get_row_data()
+            assert history.zero[idx].tolist() == [row.zero for row in rows]
+            assert history.ln_df[idx].tolist() == [row.ln_df for row in rows]
+
+    def test_empty(self):
+        history = load_history()
+
+        assert history.zero.shape == (0, 349)
+        assert len(history.dates) == 0
+
+    def test_curve_matrices_from_history(self, mocker):
+        self._save(1, 2, 3)
+        history = load_history()
+        # Only the history still has the curves
+        TreasuryCurve.objects.all().delete()
+        compute = mocker.spy(curve_engine, "compute")
+
+        dates, par, curve = curve_matrices(
+            TreasuryData.objects.filter(date__gte="2024-04-02").order_by("date")
+        )
+
+        assert compute.call_count == 0
+        assert dates.tolist() == [date(2024, 4, 2), date(2024, 4, 3)]
+        assert curve.zero.tolist() == history.zero[1:].tolist()
+        assert par[0].tolist() == [
+            rate / 100
+            for rate in TreasuryData.objects.get(date="2024-04-02").par_values()
+        ]
+
+    def test_curve_matrices_from_stored_curves(self, mocker):
+        self._save(1, 2)
+        TreasuryCurve.objects.filter(treasury_data__date="2024-04-02").update(
+            version="old"
+        )
+        expected = [
+            [row.zero for row in tdata.get_row_data()]
+            for tdata in TreasuryData.objects.order_by("date")
+        ]
+        compute = mocker.spy(curve_engine, "compute")
+
+        _, _, curve = curve_matrices(TreasuryData.objects.order_by("date"))
+
+        # The history was never built; only the stale curve is computed
+        assert compute.call_count == 1
+        assert curve.zero.tolist() == expected
+
+    def test_waits_for_other_processes(self):
+        history = get_history()
+        history.directory.mkdir(parents=True)
+
+        # A separate open file description, like another process's
+        with open(history.directory / ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            thread = threading.Thread(
+                target=history.append, args=([date(2024, 4, 1)], None)
+            )
+            thread.start()
+            thread.join(0.2)
+            assert thread.is_alive()
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+        thread.join(5)
+        assert not thread.is_alive()
+
+    def test_build_once(self):
+        self._save(1, 2, 3)
+
+        history = load_history()
+        assert isinstance(history.zero, np.memmap)
+        assert history.zero.shape == (3, 349)
+        self.assert_matches_database(history)
+
+        assert load_history() is history
+        assert get_history().rebuilds == 1
+
+    def test_append_later_dates(self, django_capture_on_commit_callbacks):
+        self._save(1, 2)
+        load_history()
+
+        with django_capture_on_commit_callbacks(execute=True):
+            self._save(3, 4)
+
+        history = load_history()
+        assert get_history().rebuilds == 1
+        self.assert_matches_database(history)
+
+    def test_rebuild_on_earlier_date(self, django_capture_on_commit_callbacks):
+        self._save(3, 4)
+        load_history()
+
+        with django_capture_on_commit_callbacks(execute=True):
+            self._save(1)
+
+        history = load_history()
+        assert get_history().rebuilds == 2
+        self.assert_matches_database(history)
+
+    def test_rebuild_on_delete(self):
+        self._save(1, 2, 3)
+        load_history()
+        TreasuryData.objects.filter(date="2024-04-02").delete()
+
+        history = load_history()
+        assert get_history().rebuilds == 2
+        self.assert_matches_database(history)
+
+    def test_rebuild_on_version_change(self, mocker):
+        self._save(1, 2)
+        load_history()
+        mocker.patch.object(type(curve_engine), "revision", 2)
+
+        load_history()
+        assert get_history().rebuilds == 2
+
+    def test_rebuild_in_chunks(self, mocker):
+        mocker.patch("rates.history.REBUILD_CHUNK_SIZE", 2)
+        self._save(1, 2, 3, 4, 5)
+
+        self.assert_matches_database(load_history())
+
+
+class TestMetrics:
+    def test_histogram(self):
+        registry = Registry()
+        histogram = registry.histogram(
+            "test_seconds", "Test timings", ("span",), buckets=(0.1, 1)
+        )
+        histogram.observe(0.05, span="a")
+        histogram.observe(0.5, span="a")
+        histogram.observe(5, span="a")
+
+        assert registry.render().splitlines() == [
+            "# HELP test_seconds Test timings",
+            "# TYPE test_seconds histogram",
+            'test_seconds_bucket{span="a",le="0.1"} 1',
+            'test_seconds_bucket{span="a",le="1"} 2',
+            'test_seconds_bucket{span="a",le="+Inf"} 3',
+            'test_seconds_sum{span="a"} 5.55',
+            'test_seconds_count{span="a"} 3',
+        ]
+
+    def test_counter(self):
+        registry = Registry()
+        counter = registry.counter("test_total", "Test count", ("result",))
+        counter.inc(result='say "hi"')
+        counter.inc(2, result='say "hi"')
+
+        assert 'test_total{result="say \\"hi\\""} 3' in registry.render()
+        with pytest.raises(ValueError):
+            counter.inc(other="label")
+
+    def test_span(self):
+        count = span_seconds.count(span="test")
+        errors = span_errors.value(span="test")
+
+        with span("test"):
+            pass
+        with pytest.raises(KeyError), span("test"):
+            raise KeyError()
+
+        assert span_seconds.count(span="test") == count + 2
+        assert span_errors.value(span="test") == errors + 1
+
+    @pytest.mark.django_db
+    def test_endpoint(self, client, mock_get):
+        TreasuryData(date=date(2024, 4, 2)).save()
+
+        response = client.get("/rates/metrics/")
+
+        assert response.status_code == 200
+        assert response["Content-Type"].startswith("text/plain; version=0.0.4")
+        content = response.content.decode("utf-8")
+        for name in ("treasury_fetch", "csv_parse", "curve_compute"):
+            assert f'rates_span_seconds_count{{span="{name}"}}' in content
+        assert 'rates_treasury_lookups_total{result="downloaded"}' in content
+
+    @pytest.mark.django_db
+    def test_endpoint_restricted(self, client, admin_client, settings):
+        settings.METRICS_ALLOWED_NETWORKS = ("10.0.0.0/8",)
+
+        assert client.get("/rates/metrics/").status_code == 403
+        response = client.get("/rates/metrics/", REMOTE_ADDR="10.1.2.3")
+        assert response.status_code == 200
+        assert admin_client.get("/rates/metrics/").status_code == 200
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures("mock_get")
+class TestSummaryColumns:
+    def test_computed_on_save(self):
+        TreasuryData(date=date(2024, 4, 2)).save()
+
+        tdata = TreasuryData.objects.get()
+        assert tdata.ten_two_spread == -0.34
+        assert tdata.inverted is True
+        assert tdata.thirty_year_zero == pytest.approx(tdata.curve().zero[-1] * 100)
+
+    def test_computed_on_backfill(self):
+        call_command("backfill", "--start", "2024-04-01", "--end", "2024-04-05")
+
+        assert not TreasuryData.objects.filter(thirty_year_zero__isnull=True).exists()
+        assert TreasuryData.objects.filter(inverted=True).count() == 5
+
+    def test_rebuilt_with_curves(self):
+        TreasuryData(date=date(2024, 4, 2)).save()
+        TreasuryData.objects.update(thirty_year_zero=None)
+
+        call_command("rebuild_curves", "--all", stdout=StringIO())
+
+        assert TreasuryData.objects.get().thirty_year_zero is not None
+
+    def test_filled_after_migration(self):
+        TreasuryData(date=date(2024, 4, 2)).save()
+        TreasuryData.objects.update(
+            ten_two_spread=None, inverted=None, thirty_year_zero=None
+        )
+
+        call_command("rebuild_curves", stdout=StringIO())
+
+        tdata = TreasuryData.objects.get()
+        assert tdata.ten_two_spread == -0.34
+        assert tdata.thirty_year_zero is not None
+
+    def test_changelist(self, admin_client):
+        for day in (1, 2):
+            TreasuryData(date=date(2024, 4, day)).save()
+        TreasuryData.objects.filter(date="2024-04-01").update(
+            ten_two_spread=0.1, inverted=False
+        )
+
+        response = admin_client.get(
+            "/admin/rates/treasurydata/", {"inverted__exact": "1"}
+        )
+
+        assert response.status_code == 200
+        assert [tdata.date for tdata in response.context["cl"].result_list] == [
+            date(2024, 4, 2)
+        ]
+        assert "-0.34" in response.content.decode("utf-8")
+
+    def test_changelist_count_cached(self, admin_client):
+        TreasuryData(date=date(2024, 4, 1)).save()
+        admin_client.get("/admin/rates/treasurydata/")
+
+        with CaptureQueriesContext(connection) as queries:
+            admin_client.get("/admin/rates/treasurydata/")
+        assert not any("COUNT(" in query["sql"] for query in queries.captured_queries)
+
+        TreasuryData(date=date(2024, 4, 2)).save()
+        response = admin_client.get("/admin/rates/treasurydata/")
+        assert response.context["cl"].result_count == 2
+
+        TreasuryData.objects.filter(date="2024-04-02").delete()
+        response = admin_client.get("/admin/rates/treasurydata/")
+        assert response.context["cl"].result_count == 1
+
+    def test_generation_shared(self, settings):
+        settings.CACHES = SITE_CACHES
+        TreasuryData(date=date(2024, 4, 1)).save()
+        generation = treasury_generation()
+
+        # Another process starts with its own cache connections
+        assert CacheHandler()["default"].get(TREASURY_GENERATION_KEY) == generation
+        TreasuryData(date=date(2024, 4, 2)).save()
+        assert CacheHandler()["default"].get(TREASURY_GENERATION_KEY) > generation
@@ -0,0 +1,509 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from datetime import timezone as dt_timezone
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit
+
+import httpx
+import requests
+import requests.adapters
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rates.metrics import span, treasury_lookups
+
+REQUEST_TIMEOUT = 60
+
+CURRENT_MONTH_TREASURY_URL_TEMPLATE = "https://home.treasury.gov/resource-center/data-chart-center/interest-rates/daily-treasury-rates.csv/all/{year}{month}?type=daily_treasury_yield_curve&field_tdr_date_value_month={year}{month}&page&_format=csv"
+
+ANNUAL_TREASURY_URL_TEMPLATE = "https://home.treasury.gov/resource-center/data-chart-center/interest-rates/daily-treasury-rates.csv/{year}/all?type=daily_treasury_yield_curve&field_tdr_date_value={year}&page&_format=csv"
+
+DEFAULT_FETCHER = "rates.treasury.HTTPFetcher"
+DEFAULT_ASYNC_FETCHER = "rates.treasury.AsyncSessionFetcher"
+DEFAULT_CACHE_SIZE = 32
+DEFAULT_CURRENT_TTL = 300
+
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 10
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+DEFAULT_MAX_BACKOFF = 4
+DEFAULT_DEADLINE = 20
+DEFAULT_MAX_CONCURRENCY = 4
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+logger = logging.getLogger(__file__)
+
+FetchResult = namedtuple("FetchResult", "status,content,etag,last_modified")
+CacheEntry = namedtuple("CacheEntry", "content,etag,last_modified,fetched_at")
+
+
+class TreasuryPeriod(namedtuple("TreasuryPeriod", "year,month")):
+    """A single Treasury CSV download: a whole year, or one month when `month` is set."""
+
+    @classmethod
+    def for_date(cls, date, current_date=None):
+        if current_date is None:
+            current_date = timezone.now().date()
+
+        if current_date.month == date.month and current_date.year == date.year:
+            return cls(date.year, date.month)
+        return cls(date.year, None)
+
+    @property
+    def url(self):
+        if self.month is None:
+            return ANNUAL_TREASURY_URL_TEMPLATE.format(year=self.year)
+        return CURRENT_MONTH_TREASURY_URL_TEMPLATE.format(
+            year=self.year, month=f"{self.month:02}"
+        )
+
+    @property
+    def key(self):
+        if self.month is None:
+            return f"{self.year}"
+        return f"{self.year}{self.month:02}"
+
+    def is_final(self, current_date=None):
+        if current_date is None:
+            current_date = timezone.now().date()
+
+        if self.month is None:
+            return self.year < current_date.year
+        return (self.year, self.month) < (current_date.year, current_date.month)
+
+
+class HTTPFetcher:
+    def __call__(self, period, headers=None):
+        resp = requests.get(period.url, headers=headers, timeout=REQUEST_TIMEOUT)
+        return _fetch_result(resp)
+
+
+class SessionFetcher:
+    """Fetch Treasury CSVs over a pooled session, retrying transient failures.
+
+    Connection errors, timeouts and 429/5xx responses are retried up to
+    `retries` times with full-jitter exponential backoff, as long as the next
+    attempt starts within `deadline` seconds of the first. At most
+    `max_concurrency` requests are in flight per fetcher, however many
+    threads share it.
+    """
+
+    def __init__(
+        self,
+        connect_timeout=None,
+        read_timeout=None,
+        retries=None,
+        backoff=None,
+        max_backoff=None,
+        max_concurrency=None,
+        deadline=None,
+        base_url=None,
+    ):
+        self.timeout = (
+            _setting(
+                "TREASURY_CONNECT_TIMEOUT", connect_timeout, DEFAULT_CONNECT_TIMEOUT
+            ),
+            _setting("TREASURY_READ_TIMEOUT", read_timeout, DEFAULT_READ_TIMEOUT),
+        )
+        self.retries = _setting("TREASURY_RETRIES", retries, DEFAULT_RETRIES)
+        self.backoff = _setting("TREASURY_BACKOFF", backoff, DEFAULT_BACKOFF)
+        self.max_backoff = _setting(
+            "TREASURY_MAX_BACKOFF", max_backoff, DEFAULT_MAX_BACKOFF
+        )
+        self.max_concurrency = _setting(
+            "TREASURY_MAX_CONCURRENCY", max_concurrency, DEFAULT_MAX_CONCURRENCY
+        )
+        self.deadline = _setting("TREASURY_DEADLINE", deadline, DEFAULT_DEADLINE)
+        self.base_url = _setting("TREASURY_BASE_URL", base_url, None)
+        self._connect()
+
+    def _connect(self):
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.max_concurrency
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+
+    def __call__(self, period, headers=None):
+        url = self._url(period)
+        started = time.monotonic()
+        for attempt in range(self.retries + 1):
+            try:
+                with self._slots:
+                    resp = self.session.get(url, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            else:
+                if resp.status_code not in RETRY_STATUSES:
+                    return _fetch_result(resp)
+                error = requests.HTTPError(
+                    f"{resp.status_code} Error for url: {url}", response=resp
+                )
+
+            time.sleep(self._retry_delay(period, attempt, started, error))
+
+    def _retry_delay(self, period, attempt, started, error):
+        """Backoff before the next attempt, re-raising `error` if there is none."""
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+        if (
+            attempt == self.retries
+            or time.monotonic() - started + delay > self.deadline
+        ):
+            raise error
+
+        logger.warning(
+            f"Treasury request for {period.key} failed ({error}), "
+            f"retrying in {delay:.2f}s"
+        )
+        return delay
+
+    def _url(self, period):
+        if self.base_url is None:
+            return period.url
+        url = urlsplit(period.url)
+        base_url = urlsplit(self.base_url)
+        return urlunsplit(url._replace(scheme=base_url.scheme, netloc=base_url.netloc))
+
+
+class AsyncSessionFetcher(SessionFetcher):
+    """SessionFetcher for event loops, awaiting an httpx.AsyncClient.
+
+    Timeouts, retries, the deadline and the concurrency limit behave as in
+    SessionFetcher; httpx errors are raised instead of requests ones. An
+    AsyncClient is bound to the loop it was first used on, so one is kept
+    per running loop and closed when that loop shuts down.
+    """
+
+    def _connect(self):
+        self._clients = weakref.WeakKeyDictionary()
+        # Loading the CA bundle dominates creating a client, and under WSGI
+        # every request runs on a new loop
+        self._ssl_context = httpx.create_ssl_context()
+
+    async def _client(self):
+        loop = asyncio.get_running_loop()
+        entry = self._clients.get(loop)
+        if entry is None:
+            connect_timeout, read_timeout = self.timeout
+            client = httpx.AsyncClient(
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout, pool=None),
+                limits=httpx.Limits(max_connections=self.max_concurrency),
+                verify=self._ssl_context,
+            )
+            closer = _close_with_loop(client)
+            await closer.asend(None)
+            entry = self._clients[loop] = (client, closer)
+        return entry[0]
+
+    async def __call__(self, period, headers=None):
+        url = self._url(period)
+        started = time.monotonic()
+        for attempt in range(self.retries + 1):
+            try:
+                client = await self._client()
+                resp = await client.get(url, headers=headers)
+            except httpx.TransportError as e:
+                error = e
+            else:
+                if resp.status_code not in RETRY_STATUSES:
+                    return _fetch_result(resp)
+                error = httpx.HTTPStatusError(
+                    f"{resp.status_code} Error for url: {url}",
+                    request=resp.request,
+                    response=resp,
+                )
+
+            await asyncio.sleep(self._retry_delay(period, attempt, started, error))
+
+
+async def _close_with_loop(client):
+    # Suspended until the loop finalizes its async generators on shutdown
+    # (asyncio.run, asgiref's per-request loops, uvicorn), which closes the
+    # client's connections before the loop is gone
+    try:
+        yield
+    finally:
+        await client.aclose()
+
+
+def _fetch_result(resp):
+    if resp.status_code == 304:
+        return FetchResult(304, None, None, None)
+
+    resp.raise_for_status()
+    return FetchResult(
+        resp.status_code,
+        resp.content,
+        resp.headers.get("ETag"),
+        resp.headers.get("Last-Modified"),
+    )
+
+
+def _utc_date(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc).date()
+
+
+def _setting(name, value, default):
+    if value is not None:
+        return value
+    return getattr(settings, name, default)
+
+
+class LocalFetcher:
+    """Serve Treasury CSVs from `<directory>/<key>.csv` so nothing touches the network."""
+
+    def __init__(self, directory=None):
+        self.directory = Path(directory or settings.TREASURY_LOCAL_DIR)
+
+    def __call__(self, period, headers=None):
+        path = self.directory / f"{period.key}.csv"
+        try:
+            content = path.read_bytes()
+        except FileNotFoundError:
+            raise requests.HTTPError(f"No local Treasury data for {period.key}")
+        return FetchResult(200, content, None, None)
+
+
+class TreasuryCache:
+    def __init__(
+        self,
+        fetcher=None,
+        directory=None,
+        max_entries=None,
+        ttl=None,
+        async_fetcher=None,
+    ):
+        if fetcher is None:
+            fetcher = import_string(
+                getattr(settings, "TREASURY_FETCHER", DEFAULT_FETCHER)
+            )()
+        if directory is None:
+            directory = getattr(settings, "TREASURY_CACHE_DIR", None)
+
+        self.fetcher = fetcher
+        self._async_fetcher = async_fetcher
+        self.directory = Path(directory) if directory else None
+        self.max_entries = max_entries or getattr(
+            settings, "TREASURY_CACHE_SIZE", DEFAULT_CACHE_SIZE
+        )
+        self.ttl = (
+            ttl
+            if ttl is not None
+            else getattr(settings, "TREASURY_CACHE_TTL", DEFAULT_CURRENT_TTL)
+        )
+
+        self.lookups = 0
+        self.downloads = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, period, current_date=None):
+        entry, headers = self._lookup(period, current_date)
+        if headers is None:
+            return entry.content
+
+        with span("treasury_fetch"):
+            result = self.fetcher(period, headers=headers)
+        return self._update(period, entry, result)
+
+    async def aget(self, period, current_date=None):
+        """`get` for event loops, downloading with the async fetcher."""
+        entry, headers = self._lookup(period, current_date)
+        if headers is None:
+            return entry.content
+
+        with span("treasury_fetch"):
+            result = await self.async_fetcher(period, headers=headers)
+        return self._update(period, entry, result)
+
+    @property
+    def async_fetcher(self):
+        # Created on first use so sync-only processes never build a client
+        with self._lock:
+            if self._async_fetcher is None:
+                self._async_fetcher = import_string(
+                    getattr(settings, "TREASURY_ASYNC_FETCHER", DEFAULT_ASYNC_FETCHER)
+                )()
+            return self._async_fetcher
+
+    def _lookup(self, period, current_date):
+        """The cached entry and, when it has to be fetched, the request headers."""
+        self.lookups += 1
+        entry = self._get_entry(period)
+
+        # A download only stays valid for good if it was made after the period
+        # ended, otherwise it can be missing the period's last days
+        if entry is not None and (
+            time.time() - entry.fetched_at < self.ttl
+            or (
+                period.is_final(current_date)
+                and period.is_final(_utc_date(entry.fetched_at))
+            )
+        ):
+            treasury_lookups.inc(result="cached")
+            return entry, None
+
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        self.downloads += 1
+        return entry, headers
+
+    def _update(self, period, entry, result):
+        if result.status == 304 and entry is not None:
+            treasury_lookups.inc(result="revalidated")
+            entry = entry._replace(fetched_at=time.time())
+        else:
+            treasury_lookups.inc(result="downloaded")
+            entry = CacheEntry(
+                result.content, result.etag, result.last_modified, time.time()
+            )
+
+        self._set_entry(period, entry)
+        return entry.content
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _get_entry(self, period):
+        with self._lock:
+            entry = self._entries.get(period)
+            if entry is not None:
+                self._entries.move_to_end(period)
+                return entry
+
+        entry = self._read(period)
+        if entry is not None:
+            self._remember(period, entry)
+        return entry
+
+    def _set_entry(self, period, entry):
+        self._remember(period, entry)
+        self._write(period, entry)
+
+    def _remember(self, period, entry):
+        with self._lock:
+            self._entries[period] = entry
+            self._entries.move_to_end(period)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _paths(self, period):
+        return (
+            self.directory / f"{period.key}.csv",
+            self.directory / f"{period.key}.json",
+        )
+
+    def _read(self, period):
+        if self.directory is None:
+            return None
+
+        csv_path, meta_path = self._paths(period)
+        try:
+            meta = json.loads(meta_path.read_text())
+            content = csv_path.read_bytes()
+        except (FileNotFoundError, ValueError):
+            return None
+        return CacheEntry(
+            content, meta["etag"], meta["last_modified"], meta["fetched_at"]
+        )
+
+    def _write(self, period, entry):
+        if self.directory is None:
+            return
+
+        csv_path, meta_path = self._paths(period)
+        meta = {
+            "etag": entry.etag,
+            "last_modified": entry.last_modified,
+            "fetched_at": entry.fetched_at,
+        }
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            _atomic_write(csv_path, entry.content)
+            _atomic_write(meta_path, json.dumps(meta).encode("utf-8"))
+        except OSError as e:
+            logger.warning(f"Unable to persist Treasury data for {period.key}: {e}")
+
+
+def _atomic_write(path, content):
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = TreasuryCache()
+        return _cache
+
+
+def reset_cache():
+    global _cache
+
+    with _cache_lock:
+        _cache = None
+
+
+def treasury_csv(period, current_date=None):
+    return get_cache().get(period, current_date=current_date).decode("utf-8")
+
+
+async def atreasury_csv(period, current_date=None):
+    content = await get_cache().aget(period, current_date=current_date)
+    return content.decode("utf-8")
+
+
+def treasury_csvs(periods, current_date=None, max_workers=None):
+    """Fetch several periods in parallel, returning {period: csv text}."""
+    periods = list(dict.fromkeys(periods))
+    max_workers = _setting(
+        "TREASURY_MAX_CONCURRENCY", max_workers, DEFAULT_MAX_CONCURRENCY
+    )
+
+    with ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="rates-treasury"
+    ) as executor:
+        contents = executor.map(
+            lambda period: treasury_csv(period, current_date=current_date), periods
+        )
+        return dict(zip(periods, contents))
+
+
+@receiver(setting_changed)
+def _reset_cache_on_setting_change(setting, **kwargs):
+    if setting.startswith("TREASURY_"):
+        reset_cache()
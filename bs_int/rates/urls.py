@@ -0,0 +1,14 @@
+from django.urls import path
+from rates import api, views
+
+app_name = "rates"
+
+urlpatterns = [
+    path("chart/", views.chart, name="chart"),
+    path("metrics/", views.metrics, name="metrics"),
+    path("api/treasury/", api.treasury_list, name="api-treasury"),
+    path("api/curves/<str:date_str>/", api.curve_detail, name="api-curve"),
+    path("exports/<str:token>/", views.export_download, name="export-download"),
+    path("exports/<str:token>/status/", views.export_status, name="export-status"),
+    path("api/published/<str:date_str>/", views.published, name="api-published"),
+]
@@ -1,3 +1,260 @@
-# from django.shortcuts import render
+import functools
+import hashlib
+import ipaddress
+import logging
+import threading
+from datetime import date
 
-# Create your views here.
+import httpx
+from dateutil.parser import parse
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.views import redirect_to_login
+from django.core.exceptions import ValidationError
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseForbidden,
+    JsonResponse,
+)
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_GET
+from rates import workers
+from rates.charts import DEFAULT_CHART_SIZE, RenderCache, render_curves
+from rates.exports import export_cache
+from rates.metrics import registry
+from rates.models import ExportJob, TreasuryData, curve_engine, parse_treasury_table
+from rates.treasury import TreasuryPeriod, atreasury_csv
+
+logger = logging.getLogger(__file__)
+
+CHART_FORMATS = {
+    "png": "image/png",
+    "svg": "image/svg+xml",
+}
+MAX_CHART_DATES = 10
+# Sizes chart renders: the default and the admin's image_tag
+CHART_SIZES = frozenset((DEFAULT_CHART_SIZE, (600, 400)))
+DEFAULT_CHART_MAX_AGE = 24 * 60 * 60
+DEFAULT_CHART_MAX_RENDERS = 4
+
+chart_cache = RenderCache(getattr(settings, "CHART_CACHE_SIZE", 128))
+# Renders of uncached charts in progress per process; further requests get a
+# 503 rather than queueing more CPU work
+_render_slots = threading.BoundedSemaphore(
+    getattr(settings, "CHART_MAX_RENDERS", DEFAULT_CHART_MAX_RENDERS)
+)
+
+
+@receiver(setting_changed)
+def _reset_render_slots(setting, value, **kwargs):
+    global _render_slots
+
+    if setting == "CHART_MAX_RENDERS":
+        _render_slots = threading.BoundedSemaphore(value or DEFAULT_CHART_MAX_RENDERS)
+
+
+def _staff_member_required(view):
+    """staff_member_required for async views, which Django 5.0's does not wrap."""
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not (user.is_active and user.is_staff):
+            return redirect_to_login(request.get_full_path(), reverse("admin:login"))
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+class _ChartRequest:
+    def __init__(self, request):
+        try:
+            self.dates = sorted(
+                {parse(value).date() for value in request.GET["dates"].split(",")}
+            )
+            self.size = (
+                int(request.GET.get("width", DEFAULT_CHART_SIZE[0])),
+                int(request.GET.get("height", DEFAULT_CHART_SIZE[1])),
+            )
+        except (KeyError, ValueError, OverflowError) as e:
+            raise ValueError(f"Invalid chart request: {e}")
+
+        self.format = request.GET.get("format", "png")
+
+        if not 0 < len(self.dates) <= MAX_CHART_DATES:
+            raise ValueError(f"Between 1 and {MAX_CHART_DATES} dates are allowed")
+        if self.size not in CHART_SIZES:
+            raise ValueError(
+                "Chart size must be one of "
+                + ", ".join(
+                    f"{width}x{height}" for width, height in sorted(CHART_SIZES)
+                )
+            )
+        if self.format not in CHART_FORMATS:
+            raise ValueError(f"Format must be one of {', '.join(CHART_FORMATS)}")
+
+        self.tdatas = None
+
+    async def load(self):
+        queryset = (
+            TreasuryData.objects.filter(date__in=self.dates)
+            .select_related("stored_curve")
+            .order_by("date")
+        )
+        self.tdatas = [tdata async for tdata in queryset]
+        if len(self.tdatas) != len(self.dates):
+            raise Http404("Treasury data was not found for every date")
+
+    @property
+    def key(self):
+        return (tuple(self.dates), self.size, self.format)
+
+    def etag(self):
+        digest = hashlib.sha256(
+            repr(
+                (
+                    self.key,
+                    curve_engine.version,
+                    [
+                        tdata.par_values(curve_engine.bill_months)
+                        for tdata in self.tdatas
+                    ],
+                )
+            ).encode("utf-8")
+        )
+        return digest.hexdigest()
+
+
+@require_GET
+@_staff_member_required
+async def chart(request):
+    try:
+        chart_request = _ChartRequest(request)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    await chart_request.load()
+
+    etag = quote_etag(chart_request.etag())
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        key = (chart_request.key, etag)
+        content = chart_cache.get(key)
+        if content is None:
+            if not _render_slots.acquire(blocking=False):
+                response = HttpResponse("Too many charts rendering", status=503)
+                response["Retry-After"] = "1"
+                return response
+            try:
+                # Rendering is CPU bound, keep it off the event loop
+                content = await workers.arun(
+                    render_curves,
+                    [
+                        (f"{tdata.date}", tdata.curve())
+                        for tdata in chart_request.tdatas
+                    ],
+                    chart_request.format,
+                    chart_request.size,
+                )
+            finally:
+                _render_slots.release()
+            chart_cache.put(key, content)
+        response = HttpResponse(
+            content, content_type=CHART_FORMATS[chart_request.format]
+        )
+        response["ETag"] = etag
+
+    patch_cache_control(
+        response,
+        private=True,
+        max_age=getattr(settings, "CHART_MAX_AGE", DEFAULT_CHART_MAX_AGE),
+    )
+    return response
+
+
+@require_GET
+async def published(request, date_str):
+    """Par yields Treasury published for a date, whether or not it is stored.
+
+    The Treasury CSV is awaited through the shared cache, so under ASGI a slow
+    download does not hold a worker thread.
+    """
+    try:
+        published_date = date.fromisoformat(date_str)
+    except ValueError:
+        raise Http404(f"Invalid date {date_str}")
+    # Anonymous callers would otherwise have every year downloaded and cached
+    first_date = date(settings.TREASURY_FIRST_YEAR, 1, 1)
+    if not first_date <= published_date <= timezone.now().date():
+        raise Http404(f"Treasury has not published rates for {published_date}")
+
+    try:
+        content = await atreasury_csv(TreasuryPeriod.for_date(published_date))
+        table = parse_treasury_table(content)
+    except (httpx.HTTPError, ValidationError) as e:
+        logger.warning(f"Unable to load Treasury data for {published_date}: {e}")
+        return HttpResponse("Treasury data is unavailable", status=502)
+
+    if published_date not in table:
+        raise Http404(f"Treasury has not published rates for {published_date}")
+    return JsonResponse({"date": published_date, **table.row(published_date)})
+
+
+@require_GET
+@staff_member_required
+def export_status(request, token):
+    """Progress of the ExportJob `token`, polled by the admin's export page."""
+    job = get_object_or_404(ExportJob, token=token)
+    done = job.status == ExportJob.Status.DONE
+    return JsonResponse(
+        {
+            "status": job.status,
+            "progress": job.progress,
+            "total": job.total,
+            "error": job.error,
+            "download": (
+                reverse("rates:export-download", args=[token]) if done else None
+            ),
+        }
+    )
+
+
+@require_GET
+@staff_member_required
+def export_download(request, token):
+    job = get_object_or_404(ExportJob, token=token, status=ExportJob.Status.DONE)
+    # A hit keeps the file from being evicted as least recently used
+    output = export_cache.get(job.key, job.format)
+    if output is None:
+        raise Http404("The export was removed, please export it again")
+    return FileResponse(output, as_attachment=True, filename=job.download_filename)
+
+
+def _metrics_allowed(request):
+    if request.user.is_active and request.user.is_staff:
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get("REMOTE_ADDR", ""))
+    except ValueError:
+        return False
+    return any(
+        address in ipaddress.ip_network(network)
+        for network in settings.METRICS_ALLOWED_NETWORKS
+    )
+
+
+@require_GET
+def metrics(request):
+    if not _metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
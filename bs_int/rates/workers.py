@@ -0,0 +1,113 @@
+"""
+Bounded process pool for CPU heavy work: chart renders and Excel exports.
+
+Under ASGI a render running on the event loop, or holding the GIL in one of
+its threads, stalls every other request of the process. Work submitted here
+runs in CPU_POOL_WORKERS spawned processes instead; with 0 workers (the
+default) it runs in the caller's process as before.
+
+Functions and arguments are pickled, so submit module-level functions that
+take plain data or model instances.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+import django
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.dispatch import receiver
+from rates.metrics import span
+
+logger = logging.getLogger(__file__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker():
+    # Spawned workers start a fresh interpreter that inherits
+    # DJANGO_SETTINGS_MODULE and sys.path from the server
+    django.setup()
+
+
+def _call(func, *args):
+    # Pool processes outlive requests, so drop connections past CONN_MAX_AGE
+    # or left broken by an earlier task. Never run on the caller's thread,
+    # which may be inside a transaction.
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+def get_pool():
+    """The shared pool, or None when CPU_POOL_WORKERS is 0."""
+    global _pool
+
+    workers = getattr(settings, "CPU_POOL_WORKERS", 0)
+    if not workers:
+        return None
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        return _pool
+
+
+def reset_pool():
+    global _pool
+
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def run(func, *args):
+    """Call `func(*args)` in the pool, blocking until it returns."""
+    pool = get_pool()
+    if pool is None:
+        return func(*args)
+
+    with span("cpu_pool"), _restart_broken_pool():
+        return pool.submit(_call, func, *args).result()
+
+
+async def arun(func, *args):
+    """Await `func(*args)` in the pool, or in a thread when there is none."""
+    pool = get_pool()
+    if pool is None:
+        return await sync_to_async(func, thread_sensitive=False)(*args)
+
+    with span("cpu_pool"), _restart_broken_pool():
+        return await asyncio.wrap_future(pool.submit(_call, func, *args))
+
+
+@contextmanager
+def _restart_broken_pool():
+    try:
+        yield
+    except BrokenProcessPool:
+        # A worker died (OOM kill, segfault); start a new pool next time
+        logger.error("CPU pool is broken, restarting it")
+        reset_pool()
+        raise
+
+
+@receiver(setting_changed)
+def _reset_pool_on_setting_change(setting, **kwargs):
+    if setting == "CPU_POOL_WORKERS":
+        reset_pool()
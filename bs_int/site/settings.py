@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -40,7 +41,6 @@ INSTALLED_APPS = [
     "django_extensions",
     "bs_int.site",
     "bs_int.rates",
-    "silk",
 ]
 
 MIDDLEWARE = [
@@ -51,9 +51,28 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "silk.middleware.SilkyMiddleware",
 ]
 
+# django-silk stores every request it profiles, with its queries, in the
+# database. Enable it with SILK_ENABLED=1; SILK_INTERCEPT_PERCENT samples a
+# share of requests instead of all of them. rates.metrics (served at
+# /rates/metrics/) is the always-on, low overhead alternative.
+SILK_ENABLED = os.environ.get("SILK_ENABLED") == "1"
+# Clients served /rates/metrics/ without logging in as staff, for scrapers.
+# nginx refuses the path, so only services inside the deployment reach it
+# from these addresses.
+METRICS_ALLOWED_NETWORKS = (
+    "127.0.0.0/8",
+    "::1/128",
+    "10.0.0.0/8",
+    "172.16.0.0/12",
+    "192.168.0.0/16",
+)
+if SILK_ENABLED:
+    INSTALLED_APPS.append("silk")
+    MIDDLEWARE.append("silk.middleware.SilkyMiddleware")
+    SILKY_INTERCEPT_PERCENT = int(os.environ.get("SILK_INTERCEPT_PERCENT", 100))
+
 ROOT_URLCONF = "bs_int.site.urls"
 
 TEMPLATES = [
@@ -135,6 +154,83 @@ STATIC_ROOT = "/tmp/static"
 
 MEDIA_ROOT = "/tmp/media_root"
 
+# Raw Treasury CSV downloads, see rates.treasury
+TREASURY_CACHE_DIR = "/tmp/treasury_cache"
+TREASURY_CACHE_TTL = 300
+TREASURY_FETCHER = "rates.treasury.SessionFetcher"
+# Fetcher awaited by async views such as rates.views.published
+TREASURY_ASYNC_FETCHER = "rates.treasury.AsyncSessionFetcher"
+# rates.treasury.SessionFetcher: seconds to connect / between bytes read,
+# retries of failed requests, and requests in flight at once
+TREASURY_CONNECT_TIMEOUT = 3.05
+TREASURY_READ_TIMEOUT = 10
+TREASURY_RETRIES = 3
+TREASURY_MAX_CONCURRENCY = 4
+# Scheme and host to request Treasury CSVs from instead of home.treasury.gov
+TREASURY_BASE_URL = None
+# First year of daily par yield curves; rates.views.published answers 404
+# for dates before it (or after today) without fetching anything
+TREASURY_FIRST_YEAR = 1990
+
+# rates.api is for logged in users, each allowed API_THROTTLE_RATE requests
+# per API_THROTTLE_WINDOW seconds; more are answered with 429
+API_THROTTLE_RATE = 120
+API_THROTTLE_WINDOW = 60
+
+# Changelist counts and other values derived from TreasuryData, see
+# rates.models.treasury_generation. Kept in the database so every uwsgi
+# process and management command sees the same generation; create the table
+# with "manage.py createcachetable".
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "rates_cache",
+    }
+}
+
+# Interpolation method of the stored curves, one of rates.curves.CURVE_ENGINES.
+# Run the rebuild_curves command after changing it.
+CURVE_METHOD = "log_linear"
+# Curves of the other methods kept in memory per process
+CURVE_CACHE_SIZE = 1024
+
+# Memory-mapped (dates x months) curve matrices served by rates.history
+CURVE_HISTORY_DIR = "/tmp/curve_history"
+
+# Also store a PNG per TreasuryData in MEDIA_ROOT. The admin shows charts
+# rendered on request by rates.views.chart either way.
+STORE_CHARTS = True
+# Render stored charts on a background thread after the row is saved
+CHART_RENDER_ASYNC = True
+# Rendered charts kept in memory per process, and their Cache-Control max-age
+CHART_CACHE_SIZE = 128
+CHART_MAX_AGE = 24 * 60 * 60
+# Uncached chart renders in progress per process; more are answered with 503
+CHART_MAX_RENDERS = 4
+
+# rates.models.Excel copies the template workbook per sheet,
+# rates.models.WriteOnlyExcel streams sheets with openpyxl's write-only mode
+EXCEL_EXPORT_ENGINE = "rates.models.WriteOnlyExcel"
+
+# Processes rendering charts and building Excel exports, see rates.workers.
+# 0 keeps the work in the request's process.
+CPU_POOL_WORKERS = int(os.environ.get("CPU_POOL_WORKERS", 0))
+
+# Admin exports of more dates than this are queued as rates.models.ExportJob
+# and built by the run_export_jobs command instead of inside the request.
+# Running jobs that report no progress for EXPORT_JOB_STALE_AFTER seconds
+# are handed to another worker. Finished jobs and their files are removed
+# EXPORT_JOB_MAX_AGE seconds later.
+EXPORT_JOB_MIN_DATES = 50
+EXPORT_JOB_STALE_AFTER = 15 * 60
+EXPORT_JOB_MAX_AGE = 7 * 24 * 60 * 60
+# Excel and CSV zip downloads kept on disk by rates.exports.ExportCache,
+# least recently used first out once they take more than EXPORT_CACHE_SIZE bytes.
+# ExportJob files are stored here too; keep it out of MEDIA_ROOT, which nginx
+# serves without authentication.
+EXPORT_CACHE_DIR = "/tmp/export_cache"
+EXPORT_CACHE_SIZE = 512 * 1024 * 1024
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -22,9 +22,11 @@ from django.urls import include, path
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("rates/", include("rates.urls")),
 ]
 
-urlpatterns += [path("silk/", include("silk.urls", namespace="silk"))]
+if settings.SILK_ENABLED:
+    urlpatterns += [path("silk/", include("silk.urls", namespace="silk"))]
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
 admin.site.site_header = "Revantage Yield Curve Calculator"